@@ -33,6 +33,7 @@ argp.add_argument("-r","--rowMetadataID", dest = "sLastMetadataRow", default = N
 argp.add_argument("-f", "--delim", dest = "cFileDelimiter", action = "store", metavar = "File Delimiter", default = "\t", help = "File delimiter, default tab.") 
 argp.add_argument("-p", "--pipe", dest = "fPipe", action = "store_true", help = "If this flag is used, the input is read from standard in and wrote to standard out. When using this option please also specify the format to write in with -f.")
 argp.add_argument("-m", "--format", dest = "strFormat", choices = lsTypeChoices, action = "store", metavar = "save_format", default = None, help = "The file format to use when saving, this is not required unless using piping. When using file paths, file format will be assumed. If this is set, it takes priority over automatic guessing.")
+argp.add_argument("--cache", dest = "strCacheDirectory", action = "store", metavar = "Cache Directory", default = None, help = "Directory of a cache of parsed input files. Repeated reads of the same input file (with the same settings) are loaded from the cache. Not used when piping.")
 argp.add_argument("strFileAbund", metavar = "Abundance file", nargs = "?", help = "Input data file")
 argp.add_argument("strOutputFile", metavar = "Selection Output File", nargs = "?", help ="Output file")
 
@@ -69,7 +70,7 @@ if strOutputFileType is None:
   print( "Please provide a format to store the file as, using -f." )
 else:
   # Read in abundance table
-  abndTable = AbundanceTable.funcMakeFromFile(args.strFileAbund, cDelimiter=args.cFileDelimiter, sMetadataID=args.sID, sLastMetadataRow = args.sLastMetadataRow, sLastMetadata=args.sLastMetadataName, strFormat = strInputFileFormat)
+  abndTable = AbundanceTable.funcMakeFromFile(args.strFileAbund, cDelimiter=args.cFileDelimiter, sMetadataID=args.sID, sLastMetadataRow = args.sLastMetadataRow, sLastMetadata=args.sLastMetadataName, strFormat = strInputFileFormat, xCache = args.strCacheDirectory)
   if not abndTable:
     print("Could not create an abundance table from the given file and settings.")
   else:
@@ -19,7 +19,7 @@ import sys
 import re
 import os
 import numpy as np
-from breadcrumbs.src.AbundanceTable import AbundanceTable
+from breadcrumbs.src.AbundanceTable import AbundanceTable, c_strFilterPercentile, c_strFilterMinValue
 from breadcrumbs.src.ValidateData import ValidateData
 
 #Set up arguments reader
@@ -67,6 +67,7 @@ argp.add_argument("-x","--doPrefixClades", dest="fPrefixClades", action="store_t
 
 #Checked
 argp.add_argument("-o","--output", dest="strOutFile", action="store", default=None, help="Indicate output pcl file.")
+argp.add_argument("--cache", dest="strCacheDirectory", action="store", default=None, help="Directory of a cache of parsed input files. Repeated reads of the same input file (with the same settings) are loaded from the cache.")
 argp.add_argument("strFileAbund", help ="Input data file")
 
 args = argp.parse_args( )
@@ -86,7 +87,8 @@ abndTable = AbundanceTable.funcMakeFromFile(xInputFile=args.strFileAbund,
                                             sLastMetadata = args.sLastMetadataName,
                                             lOccurenceFilter = None,
                                             cFeatureNameDelimiter=args.cFeatureDelimiter,
-                                            xOutputFile = args.strOutFile)
+                                            xOutputFile = None if args.strCacheDirectory else args.strOutFile,
+                                            xCache = args.strCacheDirectory)
 
 #TODO Check filtering, can not have some filtering together
 
@@ -189,34 +191,29 @@ if args.fNormalize:
     else:
       print "ManipulateTable::"+abndTable.funcGetName()+" was NOT normalized."
 
-# Filter on percentile
+# Filter on percentile and abundance
+# Both filters are ran together in one pass over the data so the filter on percentile
+# is evaluated on the full distribution of features in a sample
+llFilters = []
+lsFilterNames = []
 if args.strFilterPercentile:
   dPercentile,dPercentage = args.strFilterPercentile.split(",")
-  for abndTable in lsTables:
-    if abndTable.funcIsNormalized():
-      fResult = abndTable.funcFilterAbundanceByPercentile(dPercentileCutOff = float(dPercentile), dPercentageAbovePercentile = float(dPercentage))
-      if fResult:
-        print "ManipulateTable::"+abndTable.funcGetName()+" has been reduced by percentile and now has "+str(len(abndTable.funcGetFeatureNames()))+" features."
-      else:
-        print "ManipulateTable::ERROR. "+abndTable.funcGetName()+" could not be reduced by percentile."
-    else:
-      print "ManipulateTable::"+abndTable.funcGetName()+" was NOT normalized and so the percentile filter is invalid, please indicate to normalize the table."
-
-# Filter on abundance (should go after filter on percentile because the filter on percentile 
-# needs the full distribution of features in a sample
+  llFilters.append([c_strFilterPercentile, {"dPercentileCutOff":float(dPercentile), "dPercentageAbovePercentile":float(dPercentage)}])
+  lsFilterNames.append("percentile")
 if args.strFilterAbundance:
   dAbundance,iMinSamples = args.strFilterAbundance.split(",")
-  dAbundance = float(dAbundance)
-  iMinSamples = int(iMinSamples)
+  llFilters.append([c_strFilterMinValue, {"dMinAbundance":float(dAbundance), "iMinSamples":int(iMinSamples)}])
+  lsFilterNames.append("minimum relative abundance value")
+if llFilters:
   for abndTable in lsTables:
     if abndTable.funcIsNormalized():
-      fResult = abndTable.funcFilterAbundanceByMinValue(dMinAbundance=dAbundance,iMinSamples=iMinSamples)
+      fResult = abndTable.funcApplyFilters(llFilters)
       if fResult:
-        print "ManipulateTable::"+abndTable.funcGetName()+" has been reduced by minimum relative abundance value and now has "+str(len(abndTable.funcGetFeatureNames()))+" features."
+        print "ManipulateTable::"+abndTable.funcGetName()+" has been reduced by "+" and ".join(lsFilterNames)+" and now has "+str(len(abndTable.funcGetFeatureNames()))+" features."
       else:
-        print "ManipulateTable::ERROR. "+abndTable.funcGetName()+" could not be reduced by percentile."
+        print "ManipulateTable::ERROR. "+abndTable.funcGetName()+" could not be reduced by "+" and ".join(lsFilterNames)+"."
     else:
-      print "ManipulateTable::"+abndTable.funcGetName()+" was NOT normalized and so the abundance filter is invalid, please indicate to normalize the table."
+      print "ManipulateTable::"+abndTable.funcGetName()+" was NOT normalized and so the "+" and ".join(lsFilterNames)+" filter is invalid, please indicate to normalize the table."
 
 #if args.dCuttOff:
 #  print "Standard deviation filtering not completed"
@@ -16,6 +16,7 @@ __status__ = "Development"
 import sys
 import argparse
 from breadcrumbs.src.AbundanceTable import AbundanceTable
+from breadcrumbs.src.ClassicalMDS import ClassicalMDS
 from breadcrumbs.src.Metric import Metric
 import csv
 import os
@@ -43,6 +44,8 @@ argp.add_argument("-p","--paint", dest="sLabel", metavar= "Label", default=None,
 argp.add_argument("-m","--metric", dest="strMetric", metavar = "distance", default = "braycurtis", help ="Distance metric to use default is braycurtis. Pick from braycurtis, canberra, chebyshev, cityblock, correlation, cosine, euclidean, hamming, spearman, sqeuclidean, unifrac_unweighted, unifrac_weighted")
 argp.add_argument("-o","--outputFile", dest="strOutFile", metavar= "outputFile", default=None, help="Specify the path for the output figure.")
 argp.add_argument("-D","--DistanceMatrix", dest="strFileDistanceMatrix", metavar= "strFileDistanceMatrix", default=None, help="Specify the path for outputing the distance matrix (if interested). Default this will not output.")
+argp.add_argument("--engine", dest="strEngine", default=PCoA.c_strEngineNMDS, choices=PCoA.lsEngines, help="Ordination engine, nmds (non-metric, default) or classical (metric PCoA by eigendecomposition, with the variance explained by each dimension).")
+argp.add_argument("--eigensolver", dest="strEigenSolver", default=ClassicalMDS.c_strEigenSolverDense, choices=ClassicalMDS.lsEigenSolvers, help="Eigen solver of the classical engine, dense (default), arpack or randomized (fastest for many samples, approximate).")
 argp.add_argument("-C","--CoordinatesMatrix", dest="strFileCoordinatesMatrix", metavar= "strFileCoordinatesMatrix", default=None, help="Specify the path for outputing the x,y coordinates matrix (Dim 1 and 2). Default this will not output.")
 
 # Visualization
@@ -58,6 +61,7 @@ argp.add_argument("-t","--unifracTree", dest="istrmTree", metavar="UnifracTreeFi
 argp.add_argument("-e","--unifracEnv", dest="istrmEnvr", metavar="UnifracEnvFile", default=None, help="Optional file only needed for UniFrac calculations.")
 argp.add_argument("-c","--unifracColor", dest="fileUnifracColor", metavar="UnifracColorFile", default = None, help="A text file indicating the groupings of metadata to color. Each line in the file is a group to color. An example file line would be  'GroupName:ID,ID,ID,ID'")
 
+argp.add_argument("--cache", dest="strCacheDirectory", metavar="CacheDirectory", default=None, help="Directory of a cache of parsed input files, distance matrices and ordinations. Repeated reads of the same input file (with the same settings) are loaded from the cache, as are the distances and ordination when rerunning on the same data, metric, normalization and summation (for example to paint other metadata).")
 argp.add_argument("strFileAbund", metavar = "Abundance file", nargs="?", help ="Input data file")
 args = argp.parse_args( )
 
@@ -74,7 +78,8 @@ if args.strFileAbund:
                              cDelimiter = args.cFileDelimiter,
                              sMetadataID = args.sIDName,
                              sLastMetadata = args.sLastMetadataName,
-                             cFeatureNameDelimiter= args.cFeatureNameDelimiter)
+                             cFeatureNameDelimiter= args.cFeatureNameDelimiter,
+                             xCache = args.strCacheDirectory)
 
   #Normalize if need
   if args.fDoSumData:
@@ -103,7 +108,7 @@ pcoa = PCoA()
 if(not args.strMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]) and abndTable:
   pcoa.loadData(abndTable,True)
 # Optional args.strFileDistanceMatrix if not none will force a printing of the distance measures to the path in args.strFileDistanceMatrix
-pcoa.run(tempDistanceMetric=args.strMetric, iDims=2, strDistanceMatrixFile=args.strFileDistanceMatrix, istrmTree=args.istrmTree, istrmEnvr=args.istrmEnvr)
+pcoa.run(tempDistanceMetric=args.strMetric, iDims=2, strDistanceMatrixFile=args.strFileDistanceMatrix, istrmTree=args.istrmTree, istrmEnvr=args.istrmEnvr, strEngine=args.strEngine, strEigenSolver=args.strEigenSolver, xCache=args.strCacheDirectory)
 
 # Write dim 1 and 2 coordinates to file
 if args.strFileCoordinatesMatrix:
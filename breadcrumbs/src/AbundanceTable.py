@@ -32,18 +32,30 @@ __maintainer__ = "Timothy Tickle"
 __email__ = "ttickle@sph.harvard.edu"
 __status__ = "Development"
 
+import atexit
 import csv
 import sys
 import blist
-from CClade import CClade
+from AbundanceTableCache import AbundanceTableCache
 from ConstantsBreadCrumbs import ConstantsBreadCrumbs
+from LineageIndex import LineageIndex
 import copy
-from datetime import date
+from datetime import date, datetime
+import json
+import mmap
 import numpy as np
 import os
 import re
+import scipy.sparse
 import scipy.stats
 import string
+import tempfile
+import weakref
+try:
+	import h5py
+except ImportError:
+	h5py = None
+from UtilityMath import UtilityMath
 from ValidateData import ValidateData
 from biom.parse import *
 from biom.table import *
@@ -54,6 +66,17 @@ c_dTarget	= 1.0
 c_fRound	= False
 c_iSumAllCladeLevels = -1
 c_fOutputLeavesOnly = False
+c_strFilterPercentile = "Percentile"
+c_strFilterMinValue = "MinValue"
+c_strFilterSequenceOccurence = "SequenceOccurence"
+c_strFilterSD = "SD"
+c_iTextBlockSize = 10000
+c_dSparseDensity = 0.25
+c_iRankBlockSize = 2**22
+c_strTransformRelative = "relative"
+c_strTransformCLR = "clr"
+c_strTransformArcsineSqrt = "arcsine_sqrt"
+c_lsTransforms = [c_strTransformRelative, c_strTransformCLR, c_strTransformArcsineSqrt]
 
 class RowMetadata:
 	"""
@@ -124,6 +147,1113 @@ class RowMetadata:
 		return lsMetadata
 
 
+class AbundanceMatrix:
+	"""
+	Columnar storage for abundance data.
+	Holds the measurements as a contiguous 2-D float matrix (Row=Features, Columns=Samples)
+	with the feature ids and sample ids kept in separate index arrays.
+	Can be given to an AbundanceTable in place of a structured array.
+
+	The matrix can be memory-mapped (numpy memmap) for tables larger than memory.
+	If a map directory is given, data derived from the matrix (for instance removing samples or features)
+	is written to new memory-mapped files in that directory instead of being held in memory.
+
+	The matrix can also be a sparse (scipy CSR) matrix for tables which are mostly zeros.
+	Sparse matrices are always held in memory.
+
+	Memory-mapped files made for the storage are removed when the matrix mapping them is freed,
+	when funcClose is called or when python exits.
+	"""
+
+	#Memory-mapped files made for storage {file path: weak reference to the matrix mapping the file}
+	dictMapFiles = dict()
+
+	def __init__(self, npaData, lsFeatureIDs, lsSampleIDs, strIDName, strMapDirectory = None):
+		""" Constructor requires the data matrix and the ids of its rows and columns.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D float array or scipy CSR matrix
+		:param	lsFeatureIDs:	Feature ids in the order of the rows of the data
+		:type:	List or numpy array of strings
+		:param	lsSampleIDs:	Sample ids in the order of the columns of the data
+		:type:	List of strings
+		:param	strIDName:	The name of the metadata that serves as the ID for the columns (For example a sample ID)
+		:type:	String
+		:param	strMapDirectory:	Directory to write memory-mapped files of derived data to, None holds derived data in memory.
+		:type:	String
+		"""
+
+		self.npaData = npaData
+		self.strMapDirectory = strMapDirectory
+		#The memory-mapped file made for this storage (None if the data is not held in one)
+		self.strMapFile = npaData.filename if isinstance(npaData, np.memmap) and ( npaData.filename in AbundanceMatrix.dictMapFiles ) else None
+		self.npaFeatureIDs = np.asarray(lsFeatureIDs) if len(lsFeatureIDs) else np.array([], dtype="S1")
+		self.lsSampleIDs = tuple(lsSampleIDs)
+		self.strIDName = strIDName
+		self.dictSampleIndex = dict([[sSample, iIndex] for iIndex, sSample in enumerate(self.lsSampleIDs)])
+
+	@staticmethod
+	def funcGetStructuredArrayAsMatrix(npaAbundance):
+		"""
+		Returns the measurements of a structured array (first field is the feature id) as a 2-D matrix.
+		When the measurement fields share a data type and are packed next to each other (as they are
+		when the structured array is read from a file) the matrix is a view on the structured array
+		and writing to it updates the structured array. Otherwise a copy is returned.
+
+		:param	npaAbundance:	Structured array of abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy structured array
+		:return	Numpy array:	2-D array (Row=Features, Columns=Samples)
+		"""
+
+		lsNames = npaAbundance.dtype.names
+		iSampleCount = len(lsNames) - 1
+		if iSampleCount < 1:
+			return np.zeros((npaAbundance.shape[0],0))
+
+		dtValue, iOffset = npaAbundance.dtype.fields[lsNames[1]][:2]
+		fPacked = True
+		for iIndex, sSample in enumerate(lsNames[1:]):
+			dtCur, iCurOffset = npaAbundance.dtype.fields[sSample][:2]
+			if ( dtCur != dtValue ) or ( iCurOffset != iOffset + ( iIndex * dtValue.itemsize ) ):
+				fPacked = False
+				break
+
+		if fPacked:
+			return np.lib.stride_tricks.as_strided(npaAbundance[lsNames[1]], shape=(npaAbundance.shape[0], iSampleCount),
+				strides=(npaAbundance.strides[0], dtValue.itemsize))
+		return np.array([list(tplRow)[1:] for tplRow in npaAbundance], dtype=dtValue).reshape((npaAbundance.shape[0], iSampleCount))
+
+	@staticmethod
+	def funcMakeStructuredArray(npaData, lsFeatureIDs, lsSampleIDs, strIDName, dtID = None, dtValue = None):
+		"""
+		Builds a structured array (ID field followed by one field per sample) from a 2-D matrix.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D float array
+		:param	lsFeatureIDs:	Feature ids in the order of the rows of the data
+		:type:	List or numpy array of strings
+		:param	lsSampleIDs:	Sample ids in the order of the columns of the data
+		:type:	List of strings
+		:param	strIDName:	The name of the id field
+		:type:	String
+		:param	dtID:	Data type of the id field, will be widened if the ids do not fit.
+		:type:	Numpy dtype
+		:param	dtValue:	Data type of the measurement fields, defaults to the type of the data (f4 if not a float type).
+		:type:	Numpy dtype
+		:return	Numpy structured array:	Abundance data (Row=Features, Columns=Samples)
+		"""
+
+		iLongestID = max([len(sID) for sID in lsFeatureIDs] or [1])
+		if ( dtID is None ) or ( dtID.itemsize < iLongestID ):
+			dtID = np.dtype("a" + str(iLongestID))
+		npaData = npaData.toarray() if scipy.sparse.issparse(npaData) else np.asarray(npaData)
+		if dtValue is None:
+			dtValue = npaData.dtype if npaData.dtype.kind == "f" else np.dtype("f4")
+		npaRet = np.zeros(len(lsFeatureIDs), dtype=np.dtype([(strIDName, dtID)] + [(sSample, dtValue) for sSample in lsSampleIDs]))
+		npaRet[strIDName] = lsFeatureIDs
+		if len(lsSampleIDs):
+			AbundanceMatrix.funcGetStructuredArrayAsMatrix(npaRet)[:] = npaData
+		return npaRet
+
+	@staticmethod
+	def funcMakeFromStructuredArray(npaAbundance):
+		"""
+		Makes columnar storage from a structured array (first field is the feature id).
+
+		:param	npaAbundance:	Structured array of abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy structured array
+		:return	AbundanceMatrix:	Columnar copy of the data.
+		"""
+
+		lsNames = npaAbundance.dtype.names
+		return AbundanceMatrix(npaData = np.array(AbundanceMatrix.funcGetStructuredArrayAsMatrix(npaAbundance)),
+			lsFeatureIDs = npaAbundance[lsNames[0]].copy(), lsSampleIDs = lsNames[1:], strIDName = lsNames[0])
+
+	def funcToStructuredArray(self):
+		"""
+		Returns a structured array copy of the data, as used by the default AbundanceTable storage.
+
+		:return	Numpy structured array:	Abundance data (Row=Features, Columns=Samples)
+		"""
+
+		return AbundanceMatrix.funcMakeStructuredArray(self.npaData, self.npaFeatureIDs, self.lsSampleIDs, self.strIDName)
+
+	def funcGetFeatureCount(self):
+		"""
+		Returns the count of features (rows).
+		"""
+
+		return self.npaData.shape[0]
+
+	def funcCompressFeatures(self, xFeatures):
+		"""
+		Returns a new AbundanceMatrix holding only the given features (rows).
+
+		:param	xFeatures:	Indices or boolean mask of the features to keep.
+		:type:	List or numpy array
+		:return	AbundanceMatrix:	Reduced copy
+		"""
+
+		xFeatures = np.asarray(xFeatures)
+		if not xFeatures.size:
+			xFeatures = np.array([], dtype=int)
+		elif xFeatures.dtype == bool:
+			xFeatures = np.flatnonzero(xFeatures)
+
+		if ( self.strMapDirectory is None ) or self.funcIsSparse():
+			npaData = self.npaData[xFeatures]
+		else:
+			#Copy in blocks of features so only the needed pages are read
+			npaData = self._funcMakeMatrix((len(xFeatures), self.npaData.shape[1]))
+			for iStart in xrange(0, len(xFeatures), c_iTextBlockSize):
+				npaData[iStart:iStart+c_iTextBlockSize] = self.npaData[xFeatures[iStart:iStart+c_iTextBlockSize]]
+		return AbundanceMatrix(npaData = npaData, lsFeatureIDs = self.npaFeatureIDs[xFeatures],
+			lsSampleIDs = self.lsSampleIDs, strIDName = self.strIDName, strMapDirectory = self.strMapDirectory)
+
+	def funcCompressSamples(self, lsSamples):
+		"""
+		Returns a new AbundanceMatrix holding only the given samples (columns) in the given order.
+
+		:param	lsSamples:	Sample ids to keep.
+		:type:	List of strings
+		:return	AbundanceMatrix:	Reduced copy
+		"""
+
+		liSamples = [self.dictSampleIndex[sSample] for sSample in lsSamples]
+		if ( self.strMapDirectory is None ) or self.funcIsSparse():
+			npaData = self.npaData[:,liSamples]
+		else:
+			#Copy in blocks of features so only a block is held in memory
+			npaData = self._funcMakeMatrix((self.npaData.shape[0], len(liSamples)))
+			for iStart in xrange(0, self.npaData.shape[0], c_iTextBlockSize):
+				npaData[iStart:iStart+c_iTextBlockSize] = self.npaData[iStart:iStart+c_iTextBlockSize][:,liSamples]
+		return AbundanceMatrix(npaData = npaData, lsFeatureIDs = self.npaFeatureIDs.copy(),
+			lsSampleIDs = lsSamples, strIDName = self.strIDName, strMapDirectory = self.strMapDirectory)
+
+	def funcIsMemoryMapped(self):
+		"""
+		Indicates if the data matrix is memory-mapped.
+
+		:return	Boolean:	True indicates a memory-mapped matrix.
+		"""
+
+		return isinstance(self.npaData, np.memmap)
+
+	def funcIsSparse(self):
+		"""
+		Indicates if the data matrix is a sparse (scipy CSR) matrix.
+
+		:return	Boolean:	True indicates a sparse matrix.
+		"""
+
+		return scipy.sparse.issparse(self.npaData)
+
+	def _funcMakeMatrix(self, tplShape, dtValue = None):
+		"""
+		Makes a new zeroed data matrix, memory-mapped to a new file in the map directory if one is given.
+
+		:param	tplShape:	Shape of the matrix (Features, Samples)
+		:type:	Tuple of integers
+		:param	dtValue:	Data type of the matrix, defaults to the data type of this matrix.
+		:type:	Numpy dtype
+		:return	Numpy array:	Matrix
+		"""
+
+		dtValue = self.npaData.dtype if dtValue is None else dtValue
+		#Empty files can not be mapped
+		if ( self.strMapDirectory is None ) or ( not tplShape[0] ) or ( not tplShape[1] ):
+			return np.zeros(tplShape, dtype = dtValue)
+		iFile, strFile = tempfile.mkstemp(prefix = "AbundanceTable-", suffix = ".dat", dir = self.strMapDirectory)
+		os.close(iFile)
+		return AbundanceMatrix.funcTrackMapFile(np.memmap(strFile, dtype = dtValue, mode = "w+", shape = tplShape))
+
+	@staticmethod
+	def funcTrackMapFile(npaMapped):
+		"""
+		Marks the file of a memory-mapped matrix as made for storage, it is removed when the matrix is freed.
+
+		:param	npaMapped:	Memory-mapped matrix
+		:type:	Numpy memmap
+		:return	Numpy memmap:	The matrix
+		"""
+
+		strFile = npaMapped.filename
+		AbundanceMatrix.dictMapFiles[strFile] = weakref.ref(npaMapped, lambda refMapped: AbundanceMatrix.funcRemoveMapFile(strFile))
+		return npaMapped
+
+	@staticmethod
+	def funcRemoveMapFile(strFile):
+		"""
+		Removes a memory-mapped file made for storage.
+		Matrices still mapping the file keep their data until they are freed (where the system allows removing open files).
+
+		:param	strFile:	Path of the file
+		:type:	String
+		"""
+
+		if AbundanceMatrix.dictMapFiles.pop(strFile, None) is None:
+			return
+		try:
+			os.remove(strFile)
+		except OSError:
+			pass
+
+	@staticmethod
+	def funcRemoveMapFiles():
+		"""
+		Removes all memory-mapped files made for storage (called when python exits).
+		"""
+
+		for strFile in AbundanceMatrix.dictMapFiles.keys():
+			AbundanceMatrix.funcRemoveMapFile(strFile)
+
+	def funcClose(self):
+		"""
+		Removes the memory-mapped file made for this storage, call when the storage is no longer used.
+		"""
+
+		if self.strMapFile is not None:
+			AbundanceMatrix.funcRemoveMapFile(self.strMapFile)
+			self.strMapFile = None
+
+	def funcMakeLike(self, npaData, lsFeatureIDs, lsSampleIDs):
+		"""
+		Returns a new AbundanceMatrix of the given data with the same map directory as this one.
+		If this matrix has a map directory the data is written to a new memory-mapped file.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D float array or scipy CSR matrix
+		:param	lsFeatureIDs:	Feature ids in the order of the rows of the data
+		:type:	List or numpy array of strings
+		:param	lsSampleIDs:	Sample ids in the order of the columns of the data
+		:type:	List of strings
+		:return	AbundanceMatrix:	New matrix
+		"""
+
+		if ( self.strMapDirectory is not None ) and ( not scipy.sparse.issparse(npaData) ):
+			npaMapped = self._funcMakeMatrix(npaData.shape, npaData.dtype)
+			npaMapped[:] = npaData
+			npaData = npaMapped
+		return AbundanceMatrix(npaData = npaData, lsFeatureIDs = lsFeatureIDs, lsSampleIDs = lsSampleIDs,
+			strIDName = self.strIDName, strMapDirectory = self.strMapDirectory)
+
+	def funcToMemoryMap(self, strMapDirectory):
+		"""
+		Returns a copy of this matrix memory-mapped to a new file in the given directory.
+		Data derived from the copy will also be written to memory-mapped files in the directory.
+		Sparse matrices are not memory-mapped and are copied as they are.
+
+		:param	strMapDirectory:	Directory to write the memory-mapped files to.
+		:type:	String
+		:return	AbundanceMatrix:	Memory-mapped copy
+		"""
+
+		abndmMapped = AbundanceMatrix(npaData = self.npaData, lsFeatureIDs = self.npaFeatureIDs,
+			lsSampleIDs = self.lsSampleIDs, strIDName = self.strIDName, strMapDirectory = strMapDirectory)
+		return abndmMapped.funcCompressFeatures(np.arange(self.npaData.shape[0]))
+
+	def funcToSparse(self):
+		"""
+		Returns a copy of this matrix with the data held in a sparse (CSR) matrix.
+		Memory-mapped data is converted a block of features at a time.
+
+		:return	AbundanceMatrix:	Sparse copy
+		"""
+
+		return AbundanceMatrix(npaData = AbundanceMatrix.funcMakeSparse(self.npaData), lsFeatureIDs = self.npaFeatureIDs.copy(),
+			lsSampleIDs = self.lsSampleIDs, strIDName = self.strIDName, strMapDirectory = self.strMapDirectory)
+
+	@staticmethod
+	def funcMakeSparse(npaData):
+		"""
+		Returns a sparse (CSR) copy of a matrix keeping its data type.
+		Dense data is converted a block of rows at a time so memory-mapped data is not read in all at once.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy sparse matrix
+		:return	Scipy CSR matrix:	Sparse copy of the data
+		"""
+
+		if scipy.sparse.issparse(npaData):
+			npaSparse = scipy.sparse.csr_matrix(npaData, copy = True)
+			npaSparse.sum_duplicates()
+			npaSparse.eliminate_zeros()
+			return npaSparse
+		if npaData.shape[0] <= c_iTextBlockSize:
+			return scipy.sparse.csr_matrix(npaData)
+		return scipy.sparse.vstack([scipy.sparse.csr_matrix(npaData[iStart:iStart+c_iTextBlockSize])
+			for iStart in xrange(0, npaData.shape[0], c_iTextBlockSize)], format = "csr")
+
+	@staticmethod
+	def funcGetDensity(npaData):
+		"""
+		Returns the fraction of the measurements which are not zero.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy sparse matrix
+		:return	Double:	Density between 0.0 and 1.0 (0.0 for an empty matrix)
+		"""
+
+		iSize = npaData.shape[0] * npaData.shape[1]
+		if not iSize:
+			return 0.0
+		if scipy.sparse.issparse(npaData):
+			return npaData.count_nonzero() / float(iSize)
+		iNonZero = 0
+		for iStart in xrange(0, npaData.shape[0], c_iTextBlockSize):
+			iNonZero += np.count_nonzero(npaData[iStart:iStart+c_iTextBlockSize])
+		return iNonZero / float(iSize)
+
+	@staticmethod
+	def funcToDense(npaData):
+		"""
+		Returns a dense copy of a matrix.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy sparse matrix
+		:return	Numpy array:	2-D copy of the data
+		"""
+
+		return npaData.toarray() if scipy.sparse.issparse(npaData) else np.array(npaData)
+
+	@staticmethod
+	def funcIterRows(npaData):
+		"""
+		Iterates over the rows of a matrix as dense 1-D arrays.
+		Rows of sparse matrices are expanded a block at a time.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy sparse matrix
+		:return	Generator:	Rows of the matrix
+		"""
+
+		if not scipy.sparse.issparse(npaData):
+			for npaRow in npaData:
+				yield npaRow
+			return
+		for iStart in xrange(0, npaData.shape[0], c_iTextBlockSize):
+			for npaRow in npaData[iStart:iStart+c_iTextBlockSize].toarray():
+				yield npaRow
+
+	@staticmethod
+	def _funcGetEntryRows(npaSparse):
+		"""
+		Returns the row index of each stored entry of a CSR matrix.
+		"""
+
+		return np.repeat(np.arange(npaSparse.shape[0]), np.diff(npaSparse.indptr))
+
+	@staticmethod
+	def funcCountAtLeast(npaData, xThreshold):
+		"""
+		Counts, for each row, the measurements greater than or equal to a threshold.
+		Zeros of sparse matrices are counted without being expanded.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy CSR matrix
+		:param	xThreshold:	Threshold for all measurements or one threshold per column (sample).
+		:type:	Double or numpy array of doubles
+		:return	Numpy array:	Count per row
+		"""
+
+		if not scipy.sparse.issparse(npaData):
+			return np.sum(npaData >= xThreshold, axis=1)
+
+		iRows, iColumns = npaData.shape
+		npaRows = AbundanceMatrix._funcGetEntryRows(npaData)
+		npaThreshold = np.asarray(xThreshold)
+		#Stored entries are compared directly, the zeros not stored pass in the columns where zero passes
+		if npaThreshold.ndim:
+			npaEntryThreshold = npaThreshold[npaData.indices]
+			iZeroPass = int(np.sum(0 >= npaThreshold))
+			npaStoredZeroPass = np.bincount(npaRows[0 >= npaEntryThreshold], minlength = iRows)
+		else:
+			npaEntryThreshold = npaThreshold
+			iZeroPass = iColumns if 0 >= npaThreshold else 0
+			npaStoredZeroPass = np.diff(npaData.indptr) if iZeroPass else 0
+		npaCount = np.bincount(npaRows[npaData.data >= npaEntryThreshold], minlength = iRows)
+		return npaCount + iZeroPass - npaStoredZeroPass
+
+	@staticmethod
+	def funcGetRowStandardDeviations(npaData):
+		"""
+		Returns the (population) standard deviation of each row.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy CSR matrix
+		:return	Numpy array:	Standard deviation per row
+		"""
+
+		if not scipy.sparse.issparse(npaData):
+			return np.std(npaData, axis=1)
+
+		iRows, iColumns = npaData.shape
+		npaRows = AbundanceMatrix._funcGetEntryRows(npaData)
+		npaMean = np.bincount(npaRows, weights = npaData.data, minlength = iRows) / float(iColumns)
+		npaDeviation = npaData.data - npaMean[npaRows]
+		#Squared deviations of the stored entries plus those of the zeros which are not stored
+		npaSquares = np.bincount(npaRows, weights = npaDeviation * npaDeviation, minlength = iRows)
+		npaSquares = npaSquares + ( iColumns - np.diff(npaData.indptr) ) * npaMean * npaMean
+		return np.sqrt(npaSquares / float(iColumns))
+
+	@staticmethod
+	def funcGetColumnPercentiles(npaData, dPercentile):
+		"""
+		Returns the score at a percentile of each column.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy sparse matrix
+		:param	dPercentile:	Percentile between 0.0 and 100.0
+		:type:	Double
+		:return	Numpy array:	Score per column
+		"""
+
+		if not scipy.sparse.issparse(npaData):
+			return scipy.stats.scoreatpercentile(npaData, dPercentile, axis=0)
+
+		#Expand one column at a time
+		npaColumns = npaData.tocsc()
+		npaScores = np.zeros(npaData.shape[1])
+		npaColumn = np.zeros(npaData.shape[0], dtype = npaData.dtype)
+		for iColumn in xrange(npaData.shape[1]):
+			iStart, iEnd = npaColumns.indptr[iColumn], npaColumns.indptr[iColumn+1]
+			npaColumn[:] = 0
+			npaColumn[npaColumns.indices[iStart:iEnd]] = npaColumns.data[iStart:iEnd]
+			npaScores[iColumn] = scipy.stats.scoreatpercentile(npaColumn, dPercentile)
+		return npaScores
+
+	@staticmethod
+	def funcGetColumnSums(npaData):
+		"""
+		Returns the sum of each column.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy CSR matrix
+		:return	Numpy array:	Sum per column
+		"""
+
+		if not scipy.sparse.issparse(npaData):
+			return np.sum(npaData, axis=0)
+		return np.bincount(npaData.indices, weights = npaData.data, minlength = npaData.shape[1])
+
+	@staticmethod
+	def funcTransformColumns(npaData, strTransform, dPseudoCount = None):
+		"""
+		Transforms each column (sample) of a float matrix in place, all columns at once.
+		c_strTransformRelative: Fraction of the column total (columns totaling zero or less are not changed).
+		c_strTransformCLR: Centered log-ratio, the log of each measurement less the mean log of its column.
+		Zeros are replaced by the pseudocount first. Dense matrices only.
+		c_strTransformArcsineSqrt: Arcsine of the square root of each measurement (relative abundance), values are clipped to 0.0 - 1.0.
+
+		:param	npaData:	Abundance data (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D float array or scipy CSR matrix
+		:param	strTransform:	Transform (c_strTransformRelative, c_strTransformCLR or c_strTransformArcsineSqrt)
+		:type:	String
+		:param	dPseudoCount:	Value replacing zeros before the centered log-ratio, defaults to half of the smallest positive measurement.
+		:type:	Double
+		:return	Matrix:	The data (transformed in place), False on error.
+		"""
+
+		fSparse = scipy.sparse.issparse(npaData)
+		if not strTransform in c_lsTransforms:
+			sys.stderr.write( "AbundanceMatrix::funcTransformColumns. Did not recognize transform " + str(strTransform) + ".\n" )
+			return False
+		if fSparse and ( strTransform == c_strTransformCLR ):
+			sys.stderr.write( "AbundanceMatrix::funcTransformColumns. The centered log-ratio can not be held in a sparse matrix.\n" )
+			return False
+
+		#Zero preserving transforms of sparse matrices act on the stored measurements
+		npaValues = npaData.data if fSparse else npaData
+		if strTransform == c_strTransformRelative:
+			npaTotals = AbundanceMatrix.funcGetColumnSums(npaData).astype(npaData.dtype)
+			npaTotals[~( npaTotals > 0.0 )] = 1.0
+			np.divide(npaValues, npaTotals[npaData.indices] if fSparse else npaTotals, out = npaValues)
+		elif strTransform == c_strTransformCLR:
+			npaZeros = npaData == 0
+			if dPseudoCount is None:
+				npaPositive = npaData[npaData > 0]
+				dPseudoCount = npaPositive.min() / 2.0 if len(npaPositive) else 1.0
+			npaData[npaZeros] = dPseudoCount
+			np.log(npaData, out = npaData)
+			npaData -= np.mean(npaData, axis=0)
+		else:
+			np.clip(npaValues, 0.0, 1.0, out = npaValues)
+			np.sqrt(npaValues, out = npaValues)
+			np.arcsin(npaValues, out = npaValues)
+		return npaData
+
+
+#Remove the memory-mapped storage files still held when python exits
+atexit.register(AbundanceMatrix.funcRemoveMapFiles)
+
+
+class TextBlockReader:
+	"""
+	Streams a delimited text abundance file (PCL) in blocks of features.
+	The metadata rows are read on construction, the data rows are parsed on iteration
+	in blocks of a fixed number of features straight into float arrays.
+	"""
+
+	def __init__(self, xInputFile, cDelimiter = ConstantsBreadCrumbs.c_cTab, sMetadataID = None, sLastMetadataRow = None, sLastMetadata = None,
+		ostmOutputFile = None, iBlockSize = c_iTextBlockSize):
+		"""
+		Constructor opens the file and reads the metadata rows.
+
+		:param	xInputFile:	File stream or path to input file.
+		:type:	String		File stream or string path.
+		:param	cDelimiter:	Delimiter for parsing the input file.
+		:type:	Character	Character.
+		:param	sMetadataID:	String ID that is a metadata row ID (found on the first column) and used as an ID for samples. 
+					If not given it is assumed to be position 0
+		:type: String		String ID
+		:param sLastMetadataRow: String ID that is the last row metadat id (id of the most right column with row/feature metadata)
+		:type:	String		String ID
+		:param	sLastMetadata:	The ID of the metadata that is the last metadata before measurement or feature rows.
+		:type:	String		String ID
+		:param	ostmOutputFile:	Output File to write to if needed. None does not write the file.
+		:type:	FileStream or String
+		:param	iBlockSize:	The number of features parsed in a block.
+		:type:	Integer
+		"""
+
+		self.xInputFile = xInputFile
+		self.iBlockSize = max(1, iBlockSize)
+		# Sample id row
+		self.namesRow = None
+		# Row metadata names
+		self.lsRowMetadataIDs = None
+		# Index of the last row metadata
+		self.iIndexLastMetadataRow = None
+		# Holds metadata {ID:[list of values]}
+		self.dictMetadata = dict()
+		# Holds row metadata { sID : [ list of values ] }, filled as the data rows are read
+		self.dictRowMetadata = {}
+		# Indicates an error occured while reading, reading stops on an error
+		self.fError = False
+
+		# Open file from a stream or file path
+		istmInput = open( xInputFile, 'rU' ) if isinstance(xInputFile, str) else xInputFile
+		self._iterRows = iter( csv.reader( istmInput, dialect = csv.excel_tab, delimiter = cDelimiter ) )
+		self._csvw = None
+		if ostmOutputFile:
+			self._csvw = csv.writer( open(ostmOutputFile,'w') if isinstance(ostmOutputFile, str) else ostmOutputFile, csv.excel_tab, delimiter = cDelimiter )
+
+		self._funcReadMetadata( sMetadataID, sLastMetadataRow, sLastMetadata )
+
+	def _funcReadMetadata(self, sMetadataID, sLastMetadataRow, sLastMetadata):
+		"""
+		Reads the metadata rows up to (and including) the last metadata or the first row if no last metadata is given.
+		"""
+
+		metadata = self.dictMetadata
+		for iIndex, lsLineElements in enumerate( self._iterRows ):
+			taxId, sampleReads = lsLineElements[0], lsLineElements[1:]
+
+			# Read in metadata values, if the entry is blank then give it the default empty metadata value.
+			for i, s in enumerate( sampleReads ):
+				if not s.strip( ):
+					sampleReads[i] = ConstantsBreadCrumbs.c_strEmptyDataMetadata
+
+			# If no id metadata (sample ids) is given then the first row is assumed to be the id row, otherwise look for the id for the metadata.
+			# Add the metadata to the containing dict
+			if ( ( not sMetadataID ) and ( iIndex == 0 ) ) or ( taxId == sMetadataID ):
+				self.namesRow = lsLineElements
+				# Remove the row metadata ids, these names are for the column ID and the samples ids
+				if sLastMetadataRow:
+					self.iIndexLastMetadataRow = lsLineElements.index(sLastMetadataRow)
+					self.lsRowMetadataIDs = self.namesRow[ 1 : self.iIndexLastMetadataRow + 1 ]
+					self.namesRow = [ self.namesRow[ 0 ] ] + self.namesRow[ self.iIndexLastMetadataRow + 1: ]
+
+					# If the sample metadata dictionary already has entries then remove the row metadata info from it.
+					if len( metadata ) and len( self.lsRowMetadataIDs ):
+						for sKey, lsValues in metadata.items():
+							metadata[ sKey ] = lsValues[ self.iIndexLastMetadataRow: ]
+
+			# Set the metadata without row metadata entries
+			metadata[taxId] = sampleReads[ self.iIndexLastMetadataRow: ] if (self.lsRowMetadataIDs and len( self.lsRowMetadataIDs )) else sampleReads
+
+			# If writing out the data write back out the line read in.
+			# This happens at the end so that the above cleaning is captured and written.
+			if self._csvw:
+				self._csvw.writerow( [taxId] + sampleReads )
+
+			# If the last metadata was just processed switch to data processing
+			# If the last metadata name is not given it is assumed that there is only one metadata
+			if ( not sLastMetadata ) or ( taxId == sLastMetadata ):
+				return
+
+	def funcGetSampleNames(self):
+		"""
+		Returns the sample names in the order of the columns of the data blocks.
+
+		:return	List:	List of string sample names, None if the sample id row was not found.
+		"""
+
+		return self.namesRow[1:] if self.namesRow else None
+
+	def funcGetIDMetadataName(self):
+		"""
+		Returns the metadata id (the name of the sample id row).
+
+		:return	String:	ID or None if the sample id row was not found.
+		"""
+
+		return self.namesRow[0] if self.namesRow else None
+
+	def funcIterBlocks(self):
+		"""
+		Iterates through the data rows in blocks of at most iBlockSize features.
+		Row metadata is collected in dictRowMetadata as the rows are read.
+		On a row that can not be parsed an error is logged, fError is set and iteration stops.
+
+		:return	Generator:	[List of feature ids, Numpy 2-D float array of the features' measurements (Row=Features, Columns=Samples)]
+		"""
+
+		iSampleCount = len( self.funcGetSampleNames() or [] )
+		iIndexLastMetadataRow = self.iIndexLastMetadataRow
+		lsRowMetadataIDs = self.lsRowMetadataIDs
+		lsFeatures = []
+		npaBlock = np.zeros( ( self.iBlockSize, iSampleCount ), dtype = "f4" )
+
+		for lsLineElements in self._iterRows:
+			taxId, sampleReads = lsLineElements[0], lsLineElements[1:]
+			try:
+				# Parse the sample reads, removing row metadata and storing row metadata if it exists
+				if lsRowMetadataIDs:
+					# Build expected dict for row metadata dictionary {string feature id: {'metadata': {metadatakey: [list of metadata values]}}}
+					dictFeature = dict([ [sID, [sKey]] for sID, sKey in zip( lsRowMetadataIDs, sampleReads[ 0 : iIndexLastMetadataRow ]) ])
+					if len( dictFeature ):
+						self.dictRowMetadata[ taxId ] = { ConstantsBreadCrumbs.c_metadata_lowercase: dictFeature }
+					lsReads = sampleReads[ iIndexLastMetadataRow: ]
+				else:
+					lsReads = sampleReads
+				npaBlock[ len( lsFeatures ) ] = [ ( float(s) if s.strip( ) else 0 ) for s in lsReads ]
+			except ValueError:
+				sys.stderr.write( "AbundanceTable:textToStructuredArray::Error, non-numerical value on data row. File:" + str(self.xInputFile) +
+					" Row:" + str(lsLineElements) + "\n" )
+				self.fError = True
+				return
+			lsFeatures.append( taxId )
+
+			if self._csvw:
+				self._csvw.writerow( lsLineElements )
+
+			if len( lsFeatures ) == self.iBlockSize:
+				yield [ lsFeatures, npaBlock ]
+				lsFeatures = []
+				npaBlock = np.zeros( ( self.iBlockSize, iSampleCount ), dtype = "f4" )
+
+		if lsFeatures:
+			yield [ lsFeatures, npaBlock[ : len( lsFeatures ) ] ]
+
+
+class BiomReader:
+	"""
+	Reads a BIOM file without building a biom Table.
+	JSON files (BIOM 1.0) are memory-mapped and scanned for their top level elements, the data element is parsed in one
+	vectorized step from the sparse (row, column, value) triplets or dense rows straight into numpy arrays.
+	Only the ids of the rows and columns are read with the file, their metadata are decoded when first requested.
+	HDF5 files (BIOM 2.x) are read when h5py is installed, the compressed sparse rows are used as they are stored.
+	The row and column descriptions (ids and metadata) of HDF5 files are only read when requested.
+	"""
+
+	#First bytes of an HDF5 file
+	c_strHDF5Signature = "\x89HDF\r\n\x1a\n"
+
+	#Finds the end of a non empty data element (the closing bracket of the last row and of the element)
+	c_reDataEnd = re.compile(r"\]\s*\]")
+
+	#A JSON string
+	c_strJSONString = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+	c_reString = re.compile(c_strJSONString)
+
+	#A JSON string or a number or literal (anything up to the next separator)
+	c_reScalar = re.compile(c_strJSONString + r'|[^\s,\]}]+')
+
+	#Size in bytes of the blocks of JSON text scanned at once for the end of a value
+	c_iScanBlockSize = 2**22
+
+	#The id of a row or column description written as its first element (as BIOM tools write them)
+	c_reDescriptionID = re.compile(r'\{\s*"id"\s*:\s*(' + c_strJSONString + r')')
+
+	def __init__(self, xInputFile):
+		"""
+		Constructor reads the file.
+
+		:param	xInputFile:	File stream or path to the BIOM file.
+		:type:	String		File stream or string path.
+		"""
+
+		self.xInputFile = xInputFile
+		# Indicates an error occured while reading
+		self.fError = False
+		# Top level elements of the file other than the data, rows and columns {key: value}
+		self.dictFileInfo = dict()
+		# Measurements (Row=Features, Columns=Samples), a numpy array for dense JSON files else a scipy CSR matrix
+		self.npaData = None
+		# Row and column descriptions as in BIOM JSON [{"id": id, "metadata": {key: value} or None}]
+		self._ldictRows = None
+		self._ldictColumns = None
+		# Row and column ids as in the file
+		self._lsRowIDs = None
+		self._lsColumnIDs = None
+		# JSON text (memory-mapped for files) and the [start, end, object positions] of the row and column descriptions in it
+		# Kept until the descriptions are decoded
+		self._strText = None
+		self._dictDescriptionSpans = dict()
+
+		strPath = xInputFile if isinstance(xInputFile, str) else getattr(xInputFile, "name", None)
+		try:
+			if strPath and os.path.isfile(strPath) and BiomReader.funcIsHDF5(strPath):
+				self._funcReadHDF5(strPath)
+			elif isinstance(xInputFile, str) and os.path.getsize(xInputFile):
+				with open(xInputFile, "rb") as hndlFile:
+					self._funcReadJSON(mmap.mmap(hndlFile.fileno(), 0, access = mmap.ACCESS_READ))
+			else:
+				istmInput = open(xInputFile, 'rU') if isinstance(xInputFile, str) else xInputFile
+				self._funcReadJSON(istmInput.read())
+		except Exception as e:
+			sys.stderr.write("BiomReader::Error, could not read BIOM file. File:" + str(xInputFile) + ". " + str(e) + "\n")
+			self.fError = True
+
+	@staticmethod
+	def funcIsHDF5(strPath):
+		"""
+		Indicates if a file is an HDF5 (BIOM 2.x) file.
+
+		:param	strPath:	Path to the file
+		:type:	String
+		:return	Boolean:	True if the file starts with the HDF5 signature.
+		"""
+
+		with open(strPath, "rb") as hndlFile:
+			return hndlFile.read(len(BiomReader.c_strHDF5Signature)) == BiomReader.c_strHDF5Signature
+
+	def _funcReadJSON(self, strText):
+		"""
+		Reads the top level elements of a BIOM JSON document.
+		The data is parsed with numpy, the rows and columns are only scanned for their ids,
+		the other elements are decoded with the json module.
+
+		:param	strText:	JSON document
+		:type:	String or mmap
+		"""
+
+		funcSkip = lambda iIndex: json.decoder.WHITESPACE.match(strText, iIndex).end()
+		dictElements = dict()
+		strData = None
+
+		iIndex = funcSkip(0)
+		if strText[iIndex:iIndex+1] != "{":
+			raise ValueError("the file is not a JSON object")
+		iIndex = funcSkip(iIndex+1)
+		while strText[iIndex:iIndex+1] != "}":
+			mtchKey = BiomReader.c_reString.match(strText, iIndex)
+			if not mtchKey:
+				raise ValueError("expected a key at position " + str(iIndex))
+			sKey = json.loads(mtchKey.group(0))
+			iIndex = funcSkip(mtchKey.end())
+			if strText[iIndex:iIndex+1] != ":":
+				raise ValueError("expected : at position " + str(iIndex))
+			iIndex = funcSkip(iIndex+1)
+
+			if sKey == ConstantsBreadCrumbs.c_strBiomDataKey and strText[iIndex:iIndex+1] == "[":
+				# The data is only numbers and brackets, find its end without decoding it
+				iStart = iIndex
+				if strText[funcSkip(iIndex+1):funcSkip(iIndex+1)+1] == "]":
+					iIndex = funcSkip(iIndex+1)+1
+				else:
+					mtchEnd = BiomReader.c_reDataEnd.search(strText, iIndex)
+					if not mtchEnd:
+						raise ValueError("the data element is not closed")
+					iIndex = mtchEnd.end()
+				strData = strText[iStart:iIndex]
+			elif sKey in (ConstantsBreadCrumbs.c_rows, ConstantsBreadCrumbs.c_columns) and strText[iIndex:iIndex+1] == "[":
+				# Only the span of the descriptions is kept, they are decoded when requested
+				iEnd, npaStarts = BiomReader._funcFindValueEnd(strText, iIndex, fObjectStarts = True)
+				self._dictDescriptionSpans[sKey] = [iIndex, iEnd, npaStarts]
+				dictElements.pop(sKey, None)
+				iIndex = iEnd
+			else:
+				iEnd = BiomReader._funcFindValueEnd(strText, iIndex)
+				dictElements[sKey] = json.loads(strText[iIndex:iEnd])
+				iIndex = iEnd
+				self._dictDescriptionSpans.pop(sKey, None)
+
+			iIndex = funcSkip(iIndex)
+			if strText[iIndex:iIndex+1] == ",":
+				iIndex = funcSkip(iIndex+1)
+			elif strText[iIndex:iIndex+1] != "}":
+				raise ValueError("expected , or } at position " + str(iIndex))
+
+		self._strText = strText
+		self._lsRowIDs = self._funcReadDescriptionIDs(ConstantsBreadCrumbs.c_rows, dictElements)
+		self._lsColumnIDs = self._funcReadDescriptionIDs(ConstantsBreadCrumbs.c_columns, dictElements)
+		if ConstantsBreadCrumbs.c_strBiomDataKey in dictElements:
+			strData = json.dumps(dictElements.pop(ConstantsBreadCrumbs.c_strBiomDataKey))
+		self.dictFileInfo = dictElements
+
+		tShape = (len(self._lsRowIDs), len(self._lsColumnIDs))
+		fSparse = dictElements.get(ConstantsBreadCrumbs.c_MatrixTtype, ConstantsBreadCrumbs.c_strSparseMatrixType) == ConstantsBreadCrumbs.c_strSparseMatrixType
+		npaValues = BiomReader._funcParseNumbers(strData or "[]")
+		if fSparse:
+			if npaValues.shape[0] % 3:
+				raise ValueError("the sparse data are not (row, column, value) triplets")
+			npaValues = npaValues.reshape(-1, 3)
+			self.npaData = scipy.sparse.coo_matrix((npaValues[:,2], (npaValues[:,0].astype(int), npaValues[:,1].astype(int))),
+				shape = tShape).tocsr()
+			self.npaData.sum_duplicates()
+		else:
+			if npaValues.shape[0] != tShape[0] * tShape[1]:
+				raise ValueError("the dense data do not match the number of rows and columns")
+			self.npaData = npaValues.reshape(tShape)
+
+	@staticmethod
+	def _funcFindValueEnd(strText, iIndex, fObjectStarts = False):
+		"""
+		Finds the end of the JSON value starting at a position without decoding it.
+		Arrays and objects are scanned with numpy a block of text at a time,
+		the brackets outside of strings are counted until the first bracket is closed.
+
+		:param	strText:	JSON document
+		:type:	String or mmap
+		:param	iIndex:	Position of the first character of the value
+		:type:	Integer
+		:param	fObjectStarts:	Also return the positions of the objects directly in the (array) value
+		:type:	Boolean
+		:return	Integer:	Position after the last character of the value (and the numpy array of object positions if requested)
+		"""
+
+		if strText[iIndex:iIndex+1] not in ("[", "{"):
+			mtchValue = BiomReader.c_reScalar.match(strText, iIndex)
+			if not mtchValue:
+				raise ValueError("expected a value at position " + str(iIndex))
+			return ( mtchValue.end(), np.zeros(0, dtype = int) ) if fObjectStarts else mtchValue.end()
+
+		lnpaStarts = list()
+		iDepth = 0
+		fInString = False
+		for iBlock in xrange(iIndex, len(strText), BiomReader.c_iScanBlockSize):
+			npaText = np.frombuffer(strText, dtype = np.uint8, count = min(BiomReader.c_iScanBlockSize, len(strText) - iBlock), offset = iBlock)
+
+			# Only quotes and brackets are looked at ("[" and "{" differ by bit 32 as do "]" and "}")
+			npaCase = npaText | 32
+			npaOpen = npaCase == ord("{")
+			npaClose = npaCase == ord("}")
+			npaQuote = npaText == ord('"')
+			npaPositions = np.flatnonzero(npaOpen | npaClose | npaQuote)
+			npaChars = npaText[npaPositions]
+
+			# Quotes start and end strings unless escaped by an odd number of backslashes
+			npaQuote = npaChars == ord('"')
+			npaAfterBackslash = np.flatnonzero(npaQuote & ( npaPositions > 0 ))
+			npaAfterBackslash = npaAfterBackslash[npaText[npaPositions[npaAfterBackslash] - 1] == ord("\\")]
+			if len(npaPositions) and npaPositions[0] == 0 and npaQuote[0] and iBlock > iIndex and strText[iBlock-1] == "\\":
+				npaAfterBackslash = np.concatenate([[0], npaAfterBackslash])
+			for iQuote in npaAfterBackslash:
+				iBackslash = iBlock + npaPositions[iQuote]
+				while strText[iBackslash-1:iBackslash] == "\\":
+					iBackslash -= 1
+				npaQuote[iQuote] = not ( iBlock + npaPositions[iQuote] - iBackslash ) % 2
+			npaInString = ( np.cumsum(npaQuote, dtype = np.int64) + fInString ) % 2 == 1
+			fInString = bool(npaInString[-1]) if len(npaInString) else fInString
+
+			npaDelta = npaOpen[npaPositions].astype(np.int64) - npaClose[npaPositions]
+			npaDelta[npaInString] = 0
+			npaDepth = np.cumsum(npaDelta) + iDepth
+			if fObjectStarts:
+				lnpaStarts.append(npaPositions[( npaChars == ord("{") ) & ( npaDelta == 1 ) & ( npaDepth == 2 )] + iBlock)
+			npaClosed = np.flatnonzero(npaDepth == 0)
+			if len(npaClosed):
+				iEnd = iBlock + npaPositions[npaClosed[0]] + 1
+				if not fObjectStarts:
+					return iEnd
+				npaStarts = np.concatenate(lnpaStarts)
+				return iEnd, npaStarts[npaStarts < iEnd]
+			iDepth = npaDepth[-1] if len(npaDepth) else iDepth
+		raise ValueError("the value at position " + str(iIndex) + " is not closed")
+
+	def _funcReadDescriptionIDs(self, strKey, dictElements):
+		"""
+		Reads the ids of the rows or columns of a BIOM JSON document.
+		Scanned descriptions are only searched for their ids, else the decoded descriptions are kept.
+
+		:param	strKey:	"rows" or "columns"
+		:type:	String
+		:param	dictElements:	Decoded top level elements, holds the descriptions if they were not scanned
+		:type:	Dictionary
+		:return	List:	Ids in the order of the descriptions
+		"""
+
+		if strKey in self._dictDescriptionSpans:
+			lsIDs = list()
+			for iStart in self._dictDescriptionSpans[strKey][2]:
+				mtchID = BiomReader.c_reDescriptionID.match(self._strText, iStart)
+				if not mtchID:
+					break
+				lsIDs.append(mtchID.group(1))
+			else:
+				return json.loads("[" + ",".join(lsIDs) + "]")
+			dictElements[strKey] = self._funcDecodeDescriptions(strKey)
+
+		ldictDescriptions = dictElements.pop(strKey, None) or []
+		if strKey == ConstantsBreadCrumbs.c_rows:
+			self._ldictRows = ldictDescriptions
+		else:
+			self._ldictColumns = ldictDescriptions
+		return [dictDescription.get(ConstantsBreadCrumbs.c_id_lowercase) for dictDescription in ldictDescriptions]
+
+	def _funcDecodeDescriptions(self, strKey):
+		"""
+		Decodes the scanned row or column descriptions of a BIOM JSON document.
+		The JSON text is released once no descriptions are left to decode.
+
+		:param	strKey:	"rows" or "columns"
+		:type:	String
+		:return	List:	[{"id": id, "metadata": {key: value} or None}]
+		"""
+
+		iStart, iEnd, npaStarts = self._dictDescriptionSpans.pop(strKey)
+		ldictDescriptions = json.loads(self._strText[iStart:iEnd])
+		if not self._dictDescriptionSpans:
+			self._strText = None
+		return ldictDescriptions
+
+	@staticmethod
+	def _funcParseNumbers(strData):
+		"""
+		Parses the numbers of a JSON array of numbers (nested arrays are flattened in order).
+
+		:param	strData:	JSON array
+		:type:	String
+		:return	Numpy array:	Float array of the numbers
+		"""
+
+		strNumbers = strData.translate(string.maketrans("[]", "  ")).strip()
+		if not strNumbers:
+			return np.zeros(0)
+		npaValues = np.fromstring(strNumbers, sep=",")
+		# fromstring stops at the first value it can not parse, check all values were read
+		if npaValues.shape[0] != strNumbers.count(",") + 1:
+			npaValues = np.array(json.loads("[" + strNumbers + "]"), dtype = float)
+		return npaValues
+
+	def _funcReadHDF5(self, strPath):
+		"""
+		Reads the file information, ids and measurements of a BIOM 2.x HDF5 file.
+		"""
+
+		if h5py is None:
+			raise ValueError("h5py is needed to read HDF5 BIOM files")
+
+		with h5py.File(strPath, "r") as hndlH5:
+			dictAttributes = hndlH5.attrs
+			funcDecode = lambda x: x.decode("utf-8") if isinstance(x, str) else x
+			lsVersion = [str(i) for i in dictAttributes.get("format-version", [])]
+			self.dictFileInfo = {ConstantsBreadCrumbs.c_strIDKey: funcDecode(dictAttributes.get("id")),
+				ConstantsBreadCrumbs.c_strFormatKey: "Biological Observation Matrix " + ".".join(lsVersion),
+				ConstantsBreadCrumbs.c_strFormatUrl: funcDecode(dictAttributes.get("format-url")),
+				ConstantsBreadCrumbs.c_strTypekey: funcDecode(dictAttributes.get("type")),
+				ConstantsBreadCrumbs.c_GeneratedBy: funcDecode(dictAttributes.get("generated-by")),
+				ConstantsBreadCrumbs.c_strDateKey: funcDecode(dictAttributes.get("creation-date")),
+				ConstantsBreadCrumbs.c_MatrixTtype: ConstantsBreadCrumbs.c_strSparseMatrixType}
+			self._lsRowIDs = [funcDecode(s) for s in hndlH5["observation/ids"][:].tolist()]
+			self._lsColumnIDs = [funcDecode(s) for s in hndlH5["sample/ids"][:].tolist()]
+			grpMatrix = hndlH5["observation/matrix"]
+			self.npaData = scipy.sparse.csr_matrix((grpMatrix["data"][:].astype(float), grpMatrix["indices"][:], grpMatrix["indptr"][:]),
+				shape = (len(self._lsRowIDs), len(self._lsColumnIDs)))
+		self.npaData.sum_duplicates()
+
+	def _funcReadHDF5Descriptions(self, strAxis, lsIDs):
+		"""
+		Reads the ids and metadata of the rows ("observation") or columns ("sample") of a BIOM 2.x HDF5 file.
+		Two dimensional metadata (for example taxonomy) are read as lists of their non empty values.
+
+		:return	List:	[{"id": id, "metadata": {key: value} or None}]
+		"""
+
+		funcDecode = lambda x: x.decode("utf-8") if isinstance(x, str) else x
+		strPath = self.xInputFile if isinstance(self.xInputFile, str) else self.xInputFile.name
+		dictMetadata = dict()
+		with h5py.File(strPath, "r") as hndlH5:
+			grpMetadata = hndlH5.get(strAxis + "/metadata")
+			for sKey in ( grpMetadata.keys() if grpMetadata is not None else [] ):
+				lxValues = grpMetadata[sKey][:].tolist()
+				if len(grpMetadata[sKey].shape) > 1:
+					dictMetadata[funcDecode(sKey)] = [[funcDecode(x) for x in lx if x not in ("", None)] for lx in lxValues]
+				else:
+					dictMetadata[funcDecode(sKey)] = [funcDecode(x) for x in lxValues]
+		return [{ConstantsBreadCrumbs.c_id_lowercase: sID,
+			ConstantsBreadCrumbs.c_metadata_lowercase: dict([[sKey, lxValues[iIndex]] for sKey, lxValues in dictMetadata.items()]) if dictMetadata else None}
+			for iIndex, sID in enumerate(lsIDs)]
+
+	def funcGetRowIDs(self):
+		"""
+		Returns the row (feature) ids in the order of the rows of the data.
+
+		:return	List:	Ids as read from the file
+		"""
+
+		return self._lsRowIDs
+
+	def funcGetColumnIDs(self):
+		"""
+		Returns the column (sample) ids in the order of the columns of the data.
+
+		:return	List:	Ids as read from the file
+		"""
+
+		return self._lsColumnIDs
+
+	def funcGetRows(self):
+		"""
+		Returns the row descriptions, read on the first request.
+
+		:return	List:	[{"id": id, "metadata": {key: value} or None}]
+		"""
+
+		if self._ldictRows is None:
+			if ConstantsBreadCrumbs.c_rows in self._dictDescriptionSpans:
+				self._ldictRows = self._funcDecodeDescriptions(ConstantsBreadCrumbs.c_rows)
+			else:
+				self._ldictRows = self._funcReadHDF5Descriptions("observation", self._lsRowIDs)
+		return self._ldictRows
+
+	def funcGetColumns(self):
+		"""
+		Returns the column descriptions, read on the first request.
+
+		:return	List:	[{"id": id, "metadata": {key: value} or None}]
+		"""
+
+		if self._ldictColumns is None:
+			if ConstantsBreadCrumbs.c_columns in self._dictDescriptionSpans:
+				self._ldictColumns = self._funcDecodeDescriptions(ConstantsBreadCrumbs.c_columns)
+			else:
+				self._ldictColumns = self._funcReadHDF5Descriptions("sample", self._lsColumnIDs)
+		return self._ldictColumns
+
+	def funcHasRowMetadata(self):
+		"""
+		Indicates if the rows have metadata (judged on the first row as the file is written).
+		Only the first row description of a JSON file is decoded if the rows were not requested yet.
+
+		:return	Boolean:	True if the first row has metadata.
+		"""
+
+		if self._ldictRows is None and ConstantsBreadCrumbs.c_rows in self._dictDescriptionSpans:
+			iStart, iEnd, npaStarts = self._dictDescriptionSpans[ConstantsBreadCrumbs.c_rows]
+			if not len(npaStarts):
+				return False
+			dictRow = json.JSONDecoder().raw_decode(self._strText[npaStarts[0]:npaStarts[1] if len(npaStarts) > 1 else iEnd])[0]
+		else:
+			lsRows = self.funcGetRows()
+			if not len(lsRows):
+				return False
+			dictRow = lsRows[0]
+		return dictRow.get(ConstantsBreadCrumbs.c_metadata_lowercase) != None
+
+
 class AbundanceTable:
 	"""
 	Represents an abundance table and contains common function to perform on the object.
@@ -141,7 +1271,8 @@ class AbundanceTable:
 		Constructor for an abundance table.
 
 		:param	npaAbundance:	Structured Array of abundance data (Row=Features, Columns=Samples)
-		:type:	Numpy Structured Array abundance data (Row=Features, Columns=Samples)
+								or columnar storage of the same data (AbundanceMatrix).
+		:type:	Numpy Structured Array abundance data (Row=Features, Columns=Samples) or AbundanceMatrix
 		:param	dictMetadata:	Dictionary of metadata {"String ID":["strValue","strValue","strValue","strValue","strValue"]}
 		:type:	Dictionary	Dictionary
 		:param	npaRowMetdata	Structured Array of row (feature) metadata (optional)
@@ -218,6 +1349,8 @@ class AbundanceTable:
 		#The abundance data
 		self._npaFeatureAbundance = npaAbundance
 
+		#Index of the clades of the feature names, built when needed (see funcGetLineageIndex)
+		self._lineageIndex = None
 
 		### Logistical
 
@@ -231,16 +1364,19 @@ class AbundanceTable:
 		### Prep the object
 
 		self._fIsNormalized = self._fIsSummed = None
+		#Transform applied to the measurements by funcTransformColumns (c_strTransformCLR or c_strTransformArcsineSqrt), None if none
+		self._strTransform = None
 		#If contents is not a false then set contents to appropriate objects
 		# Checking to see if the data is normalized, summed and if we need to run a filter on it.
-		if ( self._npaFeatureAbundance != None ) and self._dictTableMetadata:
-			self._iOriginalFeatureCount = self._npaFeatureAbundance.shape[0]
+		if ( self._npaFeatureAbundance is not None ) and self._dictTableMetadata:
+			self._iOriginalFeatureCount = self.funcGetFeatureCount()
 			self._iOriginalSampleCount = len(self.funcGetSampleNames())
-		
-			self._fIsNormalized = ( max( [max( list(a)[1:] or [0] ) for a in self._npaFeatureAbundance] or [0] ) <= 1 )
 
-			lsLeaves = AbundanceTable.funcGetTerminalNodesFromList( [a[0] for a in self._npaFeatureAbundance], self._cFeatureDelimiter )
-			self._fIsSummed = ( len( lsLeaves ) != len( self._npaFeatureAbundance ) )
+			npaData = self._funcGetDataMatrix()
+			self._fIsNormalized = ( ( npaData.max() if ( npaData.shape[0] and npaData.shape[1] ) else 0 ) <= 1 )
+
+			lsLeaves = self.funcGetTerminalNodes()
+			self._fIsSummed = ( len( lsLeaves ) != self.funcGetFeatureCount() )
 
 			#Occurence filtering
 			#Removes features that do not have a given level iLowestAbundance in a given amount of samples iLowestSampleOccurence
@@ -252,7 +1388,8 @@ class AbundanceTable:
 
 	@staticmethod
 	def funcMakeFromFile(xInputFile, cDelimiter = ConstantsBreadCrumbs.c_cTab, sMetadataID = None, sLastMetadataRow = None, sLastMetadata = None,
-	   lOccurenceFilter = None, cFeatureNameDelimiter="|", xOutputFile = None, strFormat = None):
+	   lOccurenceFilter = None, cFeatureNameDelimiter="|", xOutputFile = None, strFormat = None, fColumnar = False, xCache = None, strMapDirectory = None,
+	   fSparse = False):
 		"""
 		Creates an abundance table from a table file.
 
@@ -273,6 +1410,19 @@ class AbundanceTable:
 		:type:	Character	Delimiting letter
 		:param	xOutputFile:	File to output the abundance table which was read in.
 		:type:	FileStream or String file path
+		:param	fColumnar:	Store the measurements as a 2-D matrix with separate feature and sample id indices (AbundanceMatrix)
+					instead of a structured array.
+		:type:	Boolean
+		:param	xCache:	Cache of parsed files to read from and add to (opt-in). Not used when xOutputFile is given.
+		:type:	AbundanceTableCache or String path of the cache directory
+		:param	strMapDirectory:	Hold the measurements in a memory-mapped file in this directory (for tables larger than memory).
+					Data derived from the table (for instance by removing samples) is written to new files in the directory.
+					Implies fColumnar.
+		:type:	String
+		:param	fSparse:	Hold the measurements in a sparse matrix if the file is flagged as sparse (BIOM matrix type)
+					or if the fraction of measurements which are not zero is at most c_dSparseDensity.
+					Sparse measurements are held in memory, not memory-mapped. Implies fColumnar.
+		:type:	Boolean
 		:return	AbundanceTable:	Will return an AbundanceTable object on no error. Returns False on error.
 		"""
 		
@@ -284,9 +1434,22 @@ class AbundanceTable:
 		#################################################################################
 		strFileName = xInputFile if isinstance(xInputFile, str) else xInputFile.name
 
+		#Memory-mapped and sparse tables are columnar
+		fColumnar = fColumnar or bool(strMapDirectory) or fSparse
+
+		#Look for the parsed file in the cache if one is given
+		#The cache is not used when echoing the file to an output file
+		cacheTable = lCached = None
+		lParseArguments = [strFormat, cDelimiter, sMetadataID, sLastMetadataRow, sLastMetadata, fColumnar, fSparse]
+		if xCache and ( not outputFile ) and isinstance(xInputFile, str):
+			cacheTable = AbundanceTableCache(xCache) if isinstance(xCache, str) else xCache
+			lCached = cacheTable.funcLoad(xInputFile, lParseArguments)
+
+		if lCached:
+			lContents = AbundanceTable._funcContentsFromCache(lCached[0], lCached[1])
                 # Determine the file read function by file extension
-		if strFileName.endswith(ConstantsBreadCrumbs.c_strBiomFile) or (strFormat == ConstantsBreadCrumbs.c_strBiomFile):
-			BiomCommonArea = AbundanceTable._funcBiomToStructuredArray(xInputFile)
+		elif strFileName.endswith(ConstantsBreadCrumbs.c_strBiomFile) or (strFormat == ConstantsBreadCrumbs.c_strBiomFile):
+			BiomCommonArea = AbundanceTable._funcBiomToStructuredArray(xInputFile, fColumnar = fColumnar, fSparse = fSparse)
 			if  BiomCommonArea:
 				lContents = [BiomCommonArea[ConstantsBreadCrumbs.c_BiomTaxData],
 					BiomCommonArea[ConstantsBreadCrumbs.c_Metadata],
@@ -304,15 +1467,84 @@ class AbundanceTable:
 		or strFileName.endswith(ConstantsBreadCrumbs.c_strTSVFile) or (strFormat == ConstantsBreadCrumbs.c_strTSVFile)	): #Added support for tsv files GW 20141014	
 			#Read in from text file to create the abundance and metadata structures
 			lContents = AbundanceTable._funcTextToStructuredArray(xInputFile=xInputFile, cDelimiter=cDelimiter,
-				sMetadataID = sMetadataID, sLastMetadataRow = sLastMetadataRow, sLastMetadata = sLastMetadata, ostmOutputFile = outputFile)
+				sMetadataID = sMetadataID, sLastMetadataRow = sLastMetadataRow, sLastMetadata = sLastMetadata, ostmOutputFile = outputFile, fColumnar = fColumnar,
+				strMapDirectory = strMapDirectory)
                 else:
                   print("I do not understand the format to read and write the data as, please use the correct file extension or indicate a type.")
                   return( false )
 
+		#Move the measurements to columnar storage if requested
+		if lContents and fColumnar and not isinstance(lContents[0], AbundanceMatrix):
+			lContents[0] = AbundanceMatrix.funcMakeFromStructuredArray(lContents[0])
+
+		#Move the measurements to sparse storage if requested and the file is sparse
+		if lContents and fSparse and not lContents[0].funcIsSparse():
+			fFlaggedSparse = ( lContents[3] or {} ).get(ConstantsBreadCrumbs.c_strSparsityKey) == ConstantsBreadCrumbs.c_strSparseMatrixType
+			if fFlaggedSparse or ( AbundanceMatrix.funcGetDensity(lContents[0].npaData) <= c_dSparseDensity ):
+				lContents[0] = lContents[0].funcToSparse()
+
+		#Add the parsed file to the cache
+		if cacheTable and lContents and not lCached:
+			lToCache = AbundanceTable._funcContentsToCache(lContents)
+			cacheTable.funcStore(xInputFile, lParseArguments, lToCache[0], lToCache[1])
+
+		#Memory-map the measurements if requested
+		#Cached measurements are already memory-mapped
+		if lContents and strMapDirectory:
+			if lCached:
+				lContents[0].strMapDirectory = strMapDirectory
+			elif not ( lContents[0].funcIsMemoryMapped() or lContents[0].funcIsSparse() ):
+				lContents[0] = lContents[0].funcToMemoryMap(strMapDirectory)
+
 		#If contents is not a false then set contents to appropriate objects
 		return AbundanceTable(npaAbundance=lContents[0], dictMetadata=lContents[1], strName=str(xInputFile), strLastMetadata=sLastMetadata, rwmtRowMetadata = lContents[2],
 		dictFileMetadata = lContents[3], lOccurenceFilter = lOccurenceFilter, cFileDelimiter=cDelimiter, cFeatureNameDelimiter=cFeatureNameDelimiter) if lContents else False
 
+	@staticmethod
+	def _funcContentsToCache(lContents):
+		"""
+		Splits parsed file contents into the arrays and header stored in an AbundanceTableCache.
+
+		:param	lContents:	[abundance data, column metadata, row metadata, file metadata] as read from a file.
+		:type:	List
+		:return	List:	[Dictionary of numpy arrays, Dictionary header]
+		"""
+
+		dictHeader = {"Metadata":lContents[1], "RowMetadata":lContents[2], "FileMetadata":lContents[3], "Columnar":None}
+		if isinstance(lContents[0], AbundanceMatrix):
+			dictHeader["Columnar"] = [lContents[0].lsSampleIDs, lContents[0].strIDName]
+			if lContents[0].funcIsSparse():
+				npaSparse = lContents[0].npaData
+				return [{"Data":npaSparse.data, "Indices":npaSparse.indices, "Indptr":npaSparse.indptr,
+					"Features":lContents[0].npaFeatureIDs}, dictHeader]
+			return [{"Abundance":lContents[0].npaData, "Features":lContents[0].npaFeatureIDs}, dictHeader]
+		return [{"Abundance":lContents[0]}, dictHeader]
+
+	@staticmethod
+	def _funcContentsFromCache(dictArrays, dictHeader):
+		"""
+		Rebuilds parsed file contents from the arrays and header of an AbundanceTableCache entry.
+
+		:param	dictArrays:	Numpy arrays of the entry (memory-mapped)
+		:type:	Dictionary
+		:param	dictHeader:	Header of the entry
+		:type:	Dictionary
+		:return	List:	[abundance data, column metadata, row metadata, file metadata]
+		"""
+
+		if dictHeader["Columnar"]:
+			lsSampleIDs, strIDName = dictHeader["Columnar"]
+			if "Indptr" in dictArrays:
+				npaData = scipy.sparse.csr_matrix((dictArrays["Data"], dictArrays["Indices"], dictArrays["Indptr"]),
+					shape = (len(dictArrays["Features"]), len(lsSampleIDs)))
+			else:
+				npaData = dictArrays["Abundance"]
+			npaAbundance = AbundanceMatrix(npaData = npaData, lsFeatureIDs = dictArrays["Features"],
+				lsSampleIDs = lsSampleIDs, strIDName = strIDName)
+		else:
+			npaAbundance = dictArrays["Abundance"]
+		return [npaAbundance, dictHeader["Metadata"], dictHeader["RowMetadata"], dictHeader["FileMetadata"]]
+
 	#Testing Status: Light happy path testing
 	@staticmethod
 	def funcCheckRawDataFile(strReadDataFileName, iFirstDataIndex = -1, sLastMetadataName = None, lOccurenceFilter = None, strOutputFileName = "", cDelimiter = ConstantsBreadCrumbs.c_cTab):
@@ -436,9 +1668,9 @@ class AbundanceTable:
 	  Create a string representation of the Abundance Table.
 	  """
 
-	  return "".join(["Sample count:", str(len(self._npaFeatureAbundance.dtype.names[1:])),
-	  os.linesep+"Feature count:", str(len(self._npaFeatureAbundance[self._npaFeatureAbundance.dtype.names[0]])),
-	  os.linesep+"Id Metadata:", self._npaFeatureAbundance.dtype.names[0],
+	  return "".join(["Sample count:", str(len(self.funcGetSampleNames())),
+	  os.linesep+"Feature count:", str(self.funcGetFeatureCount()),
+	  os.linesep+"Id Metadata:", self.funcGetIDMetadataName(),
 	  os.linesep+"Metadata ids:", str(self._dictTableMetadata.keys()),
 	  os.linesep+"Metadata count:", str(len(self._dictTableMetadata.keys())),
 	  os.linesep+"Originating source:",self._strOriginalName,
@@ -543,38 +1775,194 @@ class AbundanceTable:
 		if len(result1) != len(result2):
 			return False
 
-		sorted_result1 = sorted(result1, key=lambda tup: tup[0])
-		sorted_result2 = sorted(result2, key=lambda tup: tup[0])		
-			
-		if sorted_result1 != sorted_result2 :
-			return  False
-				
+		sorted_result1 = sorted(result1, key=lambda tup: tup[0])
+		sorted_result2 = sorted(result2, key=lambda tup: tup[0])		
+			
+		if sorted_result1 != sorted_result2 :
+			return  False
+				
+
+		#************************************************** 
+		#* Commented out                                  *  
+		#************************************************** 			
+		#Check AbundanceTable.__str__(self)  - Commented out by GW on 2013/09/14 because
+		#If we import pcl file into biom file and then export to pcl, the file names might be different but the tables might be the same						
+				
+		#Check string representation
+		#if AbundanceTable.__str__(self) !=  AbundanceTable.__str__(objOther):
+				#return False
+					
+		#Check if sample ids are the same and in the same order
+		if self.funcGetSampleNames() != objOther.funcGetSampleNames():
+			return  False
+
+		return  True
+	
+
+	def __ne__(self, objOther):
+		return not self == objOther
+
+	def _funcIsColumnar(self):
+		"""
+		Indicates if the measurements are held in columnar storage (AbundanceMatrix) instead of a structured array.
+
+		:return	Boolean:	True indicates columnar storage.
+		"""
+
+		return isinstance(self._npaFeatureAbundance, AbundanceMatrix)
+
+	def _funcIsSparse(self):
+		"""
+		Indicates if the measurements are held in a sparse matrix.
+
+		:return	Boolean:	True indicates sparse storage.
+		"""
+
+		return self._funcIsColumnar() and self._npaFeatureAbundance.funcIsSparse()
+
+	def _funcGetDataMatrix(self):
+		"""
+		Returns the measurements as a 2-D matrix (Row=Features, Columns=Samples) in the order of the feature and sample names.
+		This is the underlying data (or a view on it) where possible, copy before changing it.
+		Sparse storage is returned as a scipy CSR matrix.
+
+		:return	Numpy array:	2-D array of measurements or None if there is no underlying table.
+		"""
+
+		if self._npaFeatureAbundance is None:
+			return None
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.npaData
+		return AbundanceMatrix.funcGetStructuredArrayAsMatrix(self._npaFeatureAbundance)
+
+	def _funcMakeStorage(self, npaData, lsFeatureIDs = None, lsSampleIDs = None, fSparse = None, dtValue = None):
+		"""
+		Makes new underlying storage of the same kind (structured array, columnar or sparse) and measurement type as this table.
+
+		:param	npaData:	Measurements (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array, scipy sparse matrix or list of lists
+		:param	lsFeatureIDs:	Feature ids of the rows, defaults to the current feature names.
+		:type:	List of strings
+		:param	lsSampleIDs:	Sample ids of the columns, defaults to the current sample names.
+		:type:	List of strings
+		:param	fSparse:	Indicates if columnar storage should be sparse, defaults to the storage of this table.
+		:type:	Boolean
+		:param	dtValue:	Measurement type, defaults to the measurement type of this table.
+		:type:	Numpy dtype
+		:return	Storage:	Numpy structured array or AbundanceMatrix
+		"""
+
+		if lsFeatureIDs is None:
+			lsFeatureIDs = self.funcGetFeatureNames()
+		if lsSampleIDs is None:
+			lsSampleIDs = self.funcGetSampleNames()
+		if fSparse is None:
+			fSparse = self._funcIsSparse()
+		if dtValue is None:
+			dtValue = self._funcGetDataMatrix().dtype
+		if scipy.sparse.issparse(npaData):
+			npaData = scipy.sparse.csr_matrix(npaData, dtype=dtValue)
+			if not fSparse:
+				npaData = npaData.toarray()
+		else:
+			npaData = np.asarray(npaData, dtype=dtValue).reshape((len(lsFeatureIDs), len(lsSampleIDs)))
+			if fSparse:
+				npaData = AbundanceMatrix.funcMakeSparse(npaData)
+
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.funcMakeLike(npaData = npaData, lsFeatureIDs = lsFeatureIDs, lsSampleIDs = lsSampleIDs)
+		return AbundanceMatrix.funcMakeStructuredArray(npaData, lsFeatureIDs, lsSampleIDs, self.funcGetIDMetadataName(),
+			dtID = self._npaFeatureAbundance.dtype[0], dtValue = dtValue)
+
+	def _funcSetStorage(self, npaAbundance):
+		"""
+		Replaces the underlying storage (structured array or AbundanceMatrix),
+		the memory-mapped file of replaced columnar storage is removed.
+
+		:param	npaAbundance:	New storage
+		:type:	Numpy structured array or AbundanceMatrix
+		"""
+
+		if self._funcIsColumnar() and ( self._npaFeatureAbundance.strMapFile != getattr(npaAbundance, "strMapFile", None) ):
+			self._npaFeatureAbundance.funcClose()
+		self._npaFeatureAbundance = npaAbundance
+
+	def funcClose(self):
+		"""
+		Removes the memory-mapped file holding the measurements of this table (if any), call when the table is no longer used.
+		Otherwise the file is removed when the table is freed.
+		"""
+
+		if self._funcIsColumnar():
+			self._npaFeatureAbundance.funcClose()
+
+	def _funcSetDataMatrix(self, npaData, lsFeatureIDs = None, fSparse = None, dtValue = None):
+		"""
+		Replaces the measurements of the table, keeping the samples.
+
+		:param	npaData:	Measurements (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or list of lists
+		:param	lsFeatureIDs:	Feature ids of the rows if the features changed.
+		:type:	List of strings
+		:param	fSparse:	Indicates if columnar storage should be sparse, defaults to the storage of this table.
+		:type:	Boolean
+		:param	dtValue:	Measurement type, defaults to the measurement type of this table.
+		:type:	Numpy dtype
+		"""
+
+		self._funcSetStorage(self._funcMakeStorage(npaData, lsFeatureIDs, fSparse = fSparse, dtValue = dtValue))
+		self._lineageIndex = None
+
+	def _funcSetFeatureNames(self, lsFeatureNames):
+		"""
+		Replaces the feature names (in order) of the table.
+
+		:param	lsFeatureNames:	New feature names in the order of the current features.
+		:type:	List of strings
+		"""
+
+		if self._funcIsColumnar():
+			self._npaFeatureAbundance.npaFeatureIDs = np.array(lsFeatureNames)
+		else:
+			self._npaFeatureAbundance[self.funcGetIDMetadataName()] = np.array(lsFeatureNames)
+		self._lineageIndex = None
+
+	def _funcCompressFeatures(self, xFeatures):
+		"""
+		Returns the underlying storage reduced to the given features.
+
+		:param	xFeatures:	Indices or boolean indicators of the features (rows) to keep.
+		:type:	List of integers or booleans
+		:return	Storage:	Numpy structured array or AbundanceMatrix
+		"""
 
-		#************************************************** 
-		#* Commented out                                  *  
-		#************************************************** 			
-		#Check AbundanceTable.__str__(self)  - Commented out by GW on 2013/09/14 because
-		#If we import pcl file into biom file and then export to pcl, the file names might be different but the tables might be the same						
-				
-		#Check string representation
-		#if AbundanceTable.__str__(self) !=  AbundanceTable.__str__(objOther):
-				#return False
-					
-		#Check if sample ids are the same and in the same order
-		if self.funcGetSampleNames() != objOther.funcGetSampleNames():
-			return  False
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.funcCompressFeatures(xFeatures)
+		xFeatures = np.asarray(xFeatures)
+		if not xFeatures.size:
+			xFeatures = np.array([], dtype=int)
+		return self._npaFeatureAbundance[xFeatures]
 
-		return  True
-	
+	def _funcCompressSamples(self, lsSamples):
+		"""
+		Returns the underlying storage reduced to the given samples (in the given order).
 
-	def __ne__(self, objOther):
-		return not self == objOther
+		:param	lsSamples:	Names of the samples to keep.
+		:type:	List of strings
+		:return	Storage:	Numpy structured array or AbundanceMatrix
+		"""
+
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.funcCompressSamples(lsSamples)
+		dictSampleIndex = dict([[sSample, iIndex] for iIndex, sSample in enumerate(self.funcGetSampleNames())])
+		return self._funcMakeStorage(self._funcGetDataMatrix()[:,[dictSampleIndex[sSample] for sSample in lsSamples]], lsSampleIDs = lsSamples)
 
 	  
 	#Testing Status: Light happy path testing
         #TODO: Tim change static to class methods
 	@staticmethod
-	def _funcTextToStructuredArray(xInputFile = None, cDelimiter = ConstantsBreadCrumbs.c_cTab, sMetadataID = None, sLastMetadataRow = None, sLastMetadata = None, ostmOutputFile = None):
+	def _funcTextToStructuredArray(xInputFile = None, cDelimiter = ConstantsBreadCrumbs.c_cTab, sMetadataID = None, sLastMetadataRow = None, sLastMetadata = None, ostmOutputFile = None,
+		fColumnar = False, iBlockSize = c_iTextBlockSize, strMapDirectory = None):
 
 		"""
 		Private method
@@ -593,6 +1981,13 @@ class AbundanceTable:
 		:type:	String		String ID
 		:param	ostmOutputFile:	Output File to write to if needed. None does not write the file.
 		:type:	FileStream or String
+		:param	fColumnar:	Return the abundance data as columnar storage (AbundanceMatrix) instead of a structured array.
+		:type:	Boolean
+		:param	iBlockSize:	The number of data rows parsed in a block.
+		:type:	Integer
+		:param	strMapDirectory:	If given the abundance data is written to a memory-mapped file in this directory
+						and returned as columnar storage (AbundanceMatrix).
+		:type:	String
 		:return	[taxData,metadata,rowmetadata]: Numpy Structured Array of abundance data and dictionary of metadata.
  										Metadata is a dictionary as such {"ID", [value,value,values...]}
  										Values are in the order thety are read in (and the order of the sample names).
@@ -605,109 +2000,74 @@ class AbundanceTable:
 +										[Numpy structured Array, Dictionary, Numpy structured array, dict]
 		"""
 
-		# Open file from a stream or file path
-		istmInput = open( xInputFile, 'rU' ) if isinstance(xInputFile, str) else xInputFile
-		# Flag that when incremented will switch from metadata parsing to data parsing
-		iFirstDataRow = -1
-		# Sample id row
-		namesRow = None
-		# Row metadata names
-		lsRowMetadataIDs = None
-		# Index of the last row metadata
-		iIndexLastMetadataRow = None
-		# Holds metadata {ID:[list of values]}
-		metadata = dict()
-		# Holds the data measurements [(tuple fo values)]
-		dataMatrix = []
-		# Holds row metadata { sID : [ list of values ] }
-		dictRowMetadata = {}
-		# Positional index
-		iIndex = -1
-		# File handle
-		csvw = None
-
-		# Read in files
-		if ostmOutputFile:
-			csvw = csv.writer( open(ostmOutputFile,'w') if isinstance(ostmOutputFile, str) else ostmOutputFile, csv.excel_tab, delimiter = cDelimiter )
-		# For each line in the file, and assume the tax id is the first element and the data follows
-		for lsLineElements in csv.reader( istmInput, dialect = csv.excel_tab, delimiter = cDelimiter ):
-			iIndex += 1
-			taxId, sampleReads = lsLineElements[0], lsLineElements[1:]
-
-			# Read through data measurements
-			# Process them as a list of tuples (needed for structured f)
-			if iFirstDataRow > 0:
-				try:
-					# Parse the sample reads, removing row metadata and storing row metadata if it exists
-					if lsRowMetadataIDs:
-						# Build expected dict for row metadata dictionary {string feature id: {'metadata': {metadatakey: [list of metadata values]}}}
-						dictFeature = dict([ [sID, [sKey]] for sID, sKey in zip( lsRowMetadataIDs, sampleReads[ 0 : iIndexLastMetadataRow ]) ])
-						if len( dictFeature ):
-							dictRowMetadata[ taxId ] = { ConstantsBreadCrumbs.c_metadata_lowercase: dictFeature }
-						dataMatrix.append(tuple([taxId] + [( float(s) if s.strip( ) else 0 ) for s in sampleReads[ iIndexLastMetadataRow: ]]))
-					else:
-						dataMatrix.append(tuple([taxId] + [( float(s) if s.strip( ) else 0 ) for s in sampleReads]))
-				except ValueError:
-					sys.stderr.write( "AbundanceTable:textToStructuredArray::Error, non-numerical value on data row. File:" + str(xInputFile) +
-						" Row:" + str(lsLineElements) + "\n" )
-					return False
-			# Go through study measurements
-			else:
-				# Read in metadata values, if the entry is blank then give it the default empty metadata value.
-				for i, s in enumerate( sampleReads ):
-					if not s.strip( ):
-						sampleReads[i] = ConstantsBreadCrumbs.c_strEmptyDataMetadata
-
-				# If no id metadata (sample ids) is given then the first row is assumed to be the id row, otherwise look for the id for the metadata.
-				# Add the metadata to the containing dict
-				if ( ( not sMetadataID ) and ( iIndex == 0 ) ) or ( taxId == sMetadataID ):
-					namesRow = lsLineElements
-					# Remove the row metadata ids, these names are for the column ID and the samples ids
-					if sLastMetadataRow:
-						iIndexLastMetadataRow = lsLineElements.index(sLastMetadataRow)
-						lsRowMetadataIDs = namesRow[ 1 : iIndexLastMetadataRow + 1 ]
-						namesRow = [ namesRow[ 0 ] ] + namesRow[ iIndexLastMetadataRow + 1: ]
-
-						# If the sample metadata dictionary already has entries then remove the row metadata info from it.
-						if len( metadata ) and len( lsRowMetadataIDs ):
-							for sKey, lsValues in metadata.items():
-								metadata[ sKey ] = lsValues[ iIndexLastMetadataRow: ]
-
-				# Set the metadata without row metadata entries
-				metadata[taxId] = sampleReads[ iIndexLastMetadataRow: ] if (lsRowMetadataIDs and len( lsRowMetadataIDs )) else sampleReads
-
-				# If the last metadata was just processed switch to data processing
-				# If the last metadata name is not given it is assumed that there is only one metadata
-				if ( not sLastMetadata ) or ( taxId == sLastMetadata ):
-					iFirstDataRow = iIndex + 1
-
-			# If writing out the data write back out the line read in.
-			# This happens at the end so that the above cleaning is captured and written.
-			if csvw:
-				csvw.writerow( [taxId] + sampleReads )
+		# Read the metadata and stream the data rows in blocks into a growable buffer
+		rdrText = TextBlockReader( xInputFile = xInputFile, cDelimiter = cDelimiter, sMetadataID = sMetadataID, sLastMetadataRow = sLastMetadataRow,
+			sLastMetadata = sLastMetadata, ostmOutputFile = ostmOutputFile, iBlockSize = iBlockSize )
+		namesRow = rdrText.namesRow
+		metadata = rdrText.dictMetadata
+		lsFeatures = []
+		npaBuffer = None
+		# If memory-mapping, the blocks are appended to a file instead
+		hndlMap = strMapFile = None
+		if strMapDirectory:
+			iFile, strMapFile = tempfile.mkstemp( prefix = "AbundanceTable-", suffix = ".dat", dir = strMapDirectory )
+			hndlMap = os.fdopen( iFile, "wb" )
+		for lsBlockFeatures, npaBlock in rdrText.funcIterBlocks( ):
+			iRows = len( lsFeatures )
+			if hndlMap:
+				npaBlock.tofile( hndlMap )
+			elif npaBuffer is None:
+				npaBuffer = np.zeros( ( max( rdrText.iBlockSize, npaBlock.shape[0] ), npaBlock.shape[1] ), dtype = npaBlock.dtype )
+			elif iRows + npaBlock.shape[0] > npaBuffer.shape[0]:
+				# Grow the buffer by doubling
+				npaGrown = np.zeros( ( 2 * npaBuffer.shape[0], npaBuffer.shape[1] ), dtype = npaBuffer.dtype )
+				npaGrown[ : iRows ] = npaBuffer[ : iRows ]
+				npaBuffer = npaGrown
+			if not hndlMap:
+				npaBuffer[ iRows : iRows + npaBlock.shape[0] ] = npaBlock
+			lsFeatures.extend( lsBlockFeatures )
+		if hndlMap:
+			hndlMap.close( )
+			# The file is handed off to the storage (and removed with it), remove it now if there is nothing to map
+			if rdrText.fError or ( namesRow is None ) or ( not lsFeatures ) or ( len( namesRow ) < 2 ):
+				os.remove( strMapFile )
+				hndlMap = None
+		if rdrText.fError:
+			return False
 
-		if sLastMetadata and ( not dataMatrix ):
+		if sLastMetadata and ( not lsFeatures ):
 			sys.stderr.write( "AbundanceTable:textToStructuredArray::Error, did not find the row for the last metadata ID. File:" + str(xInputFile) +
 				" Identifier:" + sLastMetadata + "\n" )
 			return False
 
 		# Make sure the names are found
-		if namesRow == None:
+		if namesRow is None:
 			sys.stderr.write( "AbundanceTable:textToStructuredArray::Error, did not find the row for the unique sample/column. File:" + str(xInputFile) +
-				" Identifier:" + sMetadataID + "\n" )
+				" Identifier:" + str(sMetadataID) + "\n" )
 			return False
 
-		# Now we know the longest taxId we can define the first column holding the tax id
-		# Gross requirement of Numpy structured arrays, a = ASCII followed by max # of characters (as a string)
-		longestTaxId = max( len(a[0]) for a in dataMatrix )
-		dataTypeVector = [(namesRow[0],'a' + str(longestTaxId*2))] + [(s, "f4") for s in namesRow[1:]]
-		# Create structured array
-		taxData = np.array(dataMatrix,dtype=np.dtype(dataTypeVector))
+		tplShape = ( len( lsFeatures ), len( namesRow ) - 1 )
+		if hndlMap and tplShape[0] and tplShape[1]:
+			npaData = AbundanceMatrix.funcTrackMapFile( np.memmap( strMapFile, dtype = "f4", mode = "r+", shape = tplShape ) )
+		else:
+			npaData = npaBuffer if npaBuffer is not None else np.zeros( tplShape, dtype = "f4" )
+			# Columnar storage keeps the matrix, do not keep the unused rows of the buffer alive with it
+			if npaData.shape[0] > len( lsFeatures ):
+				npaData = npaData[ : len( lsFeatures ) ].copy( ) if fColumnar else npaData[ : len( lsFeatures ) ]
+		if fColumnar or strMapDirectory:
+			taxData = AbundanceMatrix( npaData = npaData, lsFeatureIDs = lsFeatures, lsSampleIDs = namesRow[1:], strIDName = namesRow[0],
+				strMapDirectory = strMapDirectory )
+		else:
+			# Now we know the longest taxId we can define the first column holding the tax id
+			# Gross requirement of Numpy structured arrays, a = ASCII followed by max # of characters (as a string)
+			longestTaxId = max( [ len(sFeature) for sFeature in lsFeatures ] or [1] )
+			# Create structured array
+			taxData = AbundanceMatrix.funcMakeStructuredArray( npaData, lsFeatures, namesRow[1:], namesRow[0], dtID = np.dtype( 'a' + str(longestTaxId*2) ) )
 
 		# Returns a none currently because the PCL file specification this originally worked on did not have feature metadata
  		# Can be updated in the future.
 		# [Data (structured array), column metadata (dict), row metadata (structured array), file metadata (dict)]
-		return [taxData, metadata, RowMetadata(dictRowMetadata = dictRowMetadata, lsRowMetadataIDs = lsRowMetadataIDs), {
+		return [taxData, metadata, RowMetadata(dictRowMetadata = rdrText.dictRowMetadata, lsRowMetadataIDs = rdrText.lsRowMetadataIDs), {
                     ConstantsBreadCrumbs.c_strIDKey:ConstantsBreadCrumbs.c_strDefaultPCLID,
                     ConstantsBreadCrumbs.c_strDateKey:str(date.today()),
                     ConstantsBreadCrumbs.c_strFormatKey:ConstantsBreadCrumbs.c_strDefaultPCLFileFormateType,
@@ -796,7 +2156,7 @@ class AbundanceTable:
 		:param npdData: Rows of features to add to the table
 		:type:	Numpy array accessed by row.
 		"""
-		if ( self._npaFeatureAbundance == None ):
+		if ( self._npaFeatureAbundance is None ):
 			return False
 
 		# Check number of input data rows
@@ -804,12 +2164,13 @@ class AbundanceTable:
 		if (len(lsNames) != iDataRows):
 			print "Error:The names and the rows of data features to add must be of equal length"
 
-		# Grow the array by the neccessary amount and add the new rows
-		iTableRowCount = self.funcGetFeatureCount()
-		iRowElementCount = self.funcGetSampleCount()
-		self._npaFeatureAbundance.resize(iTableRowCount+iDataRows)
-		for iIndexData in xrange(iDataRows):
-			self._npaFeatureAbundance[iTableRowCount+iIndexData] = tuple([lsNames[iIndexData]]+list(npdData[iIndexData]))
+		# Grow the data by the new rows
+		npaNewRows = np.reshape(npdData,(iDataRows,self.funcGetSampleCount()))
+		if self._funcIsSparse():
+			npaData = scipy.sparse.vstack([self._funcGetDataMatrix(), scipy.sparse.csr_matrix(npaNewRows)], format="csr")
+		else:
+			npaData = np.vstack([self._funcGetDataMatrix(), npaNewRows])
+		self._funcSetDataMatrix(npaData, list(self.funcGetFeatureNames())+list(lsNames))
 
 		return True
 
@@ -843,7 +2204,7 @@ class AbundanceTable:
 		:type:	Character
 		:return	Boolean:	Indicator of success or not (false)
 		"""
-		if ( self._npaFeatureAbundance == None ):
+		if ( self._npaFeatureAbundance is None ):
 			return False
 		cDelimiterCurrent = self.funcGetFeatureDelimiter()
 		if ( not cDelimiter or not cDelimiterCurrent):
@@ -853,11 +2214,12 @@ class AbundanceTable:
 		lsNewFeatureNames = [sFeatureName.replace(cDelimiterCurrent,cDelimiter) for sFeatureName in self.funcGetFeatureNames()]
 		
 		#Update new feature names to abundance table
-		if (not self.funcGetIDMetadataName() == None):
-			self._npaFeatureAbundance[self.funcGetIDMetadataName()] = np.array(lsNewFeatureNames)
+		if (not self.funcGetIDMetadataName() is None):
+			self._funcSetFeatureNames(lsNewFeatureNames)
 
 		#Update delimiter
 		self._cFeatureDelimiter = cDelimiter
+		self._lineageIndex = None
 		return True
 
 	#Happy path tested
@@ -869,7 +2231,11 @@ class AbundanceTable:
 								A list of string names or empty list on error as well as no underlying table.
 		"""
 
-		return self._npaFeatureAbundance.dtype.names[1:] if ( self._npaFeatureAbundance != None ) else []
+		if self._npaFeatureAbundance is None:
+			return []
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.lsSampleIDs
+		return self._npaFeatureAbundance.dtype.names[1:]
 
 	#Happy Path Tested
 	def funcGetIDMetadataName(self):
@@ -880,7 +2246,11 @@ class AbundanceTable:
 					  Returns none on error.
 		"""
 
-		return self._npaFeatureAbundance.dtype.names[0] if ( self._npaFeatureAbundance != None ) else None
+		if self._npaFeatureAbundance is None:
+			return None
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.strIDName
+		return self._npaFeatureAbundance.dtype.names[0]
 
 	#Happy path tested
 	def funcGetAbundanceCopy(self):
@@ -891,7 +2261,11 @@ class AbundanceTable:
 									   Returns none on error.
 		"""
 
-		return self._npaFeatureAbundance.copy() if ( self._npaFeatureAbundance != None ) else None
+		if self._npaFeatureAbundance is None:
+			return None
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.funcToStructuredArray()
+		return self._npaFeatureAbundance.copy()
 
 	#Happy path tested
 	def funcGetAverageAbundancePerSample(self, lsTargetedFeatures):
@@ -949,8 +2323,11 @@ class AbundanceTable:
 			return ldAverageSample
 
 		#If there are samples return the average of each feature in the order of the feature names.
-		for sFeature in self._npaFeatureAbundance:
-			npFeaturesAbundance = list(sFeature)[1:]
+		if self._funcIsSparse():
+			npaData = self._funcGetDataMatrix()
+			npaSums = np.bincount(AbundanceMatrix._funcGetEntryRows(npaData), weights=npaData.data, minlength=npaData.shape[0])
+			return list(npaSums/float(self.funcGetSampleCount()))
+		for npFeaturesAbundance in self._funcGetDataMatrix():
 			ldAverageSample.append(sum(npFeaturesAbundance)/float(len(npFeaturesAbundance)))
 
 		return ldAverageSample
@@ -964,7 +2341,7 @@ class AbundanceTable:
 		:return	Boolean:	True (Has a hierarchy) or False (Does not have a hierarchy)
 		"""
 
-		if ( self._npaFeatureAbundance == None ):
+		if ( self._npaFeatureAbundance is None ):
 			return None
 		cDelimiter = self.funcGetFeatureDelimiter()
 		if ( not cDelimiter ):
@@ -995,7 +2372,7 @@ class AbundanceTable:
 		:return	Boolean:	True (Has a hierarchy) or False (Does not have a hierarchy)
 		"""
 
-		if ( self._npaFeatureAbundance == None ):
+		if ( self._npaFeatureAbundance is None ):
 			return None
 		cDelimiter = self.funcGetFeatureDelimiter()
 		lsPrefixes = self.funcGetCladePrefixes()
@@ -1003,21 +2380,27 @@ class AbundanceTable:
 		if ( not cDelimiter ):
 			return False
 
-		#Append prefixes to feature names
-		lsUpdatedFeatureNames = []
-		lsFeatureNames = self.funcGetFeatureNames()
+		#If there are not enough then error
+		lineage = self.funcGetLineageIndex()
+		if lineage.funcGetCladeCount() and ( lineage.npaDepth.max() >= iPrefixLength ):
+			print "Error:: Too many clades given to be biologically meaningful"
+			return False
 
-		for sFeatureName in lsFeatureNames:
-			lsClades = sFeatureName.split(cDelimiter)
-			#If there are not enough then error
-			if(len(lsClades) > iPrefixLength):
-                                print "Error:: Too many clades given to be biologically meaningful"
-				return False
-			lsUpdatedFeatureNames.append(cDelimiter.join([lsPrefixes[iClade]+lsClades[iClade] if not(lsClades[iClade][0:len(lsPrefixes[iClade])]==lsPrefixes[iClade]) else lsClades[iClade] for iClade in xrange(len(lsClades))]))
+		#Prefix each clade once and rebuild the names from the parent clades
+		lsUpdatedNames = [None] * lineage.funcGetCladeCount()
+		for liLevel in lineage.funcGetLevels():
+			for iClade in liLevel:
+				sClade = lineage.lsClades[iClade]
+				sPrefix = lsPrefixes[lineage.npaDepth[iClade]]
+				if not sClade.startswith(sPrefix):
+					sClade = sPrefix + sClade
+				iParent = lineage.npaParent[iClade]
+				lsUpdatedNames[iClade] = lsUpdatedNames[iParent] + cDelimiter + sClade if iParent >= 0 else sClade
+		lsUpdatedFeatureNames = [lsUpdatedNames[iClade] for iClade in lineage.npaFeatureClade]
 
 		#Update new feature names to abundance table
-		if not self.funcGetIDMetadataName() == None:
-			self._npaFeatureAbundance[self.funcGetIDMetadataName()] = np.array(lsUpdatedFeatureNames)
+		if not self.funcGetIDMetadataName() is None:
+			self._funcSetFeatureNames(lsUpdatedFeatureNames)
 
 		return True
 
@@ -1032,20 +2415,22 @@ class AbundanceTable:
 				  On an error None is returned.
 		"""
 		
-		if ( self._npaFeatureAbundance == None ) or ( lsFeatures == None ):
+		if ( self._npaFeatureAbundance is None ) or ( lsFeatures is None ):
 			return None
 
 		#Get a list of boolean indicators that the row is from the features list
-		lfFeatureData = [sRowID in lsFeatures for sRowID in self.funcGetFeatureNames()]
+		setFeatures = set(lsFeatures)
+		lfFeatureData = [sRowID in setFeatures for sRowID in self.funcGetFeatureNames()]
 		#compressed version as an Abundance table
 		lsNamePieces = os.path.splitext(self._strOriginalName)
-		abndFeature = AbundanceTable(npaAbundance=np.compress(lfFeatureData, self._npaFeatureAbundance, axis = 0),
+		abndFeature = AbundanceTable(npaAbundance=self._funcCompressFeatures(lfFeatureData),
 					dictMetadata = self.funcGetMetadataCopy(),
 					strName = lsNamePieces[0] + "-" + str(len(lsFeatures)) +"-Features"+lsNamePieces[1],
 					strLastMetadata=self.funcGetLastMetadataName(),
 					cFileDelimiter = self.funcGetFileDelimiter(), cFeatureNameDelimiter= self.funcGetFeatureDelimiter())
 		#Table is no longer normalized
 		abndFeature._fIsNormalized = False
+		abndFeature._strTransform = self._strTransform
 		return abndFeature
 
 	#Happy path tested
@@ -1067,7 +2452,11 @@ class AbundanceTable:
 						Returns None on error.
 		"""
 
-		return self._npaFeatureAbundance.shape[0] if not self._npaFeatureAbundance is None else 0
+		if self._npaFeatureAbundance is None:
+			return 0
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.funcGetFeatureCount()
+		return self._npaFeatureAbundance.shape[0]
 
 	#Happy path tested
 	def funcGetFeatureSumAcrossSamples(self,sFeatureName):
@@ -1089,9 +2478,11 @@ class AbundanceTable:
 		:return	Double:	Feature across samples.
 		"""
 
-		for sFeature in self._npaFeatureAbundance:
-			if sFeature[0] == sFeatureName:
-				return list(sFeature)[1:]
+		liFeature = np.where(self.funcGetFeatureNames() == sFeatureName)[0]
+		if len(liFeature):
+			if self._funcIsSparse():
+				return list(self._funcGetDataMatrix()[liFeature[0]].toarray()[0])
+			return list(self._funcGetDataMatrix()[liFeature[0]])
 		return None
 
 	#Happy path tested
@@ -1103,9 +2494,11 @@ class AbundanceTable:
 								As an error returns empty list.
 		"""
 
-		if (not self._npaFeatureAbundance == None):
-			return self._npaFeatureAbundance[self.funcGetIDMetadataName()]
-		return []
+		if self._npaFeatureAbundance is None:
+			return []
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.npaFeatureIDs
+		return self._npaFeatureAbundance[self.funcGetIDMetadataName()]
 
 	#Happy path tested
 	def funcGetFileDelimiter(self):
@@ -1136,9 +2529,13 @@ class AbundanceTable:
 				Empty numpy array returned on error.
 		"""
 
-		if (not self._npaFeatureAbundance == None):
-			return self._npaFeatureAbundance[sSampleName].copy()
-		return np.array([])
+		if self._npaFeatureAbundance is None:
+			return np.array([])
+		if self._funcIsSparse():
+			return self._npaFeatureAbundance.npaData[:,self._npaFeatureAbundance.dictSampleIndex[sSampleName]].toarray().ravel()
+		if self._funcIsColumnar():
+			return self._npaFeatureAbundance.npaData[:,self._npaFeatureAbundance.dictSampleIndex[sSampleName]].copy()
+		return self._npaFeatureAbundance[sSampleName].copy()
 
 	#Happy path tested
 	def funcGetMetadata(self, strMetadataName):
@@ -1174,6 +2571,18 @@ class AbundanceTable:
 		"""
 		return self._strOriginalName
 
+	def funcGetLineageIndex(self):
+		"""
+		Returns the index of the clades of the feature names (as consensus lineages).
+		The index is built on the first call and kept until the features or the feature name delimiter change.
+
+		:return LineageIndex:	Index of the clades of the current features.
+		"""
+
+		if self._lineageIndex is None:
+			self._lineageIndex = LineageIndex(self.funcGetFeatureNames(), self._cFeatureDelimiter)
+		return self._lineageIndex
+
 	#Happy path tested. could do more
 	def funcGetTerminalNodes(self):
 		"""
@@ -1181,7 +2590,11 @@ class AbundanceTable:
 		features must contain a consensus lineage or all will be returned.
 		:return List:	List of strings of the terminal nodes given the abundance table.
 		"""
-		return AbundanceTable.funcGetTerminalNodesFromList(lsNames=self.funcGetFeatureNames(),cNameDelimiter=self.funcGetFeatureDelimiter())
+
+		lineage = self.funcGetLineageIndex()
+		if lineage.fHasEmptyClades:
+			return AbundanceTable.funcGetTerminalNodesFromList(lsNames=self.funcGetFeatureNames(),cNameDelimiter=self.funcGetFeatureDelimiter())
+		return AbundanceTable._funcGetTerminalNodesFromIndex(lineage)
 
 	#Tested 2 test cases
 	@staticmethod
@@ -1197,32 +2610,23 @@ class AbundanceTable:
 		:return list:	A list of terminal elements in the list (given only the list).
 		"""
 
-		#Build hash
-		dictCounts = dict()
-		for strTaxaName in lsNames:
-			#Split into the elements of the clades
-			lsClades = filter(None,strTaxaName.split(cNameDelimiter))
-			#Count clade levels
-			iCladeLength = len(lsClades)
+		lineage = LineageIndex(lsNames, cNameDelimiter)
+		#Empty clades are ignored (A||B is A|B)
+		if lineage.fHasEmptyClades:
+			lineage = LineageIndex([cNameDelimiter.join(filter(None,strTaxaName.split(cNameDelimiter))) for strTaxaName in lsNames], cNameDelimiter)
+		return AbundanceTable._funcGetTerminalNodesFromIndex(lineage)
 
-			#Evaluate first element
-			sClade = lsClades[0]
-			dictCounts[sClade] = sClade not in dictCounts
+	@staticmethod
+	def _funcGetTerminalNodesFromIndex(lineage):
+		"""
+		Returns the terminal nodes of a lineage index, the clades without children given by only one feature.
 
-			#Evaluate the rest of the elements
-			if iCladeLength < 2:
-				continue
-			for iIndex in xrange(1,iCladeLength):
-				prevClade = sClade
-				sClade = cNameDelimiter.join([sClade,lsClades[iIndex]])
-				if sClade in dictCounts:
-					dictCounts[sClade] = dictCounts[prevClade] = False
-				else:
-					dictCounts[sClade] = True
-					dictCounts[prevClade] = False
+		:param	lineage:	Index of the feature names
+		:type:	LineageIndex
+		:return list:	A list of terminal elements in the order of the features.
+		"""
 
-		#Return only the elements that were of count 1
-		return filter( lambda s: dictCounts[s] == True, dictCounts )
+		return [lineage.lsNames[iClade] for iClade in lineage.npaFeatureClade[lineage.funcGetTerminalFeatures()]]
 
 	#Happy path tested
 	def funcIsNormalized(self):
@@ -1235,6 +2639,15 @@ class AbundanceTable:
 
 		return self._fIsNormalized
 
+	def funcGetTransform(self):
+		"""
+		Returns the transform applied to the measurements by funcTransformColumns.
+
+		:return	String:	c_strTransformCLR or c_strTransformArcsineSqrt, None if the measurements were not transformed.
+		"""
+
+		return self._strTransform
+
 	#Happy path tested
 	def funcIsPrimaryIdMetadata(self,sMetadataName):
 		"""
@@ -1275,42 +2688,7 @@ class AbundanceTable:
 		:return	Boolean:	Indicator of filtering occuring without error. True indicates filtering occuring.
 		"""
 
-		#No need to do anything
-		if(dPercentileCutOff==0.0) or (dPercentageAbovePercentile==0.0):
-			return True
-
-		#Sample names
-		lsSampleNames = self.funcGetSampleNames()
-
-		#Scale percentage out of 100
-		dPercentageAbovePercentile = dPercentageAbovePercentile/100.0
-
-		#Sample count
-		iSampleCount = len(lsSampleNames)
-
-		#Get a threshold score of the value at the specified percentile for each sample
-		#In the order of the sample names
-		ldScoreAtPercentile = [scipy.stats.scoreatpercentile(self._npaFeatureAbundance[lsSampleNames[iIndex]],dPercentileCutOff) for iIndex in xrange(iSampleCount)]
-
-		#Record how many entries for each feature have a value equal to or greater than the dPercentileCutOff
-		#If the percentile of entries passing the criteria are above the dPercentageAbovePercentile put index in list to keep
-		liKeepIndices = []
-		iSampleCount = float(iSampleCount)
-		for iRowIndex, npaRow in enumerate(self._npaFeatureAbundance):
-			iCountPass = sum([1 if dValue >= ldScoreAtPercentile[iValueIndex] else 0 for iValueIndex, dValue in enumerate(list(npaRow)[1:])])
-			if (iCountPass / iSampleCount) >= dPercentageAbovePercentile:
-				liKeepIndices.append(iRowIndex)
-
-		#Compress array
-		self._npaFeatureAbundance = self._npaFeatureAbundance[liKeepIndices,:]
-
-		#Update filter state
-		self._strCurrentFilterState += ":dPercentileCutOff=" + str(dPercentileCutOff) + ",dPercentageAbovePercentile=" + str(dPercentageAbovePercentile)
-
-		#Table is no longer normalized
-		self._fIsNormalized = False
-
-		return True
+		return self.funcApplyFilters([[c_strFilterPercentile, {"dPercentileCutOff":dPercentileCutOff, "dPercentageAbovePercentile":dPercentageAbovePercentile}]])
 
 	def funcFilterAbundanceByMinValue(self, dMinAbundance = 0.0001, iMinSamples = 3):
 		"""
@@ -1324,28 +2702,7 @@ class AbundanceTable:
 		:return	Boolean:	Indicator of the filter running without error. False indicates error.
 		"""
 
-		#No need to do anything
-		if(dMinAbundance==0) or (iMinSamples==0):
-			return True
-
-		#This normalization requires the data to be relative abundance
-		if not self._fIsNormalized:
-			#sys.stderr.write( "Could not filter by sequence occurence because the data is already normalized.\n" )
-			return False
-
-		#Holds which indexes are kept
-		liKeepFeatures = []
-		for iRowIndex, dataRow in enumerate( self._npaFeatureAbundance ):
-			#See which rows meet the criteria and keep the index if needed.
-			if len( filter( lambda d: d >= dMinAbundance, list(dataRow)[1:] ) ) >= iMinSamples:
-				liKeepFeatures.append(iRowIndex)
-
-		#Compress array
-		self._npaFeatureAbundance = self._npaFeatureAbundance[liKeepFeatures,:]
-		#Update filter state
-		self._strCurrentFilterState += ":dMinAbundance=" + str(dMinAbundance) + ",iMinSamples=" + str(iMinSamples)
-
-		return True
+		return self.funcApplyFilters([[c_strFilterMinValue, {"dMinAbundance":dMinAbundance, "iMinSamples":iMinSamples}]])
 
 	#Happy path tested
 	def funcFilterAbundanceBySequenceOccurence(self, iMinSequence = 2, iMinSamples = 2):
@@ -1360,28 +2717,7 @@ class AbundanceTable:
 		:return	Boolean:	Indicator of the filter running without error. False indicates error.
 		"""
 
-		#No need to do anything
-		if(iMinSequence==0) or (iMinSamples==0):
-			return True
-
-		#This normalization requires the data to be reads
-		if self._fIsNormalized:
-			#sys.stderr.write( "Could not filter by sequence occurence because the data is already normalized.\n" )
-			return False
-
-		#Holds which indexes are kept
-		liKeepFeatures = []
-		for iRowIndex, dataRow in enumerate( self._npaFeatureAbundance ):
-			#See which rows meet the criteria and keep the index if needed.
-			if len( filter( lambda d: d >= iMinSequence, list(dataRow)[1:] ) ) >= iMinSamples:
-				liKeepFeatures.append(iRowIndex)
-
-		#Compress array
-		self._npaFeatureAbundance = self._npaFeatureAbundance[[liKeepFeatures]]
-		#Update filter state
-		self._strCurrentFilterState += ":iMinSequence=" + str(iMinSequence) + ",iMinSamples=" + str(iMinSamples)
-
-		return True
+		return self.funcApplyFilters([[c_strFilterSequenceOccurence, {"iMinSequence":iMinSequence, "iMinSamples":iMinSamples}]])
    
 	#1 Happy path test
 	def funcFilterFeatureBySD(self, dMinSDCuttOff = 0.0):
@@ -1393,27 +2729,162 @@ class AbundanceTable:
 		:return	Boolean:	Indicator of success. False indicates error.
 		"""
 
-		#No need to do anything
-		if(dMinSDCuttOff==0.0):
-			return True
+		return self.funcApplyFilters([[c_strFilterSD, {"dMinSDCuttOff":dMinSDCuttOff}]])
 
-		#Holds which indexes are kept
-		liKeepFeatures = []
+	def funcApplyFilters(self, llFilters):
+		"""
+		Runs several feature filters in one pass over the data.
+		Each filter is given as [filter name, {keyword arguments of the single filter function}], for example
+		[[c_strFilterPercentile, {"dPercentileCutOff":95.0, "dPercentageAbovePercentile":1.0}], [c_strFilterMinValue, {"dMinAbundance":0.0001, "iMinSamples":3}]].
+		Filter names are c_strFilterPercentile, c_strFilterMinValue, c_strFilterSequenceOccurence and c_strFilterSD.
+		All filters are evaluated on the current features and a feature is kept only if it passes all filters,
+		so percentile thresholds are always taken from the full distribution of features in a sample.
+		If any filter can not be applied (for instance a filter needing counts on normalized data) no filtering occurs.
+
+		:param	llFilters:	Filters to apply.
+		:type:	List of [String, Dictionary]
+		:return	Boolean:	Indicator of success. False indicates error.
+		"""
+
+		if self._npaFeatureAbundance is None:
+			return False
+
+		npaData = self._funcGetDataMatrix()
+		npaKeep = np.ones(npaData.shape[0], dtype=bool)
+		lsFilterStates = []
+		fBreaksNormalization = False
+		for strFilter, dictArgs in llFilters:
+			lFilterResult = self._funcGetFilterMask(npaData, strFilter, dictArgs)
+			if not lFilterResult:
+				return False
+			npaMask, strFilterState, fDenormalizes = lFilterResult
+			#No need to do anything for this filter
+			if npaMask is None:
+				continue
+			npaKeep &= npaMask
+			lsFilterStates.append(strFilterState)
+			fBreaksNormalization = fBreaksNormalization or fDenormalizes
+
+		if not lsFilterStates:
+			return True
 
-		#Evaluate each sample
-		for iRowIndex, dataRow in enumerate(self._npaFeatureAbundance):
-			if(np.std(list(dataRow)[1:])>=dMinSDCuttOff):
-				liKeepFeatures.append(iRowIndex)
-		
 		#Compress array
-		self._npaFeatureAbundance = self._npaFeatureAbundance[liKeepFeatures,:]
+		self._funcSetStorage(self._funcCompressFeatures(npaKeep))
+		self._lineageIndex = None
 
 		#Update filter state
-		self._strCurrentFilterState += ":dMinSDCuttOff=" + str(dMinSDCuttOff)
+		self._strCurrentFilterState += "".join(lsFilterStates)
 
 		#Table is no longer normalized
-		self._fIsNormalized = False
+		if fBreaksNormalization:
+			self._fIsNormalized = False
+
+		return True
+
+	def _funcGetFilterMask(self, npaData, strFilter, dictArgs):
+		"""
+		Evaluates one feature filter on the data.
+
+		:param	npaData:	Measurements (Row=Features, Columns=Samples)
+		:type:	Numpy 2-D array or scipy CSR matrix
+		:param	strFilter:	Name of the filter (c_strFilterPercentile, c_strFilterMinValue, c_strFilterSequenceOccurence or c_strFilterSD)
+		:type:	String
+		:param	dictArgs:	Keyword arguments of the matching single filter function.
+		:type:	Dictionary
+		:return	List:	[Boolean mask of features to keep (None if the filter has nothing to do), filter state, indicator the filter breaks normalization]
+				False on error.
+		"""
+
+		iSampleCount = npaData.shape[1]
+
+		if strFilter == c_strFilterPercentile:
+			dPercentileCutOff = dictArgs.get("dPercentileCutOff", 95.0)
+			dPercentageAbovePercentile = dictArgs.get("dPercentageAbovePercentile", 1.0)
+
+			#No need to do anything
+			if(dPercentileCutOff==0.0) or (dPercentageAbovePercentile==0.0):
+				return [None, "", False]
 
+			#This filter requires the data to be abundances
+			if not self._funcIsUntransformed("funcFilterAbundanceByPercentile"):
+				return False
+
+			#Scale percentage out of 100
+			dPercentageAbovePercentile = dPercentageAbovePercentile/100.0
+
+			#Get a threshold score of the value at the specified percentile for each sample
+			#Record how many entries for each feature have a value equal to or greater than the threshold
+			#Keep features where the percentage of entries passing is above dPercentageAbovePercentile
+			if npaData.shape[0]:
+				npaScoreAtPercentile = AbundanceMatrix.funcGetColumnPercentiles(npaData, dPercentileCutOff)
+				npaCountPass = AbundanceMatrix.funcCountAtLeast(npaData, npaScoreAtPercentile)
+				npaMask = ( npaCountPass / float(iSampleCount) ) >= dPercentageAbovePercentile
+			else:
+				npaMask = np.ones(0, dtype=bool)
+			return [npaMask, ":dPercentileCutOff=" + str(dPercentileCutOff) + ",dPercentageAbovePercentile=" + str(dPercentageAbovePercentile), True]
+
+		elif strFilter == c_strFilterMinValue:
+			dMinAbundance = dictArgs.get("dMinAbundance", 0.0001)
+			iMinSamples = dictArgs.get("iMinSamples", 3)
+
+			#No need to do anything
+			if(dMinAbundance==0) or (iMinSamples==0):
+				return [None, "", False]
+
+			#This normalization requires the data to be relative abundance
+			if not self._funcIsUntransformed("funcFilterAbundanceByMinValue"):
+				return False
+			if not self._fIsNormalized:
+				#sys.stderr.write( "Could not filter by sequence occurence because the data is already normalized.\n" )
+				return False
+
+			return [AbundanceMatrix.funcCountAtLeast(npaData, dMinAbundance) >= iMinSamples,
+				":dMinAbundance=" + str(dMinAbundance) + ",iMinSamples=" + str(iMinSamples), False]
+
+		elif strFilter == c_strFilterSequenceOccurence:
+			iMinSequence = dictArgs.get("iMinSequence", 2)
+			iMinSamples = dictArgs.get("iMinSamples", 2)
+
+			#No need to do anything
+			if(iMinSequence==0) or (iMinSamples==0):
+				return [None, "", False]
+
+			#This normalization requires the data to be reads
+			if not self._funcIsUntransformed("funcFilterAbundanceBySequenceOccurence"):
+				return False
+			if self._fIsNormalized:
+				#sys.stderr.write( "Could not filter by sequence occurence because the data is already normalized.\n" )
+				return False
+
+			return [AbundanceMatrix.funcCountAtLeast(npaData, iMinSequence) >= iMinSamples,
+				":iMinSequence=" + str(iMinSequence) + ",iMinSamples=" + str(iMinSamples), False]
+
+		elif strFilter == c_strFilterSD:
+			dMinSDCuttOff = dictArgs.get("dMinSDCuttOff", 0.0)
+
+			#No need to do anything
+			if(dMinSDCuttOff==0.0):
+				return [None, "", False]
+
+			return [AbundanceMatrix.funcGetRowStandardDeviations(npaData) >= dMinSDCuttOff, ":dMinSDCuttOff=" + str(dMinSDCuttOff), True]
+
+		sys.stderr.write( "AbundanceTable::funcApplyFilters. Did not recognize filter " + str(strFilter) + ".\n" )
+		return False
+
+	def _funcIsUntransformed(self, strMethod):
+		"""
+		Checks the measurements were not transformed by funcTransformColumns (c_strTransformCLR or c_strTransformArcsineSqrt),
+		filters and normalizations on abundances would treat transformed values as abundances.
+		Writes an error naming the refusing method if they were.
+
+		:param	strMethod:	Name of the method or filter needing abundances.
+		:type:	String
+		:return	Boolean:	True indicates the measurements are not transformed.
+		"""
+
+		if self._strTransform:
+			sys.stderr.write( "AbundanceTable." + strMethod + ". Error=This table was transformed (" + self._strTransform + "), the measurements are not abundances. Did not perform.\n" )
+			return False
 		return True
 
         #Happy path tested 2 tests
@@ -1425,8 +2896,11 @@ class AbundanceTable:
 		#Get the feature names
 		lsFeatures = self.funcGetFeatureNames()
 
-		#Reduce, filter the feature names
-		lsFeatures = [sFeature for sFeature in lsFeatures if not (ValidateData.funcIsValidStringInt(sFeature.split(self.funcGetFeatureDelimiter())[-1]))]
+		#Reduce, filter the feature names, checking each distinct terminal clade once
+		lineage = self.funcGetLineageIndex()
+		dictIsOTU = dict([[sClade, ValidateData.funcIsValidStringInt(sClade)] for sClade in set(lineage.lsClades)])
+		fIsOTU = np.array([dictIsOTU[sClade] for sClade in lineage.lsClades], dtype=bool)
+		lsFeatures = [lsFeatures[iFeature] for iFeature in np.flatnonzero(~fIsOTU[lineage.npaFeatureClade])]
 
 		return self.funcGetFeatureAbundanceTable(lsFeatures)
 
@@ -1443,16 +2917,21 @@ class AbundanceTable:
 			return self.funcNormalizeColumnsBySum()
 
 	#Testing Status: Light happy path testing
-	def funcNormalizeColumnsBySum(self):
+	def funcNormalizeColumnsBySum(self, fFloat32 = False):
 		"""
 		Normalize the data in a manner that is approrpiate for NOT summed data.
 		Normalize the columns (samples) of the abundance table.
 		Normalizes as a fraction of the total (number/(sum of all numbers in the column)).
 		Will not act on summed tables.
 
+		:param	fFloat32:	Indicates the measurements should be held as 32 bit floats (half the memory of 64 bit floats).
+		:type:	Boolean
 		:return	Boolean:	Indicator of success. False indicates error.
 		"""
 
+		if not self._funcIsUntransformed("funcNormalizeColumnsBySum"):
+			return False
+
 		if self._fIsNormalized:
 #			sys.stderr.write( "This table is already normalized, did not perform new normalization request.\n" )
 			return False
@@ -1462,18 +2941,96 @@ class AbundanceTable:
 			return False
 
 		#Normalize
-		for columnName in self.funcGetSampleNames():
-			column = self._npaFeatureAbundance[columnName]
-			columnTotal = sum(column)
-			if(columnTotal > 0.0):
-				column = column/columnTotal
-			self._npaFeatureAbundance[columnName] = column
+		if not self._funcTransformColumns(c_strTransformRelative, fFloat32 = fFloat32):
+			return False
 
 		#Indicate normalization has occured
 		self._fIsNormalized = True
 
 		return True
 
+	def funcTransformColumns(self, strTransform, dPseudoCount = None, fFloat32 = False):
+		"""
+		Transforms the columns (samples) of the abundance table (see AbundanceMatrix.funcTransformColumns).
+		c_strTransformRelative normalizes by the column sums (as funcNormalizeColumnsBySum).
+		c_strTransformCLR gives the centered log-ratio of the measurements, it will not act on summed tables.
+		c_strTransformArcsineSqrt gives the arcsine of the square root of the normalized measurements,
+		the table is normalized first if needed.
+		The transform is recorded (see funcGetTransform) and a table is only transformed once,
+		only c_strTransformRelative marks the table as normalized.
+		After another transform the filters on abundances (percentile, minimum value, sequence occurence)
+		and the normalizations refuse the table.
+		Sparse tables are held dense after the centered log-ratio.
+
+		:param	strTransform:	Transform (c_strTransformRelative, c_strTransformCLR or c_strTransformArcsineSqrt)
+		:type:	String
+		:param	dPseudoCount:	Value replacing zeros before the centered log-ratio, defaults to half of the smallest positive measurement.
+		:type:	Double
+		:param	fFloat32:	Indicates the measurements should be held as 32 bit floats (half the memory of 64 bit floats).
+		:type:	Boolean
+		:return	Boolean:	Indicator of success. False indicates error.
+		"""
+
+		if strTransform == c_strTransformRelative:
+			return self.funcNormalizeColumnsBySum(fFloat32 = fFloat32)
+
+		if self._strTransform:
+			sys.stderr.write( "This table was already transformed (" + self._strTransform + "). Did not perform.\n" )
+			return False
+
+		if strTransform == c_strTransformCLR:
+			if self._fIsSummed:
+				sys.stderr.write( "This table has clades summed, the centered log-ratio is not appropriate. Did not perform.\n" )
+				return False
+		elif not self._fIsNormalized:
+			if not ( self.funcNormalizeColumnsWithSummedClades() if self._fIsSummed else self.funcNormalizeColumnsBySum(fFloat32 = fFloat32) ):
+				return False
+
+		if not self._funcTransformColumns(strTransform, dPseudoCount = dPseudoCount, fFloat32 = fFloat32):
+			return False
+		self._strTransform = strTransform
+		return True
+
+	def _funcTransformColumns(self, strTransform, dPseudoCount = None, fFloat32 = False):
+		"""
+		Transforms the measurements of each column (sample) with AbundanceMatrix.funcTransformColumns.
+		The measurements are transformed in place when they are held (or viewed) as floats of the requested precision,
+		otherwise a converted copy is transformed and replaces them.
+
+		:param	strTransform:	Transform (c_strTransformRelative, c_strTransformCLR or c_strTransformArcsineSqrt)
+		:type:	String
+		:param	dPseudoCount:	Value replacing zeros before the centered log-ratio.
+		:type:	Double
+		:param	fFloat32:	Indicates the measurements should be held as 32 bit floats.
+		:type:	Boolean
+		:return	Boolean:	Indicator of success. False indicates error.
+		"""
+
+		npaData = self._funcGetDataMatrix()
+		if npaData is None:
+			return False
+		fSparse = self._funcIsSparse()
+		dtValue = np.dtype("f4") if fFloat32 else ( npaData.dtype if npaData.dtype.kind == "f" else np.dtype("f8") )
+
+		#The centered log-ratio is dense
+		fToDense = fSparse and ( strTransform == c_strTransformCLR )
+		if fToDense:
+			npaTransformed = npaData.toarray().astype(dtValue, copy = False)
+		elif fSparse:
+			npaTransformed = npaData if npaData.dtype == dtValue else npaData.astype(dtValue)
+		elif ( npaData.dtype == dtValue ) and npaData.flags.writeable and ( self._funcIsColumnar() or np.may_share_memory(npaData, self._npaFeatureAbundance) ):
+			npaTransformed = npaData
+		else:
+			npaTransformed = np.array(npaData, dtype = dtValue)
+
+		if AbundanceMatrix.funcTransformColumns(npaTransformed, strTransform, dPseudoCount = dPseudoCount) is False:
+			return False
+		if fSparse and not fToDense:
+			npaTransformed.eliminate_zeros()
+		if not npaTransformed is npaData:
+			self._funcSetDataMatrix(npaTransformed, fSparse = False if fToDense else None, dtValue = dtValue)
+		return True
+
 	#Happy path tested
 	def funcNormalizeColumnsWithSummedClades(self):
 		"""
@@ -1485,6 +3042,9 @@ class AbundanceTable:
 		:return	Boolean:	Indicator of success. False indicates error.
 		"""
 
+		if not self._funcIsUntransformed("funcNormalizeColumnsWithSummedClades"):
+			return False
+
 		if self._fIsNormalized:
 #			sys.stderr.write( "This table is already normalized, did not perform new summed normalization request.\n" )
 			return False
@@ -1493,84 +3053,79 @@ class AbundanceTable:
 			sys.stderr.write( "This table does not have clades summed, this normalization is not appropriate until the clades are summed. The clades are being summed now before normalization.\n" )
 			self.funcSumClades()
 
-		#Load a hash table with root data {sKey: npaAbundances}
-		hashRoots = {}
-		for npaRow in self._npaFeatureAbundance:
+		if self._funcIsSparse():
+			return self._funcNormalizeSparseWithSummedClades()
 
-			curldAbundance = np.array(list(npaRow)[1:])
-			curFeatureNameLength = len(npaRow[0].split(self._cFeatureDelimiter))
-			curlRootData = hashRoots.get(npaRow[0].split(self._cFeatureDelimiter)[0])
+		#Row of the root (first of the shortest names of a top level clade) of each feature
+		npaRootRows = self.funcGetLineageIndex().funcGetRootRows()
+		npaData = self._funcGetDataMatrix()
 
-			if not curlRootData:
-				hashRoots[npaRow[0].split(self._cFeatureDelimiter)[0]] = [curFeatureNameLength, curldAbundance]
-			elif curlRootData[0] > curFeatureNameLength:
-				hashRoots[npaRow[0].split(self._cFeatureDelimiter)[0]] = [curFeatureNameLength, curldAbundance]
+		#Normalize each feature by thier root feature, measurements with a root of zero become zero
+		npaDenominator = npaData[npaRootRows]
+		dataMatrix = np.zeros(npaData.shape, dtype=npaData.dtype)
+		np.divide(npaData, npaDenominator, out=dataMatrix, where=npaDenominator > 0)
 
-		#Normalize each feature by thier root feature
-		dataMatrix = list()
-		for npaRow in self._npaFeatureAbundance:
-
-			curHashRoot = list(hashRoots[npaRow[0].split(self._cFeatureDelimiter)[0]][1])
-			dataMatrix.append(tuple([npaRow[0]]+[npaRow[i+1]/curHashRoot[i] if curHashRoot[i] > 0 else 0 for i in xrange(len(curHashRoot))]))
-
-		self._npaFeatureAbundance = np.array(dataMatrix,self._npaFeatureAbundance.dtype)
+		self._funcSetDataMatrix(dataMatrix)
 
 		#Indicate normalization has occured
 		self._fIsNormalized = True
 
 		return True
-	
-	def _funcRankAbundanceHelper( self, aaTodo, iRank, lRankAbundance ):
+
+	def _funcNormalizeSparseWithSummedClades(self):
 		"""
-		Helper method for ranking abudance which are tied.
+		Normalizes a summed Abundance Table held in sparse storage.
+		Each stored measurement is divided by the measurement of its root clade in the same sample,
+		measurements with a root of zero become zero.
 
-		:params aaTodo: List of tied ranks to change to a rank.
-		:type:	List of Enumerates of samples.
-		:params iRank: Current Rank
-		:type:	Integer
-		:params lRankAbundance: Sample of abundance
-		:type:	List of integers
+		:return	Boolean:	Indicator of success. False indicates error.
 		"""
 
-		# Subtract one from iRank (each time) to account for next loop iteration
-		# Then average it with itself minus (the length of aaTodo + 1)
-		dRank = ( iRank + iRank - len( aaTodo ) - 1 ) / 2.0
-		for a in aaTodo:
-			lRankAbundance[a[0]] = dRank
+		#Find the row of the root of each feature (the first of the shortest names of a root)
+		npaRootRows = self.funcGetLineageIndex().funcGetRootRows()
+		npaRoots, npaRootOfFeature = np.unique(npaRootRows, return_inverse=True)
+
+		#The root rows are few so are expanded
+		npaData = self._funcGetDataMatrix().copy()
+		npaRootData = npaData[npaRoots].toarray() if len(npaRoots) else np.zeros((0,npaData.shape[1]))
+		npaEntryRoots = npaRootOfFeature[AbundanceMatrix._funcGetEntryRows(npaData)]
+		npaDenominator = npaRootData[npaEntryRoots, npaData.indices]
+		npaPositive = npaDenominator > 0
+		npaData.data[npaPositive] = npaData.data[npaPositive] / npaDenominator[npaPositive]
+		npaData.data[~npaPositive] = 0
+		npaData.eliminate_zeros()
+		self._funcSetDataMatrix(npaData)
 
+		#Indicate normalization has occured
+		self._fIsNormalized = True
+
+		return True
+	
 	#1 Happy path test
 	def funcRankAbundance(self):
 		"""
 		Rank abundances of features with in a sample.
+		The most abundant feature is ranked 0, tied abundances get the average of their ranks.
 
 		:return	AbundanceTable:	Abundance table data ranked (Features with in samples).
 							  None is returned on error.
 		"""
 
-		if self._npaFeatureAbundance == None:
+		if self._npaFeatureAbundance is None:
 			return None
 
-		lsSampleNames = self.funcGetSampleNames()
-		npRankAbundance = self.funcGetAbundanceCopy()
-		liRanks = []
-		#For each sample name get the ranks
-		for sName in lsSampleNames:
-			#Enumerate for order and sort abundances
-			lfSample = list(enumerate(npRankAbundance[sName]))
-			lfSample = sorted(lfSample, key = lambda a: a[1], reverse = True)
-
-			# Accumulate indices until a new value is encountered to detect + handle ties
-			aaTodo = []
-			for i, a in enumerate( lfSample ):
-				if ( not aaTodo ) or ( a[1] == aaTodo[-1][1] ):
-					aaTodo.append( a )
-				else:
-			# Make multiple tied ranks = average of first and last
-					self._funcRankAbundanceHelper( aaTodo, i, npRankAbundance[sName] )
-					aaTodo = [a]
-			self._funcRankAbundanceHelper( aaTodo, i + 1, npRankAbundance[sName] )
-
-		abndRanked = AbundanceTable(npaAbundance=npRankAbundance, dictMetadata=self.funcGetMetadataCopy(),
+		npaData = self._funcGetDataMatrix()
+		iFeatures, iSamples = npaData.shape
+		npRankAbundance = np.empty(npaData.shape, dtype = npaData.dtype if npaData.dtype.kind == "f" else np.dtype("f8"))
+		#Rank blocks of samples at a time, each sample is a row of the transposed block
+		#Descending ranks from 0 are the feature count less the ascending ranks from 1
+		iBlockSamples = max(1, c_iRankBlockSize // max(1, iFeatures))
+		for iStart in xrange(0, iSamples, iBlockSamples):
+			npaBlock = AbundanceMatrix.funcToDense(npaData[:,iStart:iStart+iBlockSamples])
+			npRankAbundance[:,iStart:iStart+iBlockSamples] = ( iFeatures - UtilityMath.funcRankRows(npaBlock.T) ).T
+
+		#Ranks are not sparse
+		abndRanked = AbundanceTable(npaAbundance=self._funcMakeStorage(npRankAbundance, fSparse=False), dictMetadata=self.funcGetMetadataCopy(),
 			strName= self.funcGetName() + "-Ranked",
 			strLastMetadata=self.funcGetLastMetadataName(),
 			cFileDelimiter=self.funcGetFileDelimiter(),
@@ -1597,12 +3152,11 @@ class AbundanceTable:
 		"""
 
 		if iCladeLevel < 1: return False
-		if not self._npaFeatureAbundance == None:
-			liFeatureKeep = []
-			[liFeatureKeep.append(tplFeature[0]) if (len(tplFeature[1][0].split(self.funcGetFeatureDelimiter())) <= iCladeLevel) else 0
-			 for tplFeature in enumerate(self._npaFeatureAbundance)]
+		if not self._npaFeatureAbundance is None:
+			liFeatureKeep = np.flatnonzero(self.funcGetLineageIndex().funcGetFeatureDepths() <= iCladeLevel)
 			#Compress array
-			self._npaFeatureAbundance = self._npaFeatureAbundance[liFeatureKeep,:]
+			self._funcSetStorage(self._funcCompressFeatures(liFeatureKeep))
+			self._lineageIndex = None
 
 			#Update filter state
 			self._strCurrentFilterState += ":iCladeLevel=" + str(iCladeLevel)
@@ -1632,7 +3186,7 @@ class AbundanceTable:
 		lfKeepSamples = [not sSample in setSamples for sSample in self.funcGetSampleNames()]
 		
 		#Reduce the abundance data and update
-		self._npaFeatureAbundance = self._npaFeatureAbundance[[self.funcGetIDMetadataName()]+lsKeepSamples]
+		self._funcSetStorage(self._funcCompressSamples(lsKeepSamples))
 
 		#Reduce the metadata and update
 		for sKey in self._dictTableMetadata:
@@ -1670,56 +3224,25 @@ class AbundanceTable:
 
 		if not self.funcIsSummed():
 
-			#Read in the data
-			#Find the header column (iCol) assumed to be 1 or 2 depending on the location of "NAME"
-			#Create a list (adSeq) that will eventually hold the sum of the columns of data
-			astrHeaders = iCol = None
-			adSeqs = np.array([0] * len(self.funcGetSampleNames()))
-			pTree = CClade( )
-			aastrRaw = []
-
-			#For each row in the npaAbundance
-			#Get the feature name, feature abundances, and sum up the abudance columns
-			#Keep the sum for later normalization
-			#Give a tree the feature name and abundance
-			for dataRow in self._npaFeatureAbundance:
-				
-				sFeatureName = dataRow[0]
-				ldAbundances = list(dataRow)[1:]
-
-				#Add to the sum of the columns (samples)
-				adSeqs = adSeqs + np.array(list(dataRow)[1:])
-
-				#Build tree
-				pTree.get( sFeatureName.split(self._cFeatureDelimiter) ).set( ldAbundances )
-
-			#Create tree of data
-			#Input missing data
-			#Fill hashFeatures with the clade name (key) and a blist of values (value) of the specified level interested.
-			pTree.impute( )
-			hashFeatures = {}
-			pTree.freeze( hashFeatures, c_iSumAllCladeLevels, c_fOutputLeavesOnly )
-			setstrFeatures = hashFeatures.keys( )
+			#Index the clades of the feature names and sum the clades without measurements from their children
+			lineage = self.funcGetLineageIndex()
+			npaData = self._funcGetDataMatrix()
+			if ( not lineage.funcGetCladeCount() ) or ( not npaData.shape[1] ):
+				self._funcSetDataMatrix(np.zeros((0, npaData.shape[1])), [])
+				self._fIsSummed = True
+				return True
+			fSummed = lineage.funcGetSummedClades()
+			npaValues = lineage.funcSumClades(npaData)
 
 			#Remove parent clades that are identical to child clades
-			for strFeature, adCounts in hashFeatures.items( ):
-					astrFeature = strFeature.strip( ).split( "|" )
-					while len( astrFeature ) > 1:
-						astrFeature = astrFeature[:-1]
-						strParent = "|".join( astrFeature )
-						adParent = hashFeatures.get( strParent )
-						if adParent == adCounts:
-							del hashFeatures[strParent]
-							setstrFeatures.remove( strParent )
+			fRemove = lineage.funcGetCladesEqualToDescendant(npaValues, fSummed)
 
-			#Sort features to be nice
-			astrFeatures = sorted( setstrFeatures )
+			#Summed clades are named with the consensus lineage delimiter
+			lsNames = lineage.lsNames if ( self._cFeatureDelimiter == "|" ) else [sName.replace(self._cFeatureDelimiter, "|") for sName in lineage.lsNames]
 
-			#Change the hash table to an array
-			dataMatrix = list()
-			for sFeature in astrFeatures:
-				dataMatrix.append(tuple([sFeature]+list(hashFeatures[sFeature])))
-			self._npaFeatureAbundance=np.array(dataMatrix,self._npaFeatureAbundance.dtype)
+			#Sort features to be nice
+			liClades = sorted(np.flatnonzero(fSummed & ~fRemove), key = lambda iClade: lsNames[iClade])
+			self._funcSetDataMatrix(npaValues[liClades], [lsNames[iClade] for iClade in liClades])
 
 			#Indicate summation has occured
 			self._fIsSummed = True
@@ -1763,7 +3286,7 @@ class AbundanceTable:
 			lfDataIndex = [sData==value for sData in lsMetadata]
 			#Get abundance data for the metadata value
 			#The true is added to keep the first column which should be the feature id
-			npaStratfiedAbundance = self._npaFeatureAbundance[[self.funcGetIDMetadataName()]+list(np.compress(lfDataIndex,lsNames))]
+			npaStratfiedAbundance = self._funcCompressSamples([sName for sName, fData in zip(lsNames,lfDataIndex) if fData])
 
 			#Get metadata for the metadata value
 			dictStratifiedMetadata = dict()
@@ -1778,6 +3301,7 @@ class AbundanceTable:
 				strName=lsNamePieces[0] + "-StratBy-" + value+lsNamePieces[1],
 				strLastMetadata=self.funcGetLastMetadataName(),
 				cFeatureNameDelimiter=self._cFeatureDelimiter, cFileDelimiter = self._cDelimiter)
+			objStratifiedAbundanceTable._strTransform = self._strTransform
 			if fWriteToFile:
 				objStratifiedAbundanceTable.funcWriteToFile(lsNamePieces[0] + "-StratBy-" + value+lsNamePieces[1])
 			#Append abundance table to returning list
@@ -1840,10 +3364,33 @@ class AbundanceTable:
 								None is returned on error.
 		"""
 
-		if not self._npaFeatureAbundance == None:
-			return np.array([list(tplRow)[1:] for tplRow in self._npaFeatureAbundance],'float')
+		if not self._npaFeatureAbundance is None:
+			if self._funcIsSparse():
+				return self._funcGetDataMatrix().toarray().astype('float')
+			return np.array(self._funcGetDataMatrix(),'float')
 		return None
 
+	def funcIsSparse(self):
+		"""
+		Indicates if the measurements are held in a sparse matrix.
+
+		:return	Boolean:	True indicates sparse storage.
+		"""
+
+		return self._funcIsSparse()
+
+	def funcToSparseArray(self):
+		"""
+		Returns a sparse copy of the measurements of the Abundance Table
+		(Row=Features, Columns=Samples in the order of the feature and sample names).
+
+		:return Scipy CSR matrix:	Measurements. None is returned on error.
+		"""
+
+		if self._npaFeatureAbundance is None:
+			return None
+		return AbundanceMatrix.funcMakeSparse(self._funcGetDataMatrix())
+
 	#Happy Path tested
 	def funcWriteToFile(self, xOutputFile, cDelimiter=None, cFileType=ConstantsBreadCrumbs.c_strPCLFile):
 		"""
@@ -1901,16 +3448,16 @@ class AbundanceTable:
 
 		#Write abundance
 		lsOutput = list()
-		curAbundance = self._npaFeatureAbundance.tolist()
+		curAbundance = AbundanceMatrix.funcIterRows(self._funcGetDataMatrix())
 
-		for curAbundanceRow in curAbundance:
+		for sFeature, curAbundanceRow in zip(self.funcGetFeatureNames(), curAbundance):
 			# Make feature metadata, padding with NA as needed
 			lsMetadata = []
 			for sMetadataId in lsRowMetadataIDKeys:
-				lsMetadata = lsMetadata + self.rwmtRowMetadata.funGetFeatureMetadata( curAbundanceRow[0], sMetadataId )
+				lsMetadata = lsMetadata + self.rwmtRowMetadata.funGetFeatureMetadata( sFeature, sMetadataId )
 				lsMetadata = lsMetadata + ( [ ConstantsBreadCrumbs.c_strEmptyDataMetadata ] * 
 					( self.rwmtRowMetadata.dictMetadataIDs.get( sMetadataId, 0 ) - len( lsMetadata ) ) )
-			f.writerows([[curAbundanceRow[0]]+lsMetadata+[str(curAbundanceElement) for curAbundanceElement in curAbundanceRow[1:]]])
+			f.writerows([[sFeature]+lsMetadata+[str(curAbundanceElement) for curAbundanceElement in curAbundanceRow.tolist()]])
 		return
 
 	def _funcWriteBiomFile(self, xOutputFile):
@@ -1930,21 +3477,8 @@ class AbundanceTable:
 		#**************************
 
 		dictMetadataCopy = self.funcGetMetadataCopy()
-		lMetaData = list()
-		iKeysCounter = 0
-		for lMetadataCopyEntry in dictMetadataCopy.iteritems():
-			iKeysCounter +=1
-			sMetadataName = lMetadataCopyEntry[0]
-			lMetadataEntries = lMetadataCopyEntry[1]
-			iMetadataEntryCounter =  -1
-			for sMetadataEntry in lMetadataEntries:
-				iMetadataEntryCounter+=1
-				dictMetadataNames = dict()
-				dictMetadataNames[sMetadataName ] = sMetadataEntry
-				if iKeysCounter == 1:
-					lMetaData.append(dictMetadataNames)
-				else:
-					lMetaData[iMetadataEntryCounter][sMetadataName ] = sMetadataEntry
+		lsMetadataNames = list(dictMetadataCopy.keys())
+		lMetaData = [dict(zip(lsMetadataNames, lSampleEntries)) for lSampleEntries in zip(*[dictMetadataCopy[sMetadataName] for sMetadataName in lsMetadataNames])]
 
 
 		#**************************
@@ -1957,32 +3491,16 @@ class AbundanceTable:
 			
 		lObservationMetadataTable = list()
 
-		lObservationIds = list()
-		lFeatureNamesResultArray = self.funcGetFeatureNames()
-		for sFeatureName  in  lFeatureNamesResultArray:
-			lObservationIds.append(sFeatureName)
-
-			if self.rwmtRowMetadata and self.rwmtRowMetadata.dictRowMetadata:
-				RowMetadataEntry = self.rwmtRowMetadata.dictRowMetadata[sFeatureName][ConstantsBreadCrumbs.c_metadata_lowercase]	
-				lObservationMetadataTable.append( RowMetadataEntry )
+		lObservationIds = list(self.funcGetFeatureNames())
+		if self.rwmtRowMetadata and self.rwmtRowMetadata.dictRowMetadata:
+			dictRowMetadata = self.rwmtRowMetadata.dictRowMetadata
+			lObservationMetadataTable = [dictRowMetadata[sFeatureName][ConstantsBreadCrumbs.c_metadata_lowercase] for sFeatureName in lObservationIds]
 
 		#**************************
 		# Data                    *
 		#**************************
 		
-		lData = list()
-		lAbundanceCopyResultArray = self.funcGetAbundanceCopy()
-
-		for r in lAbundanceCopyResultArray:
-			lr = list(r)
-			lr.pop(0)	#Remove metadata
-			lAbundanceValues = list()
-			for AbundanceEntry in lr:
-				flAbundanceEntry = float(AbundanceEntry)
-				lAbundanceValues.append(flAbundanceEntry)
-			lData.append(lAbundanceValues)
- 
-		arrData =  np.array(lData)  #Convert list to array
+		arrData = self.funcToSparseArray() if self._funcIsSparse() else self.funcToArray()
 
 		
 		
@@ -2030,7 +3548,7 @@ class AbundanceTable:
 				BiomTable = Table(arrData,
 								lObservationIds,
 								lSampNames,
-								lMetaData,
+								sample_metadata = lMetaData,
 								table_id='Breadcrumbs_Generated_Table')
 			else:				#There was metadata in the rows
 				BiomTable = Table(arrData,
@@ -2039,15 +3557,70 @@ class AbundanceTable:
 								lObservationMetadataTable if len(lObservationMetadataTable) > 0 else None,
 								lMetaData,
 								table_id = 'Breadcrumbs_Generated_Table')	
-	  			jsonBiomResults = BiomTable.to_json("Breadcrumbs_AbundanceTable_Program", direct_io=None)
 			#**************************
 			# Generate biom Output    *   
 			#**************************
 			f = open( xOutputFile, "w" ) if isinstance(xOutputFile, str) else xOutputFile
-			f.write(jsonBiomResults)
+			AbundanceTable._funcStreamBiomJson(BiomTable, "Breadcrumbs_AbundanceTable_Program", f)
 			f.close()
 		return
 
+	@staticmethod
+	def _funcStreamBiomJson(BiomTable, strGeneratedBy, ostmOutput):
+		"""
+		Writes a biom Table as BIOM 1.0 JSON to a stream, in the layout of the biom Table.to_json.
+		The sparse data triplets are written in blocks of rows formatted from numpy arrays,
+		so the JSON document is never held in memory as a whole.
+
+		:param	BiomTable:	Table to write.
+		:type:	biom Table
+		:param	strGeneratedBy:	Name of the program generating the file.
+		:type:	String
+		:param	ostmOutput:	Stream to write to.
+		:type:	File stream
+		"""
+
+		npaData = BiomTable.matrix_data.tocsr()
+		iRows, iColumns = npaData.shape
+		ostmOutput.write('{"id": "%s",' % str(BiomTable.table_id))
+		ostmOutput.write('"format": "%s",' % ConstantsBreadCrumbs.c_strBiomJSONFormat)
+		ostmOutput.write('"format_url": "%s",' % ConstantsBreadCrumbs.c_strBiomFormatURL)
+		ostmOutput.write('"generated_by": "%s",' % strGeneratedBy)
+		ostmOutput.write('"date": "%s",' % datetime.now().isoformat())
+		ostmOutput.write('"matrix_element_type": "%s",' % ( "int" if npaData.dtype.kind in "iu" else "float" ))
+		ostmOutput.write('"shape": [%d, %d],' % (iRows, iColumns))
+		ostmOutput.write('"type": null,' if BiomTable.type is None else '"type": "%s",' % BiomTable.type)
+		ostmOutput.write('"matrix_type": "sparse",')
+
+		#Data triplets, in blocks of rows
+		ostmOutput.write('"data": [')
+		strTriplet = "[%d,%d,%d]" if npaData.dtype.kind in "iu" else "[%d,%d,%r]"
+		fHaveWritten = False
+		for iStart in xrange(0, iRows, c_iTextBlockSize):
+			npaBlock = npaData[iStart:iStart+c_iTextBlockSize]
+			npaNonZero = npaBlock.data != 0
+			if not np.any(npaNonZero):
+				continue
+			npaEntryRows = AbundanceMatrix._funcGetEntryRows(npaBlock)[npaNonZero] + iStart
+			if fHaveWritten:
+				ostmOutput.write(",")
+			ostmOutput.write(",".join(map(strTriplet.__mod__, zip(npaEntryRows.tolist(), npaBlock.indices[npaNonZero].tolist(), npaBlock.data[npaNonZero].tolist()))))
+			fHaveWritten = True
+		ostmOutput.write("],")
+
+		#Row and column ids and metadata
+		for strAxis, strKey, strEnd in [["observation", ConstantsBreadCrumbs.c_rows, "],"], ["sample", ConstantsBreadCrumbs.c_columns, "]"]]:
+			lsIDs = BiomTable.ids(axis = strAxis)
+			lMetadata = BiomTable.metadata(axis = strAxis)
+			ostmOutput.write('"%s": [' % strKey)
+			for iStart in xrange(0, len(lsIDs), c_iTextBlockSize):
+				if iStart:
+					ostmOutput.write(",")
+				ostmOutput.write(",".join(['{"id": %s, "metadata": %s}' % (json.dumps(sID), json.dumps(lMetadata[iIndex] if lMetadata is not None else None))
+					for iIndex, sID in enumerate(lsIDs[iStart:iStart+c_iTextBlockSize], iStart)]))
+			ostmOutput.write(strEnd)
+		ostmOutput.write("}")
+
 	#Testing Status: 1 Happy path test
 	@staticmethod
 	def funcPairTables(strFileOne, strFileTwo, strIdentifier, cDelimiter, strOutFileOne, strOutFileTwo, lsIgnoreValues=None):
@@ -2251,7 +3824,7 @@ class AbundanceTable:
 	#* 2. _funcDecodeBiomMetadata              *
 	#*******************************************	
 	@staticmethod
-	def _funcBiomToStructuredArray(xInputFile = None):	
+	def _funcBiomToStructuredArray(xInputFile = None, fColumnar = False, fSparse = False):	
 		"""
 		Reads the biom input file and builds a "BiomCommonArea"  that contains:
 		1.BiomCommonArea['sLastMetadata'] - This is the name of the last Metadata (String)
@@ -2259,95 +3832,71 @@ class AbundanceTable:
  		3.BiomCommonArea['Metadata']   - dict() -  going to be used as lcontents[1]==MetaData
 		4.BiomCommonArea['BiomFileInfo'] - dict() - going to be used as lcontents[2]==FileInfo (id, format:eg. Biological Observation Matrix 0.9.1) etc.
 		5.BiomCommonArea['column_metadata_id'] - This is a string which is the name of the column id
+		The file is read with the BiomReader, the measurements go into the TaxData without per value python work.
   		:param	xInputFile:	File path of biom file to read.
 		:type:	String	File path.
+		:param	fColumnar:	Build the TaxData as columnar storage (AbundanceMatrix) instead of a structured array.
+		:type:	Boolean
+		:param	fSparse:	Keep the TaxData in columnar sparse storage if the file is flagged as sparse or is sparse.
+		:type:	Boolean
 		:return:   BiomCommonArea  (See description above)
 		:type:	dict()		
 		"""	
  
-		#*******************************************
-		#* Build the metadata                      *
-		#*******************************************
- 
-		try:
-			BiomTable = parse_biom_table(open(xInputFile,'U') if isinstance(xInputFile, str) else xInputFile)	#Import the biom file
-		except:
+		readerBiom = BiomReader(xInputFile)
+		if readerBiom.fError:
 			print("Failure decoding biom file - please check your input biom file and rerun")
 			BiomCommonArea = None
 			return BiomCommonArea
  
 		BiomCommonArea = dict()		
-		dBugNames = list()			#Bug Names Table
 		dRowsMetadata = None		#Initialize the np.array of the Rows metadata
-		
-		#*******************************************
-		#* Handle  biom2 environment               *
-		#*******************************************
-		try:
-					BiomElements  =  BiomTable.getBiomFormatObject('')	 #For biom1
-		except:
-					BiomElements =   json.loads(BiomTable.to_json("Generated_by_AbundanceTable_Prog",direct_io=None))
- 					
-					
-		for BiomKey, BiomValue in BiomElements.iteritems():
+
 		#****************************************************
 		#*     Checking the different keys:  format,        *
-		#*     rows, columns, date, generated_by            *
+		#*     date, generated_by                           *
 		#****************************************************
+		for BiomKey, BiomValue in readerBiom.dictFileInfo.iteritems():
 			if (BiomKey == ConstantsBreadCrumbs.c_strFormatKey  
 			or BiomKey == ConstantsBreadCrumbs.c_strFormatUrl  
 			or BiomKey == ConstantsBreadCrumbs.c_MatrixTtype
 			or BiomKey == ConstantsBreadCrumbs.c_strTypekey
-			or BiomKey == ConstantsBreadCrumbs.c_strIDKey #Same as below
-			or BiomKey == ConstantsBreadCrumbs.c_GeneratedBy  #<---Need to follow up with Biom as always BiomValue = "" even though in the file has a value
-			or BiomKey == ConstantsBreadCrumbs.c_strDateKey):  #Same as above
+			or BiomKey == ConstantsBreadCrumbs.c_strIDKey
+			or BiomKey == ConstantsBreadCrumbs.c_GeneratedBy
+			or BiomKey == ConstantsBreadCrumbs.c_strDateKey):
 				BiomCommonArea = AbundanceTable._funcInsertKeyToCommonArea(BiomCommonArea, BiomKey, BiomValue)
 
+		#*******************************************
+		#* Build the rows and columns metadata     *
+		#*******************************************
+		lsBugNames = [str(sBugName) for sBugName in readerBiom.funcGetRowIDs()]
+		iMaxIdLen = max([len(sBugName) for sBugName in lsBugNames] or [0])	#We  are calculating dynamically the length of the ID
+		if readerBiom.funcHasRowMetadata():
+			dRowsMetadata = AbundanceTable._funcBiomBuildRowMetadata(readerBiom.funcGetRows(), iMaxIdLen)
+		BiomCommonArea = AbundanceTable._funcDecodeBiomMetadata(BiomCommonArea, readerBiom.funcGetColumns(), iMaxIdLen)	#Call the subroutine to Build the metadata
 
-			if BiomKey == ConstantsBreadCrumbs.c_rows:
-				iMaxIdLen = 0 
-				for iIndexRowMetaData in range(0, len(BiomValue)):
-					if ConstantsBreadCrumbs.c_id_lowercase in BiomValue[iIndexRowMetaData]:
-						sBugName = BiomValue[iIndexRowMetaData][ConstantsBreadCrumbs.c_id_lowercase]
-						dBugNames.append(sBugName) 	 #Post to the bug table
-						if len(sBugName) > iMaxIdLen:    #We  are calculating dynamically the length of the ID
-							iMaxIdLen  =  len(sBugName)
-				
-
-				if ConstantsBreadCrumbs.c_metadata_lowercase in BiomValue[0] and BiomValue[0][ConstantsBreadCrumbs.c_metadata_lowercase] != None :
- 					dRowsMetadata = AbundanceTable._funcBiomBuildRowMetadata(BiomValue,  iMaxIdLen )
-
- 
-			if BiomKey == ConstantsBreadCrumbs.c_columns:
-				BiomCommonArea = AbundanceTable._funcDecodeBiomMetadata(BiomCommonArea, BiomValue, iMaxIdLen)	#Call the subroutine to Build the metadata
- 
-	 
 		#*******************************************
 		#* Build the TaxData                       *
 		#*******************************************
- 
-	
-	
-		BiomTaxDataWork = list()			#Initlialize TaxData
-		try:
-			BiomObservations = BiomTable.iterObservations(conv_to_np=True)		#Invoke biom1 method to fetch data from the biom file
-		except:
-			BiomObservations =  BiomTable.iter(axis="observation") 			#If it failed - we try biom2
-
-		for BiomObservationData in BiomObservations:
-			sBugName = str( BiomObservationData[1])
-			BiomTaxDataEntry = list()
-			BiomTaxDataEntry.append(sBugName)
-			BiomObservationsValues = BiomObservationData[0]
-			for BiomDataValue in BiomObservationsValues:
-				BiomTaxDataEntry.append(BiomDataValue)
-			BiomTaxDataWork.append(tuple(BiomTaxDataEntry))	
-	
-		BiomCommonArea[ConstantsBreadCrumbs.c_BiomTaxData] = np.array(BiomTaxDataWork,dtype=np.dtype(BiomCommonArea[ConstantsBreadCrumbs.c_Dtype]))
+		BiomDtype = BiomCommonArea[ConstantsBreadCrumbs.c_Dtype]
+		lsSampleNames = [BiomDtypeEntry[0] for BiomDtypeEntry in BiomDtype[1:]]
+		npaBugNames = np.array(lsBugNames, dtype = BiomDtype[0][1])
+		npaData = readerBiom.npaData.astype(ConstantsBreadCrumbs.c_f4)
+		fFlaggedSparse = readerBiom.dictFileInfo.get(ConstantsBreadCrumbs.c_MatrixTtype) == ConstantsBreadCrumbs.c_strSparseMatrixType
+		if fSparse and ( fFlaggedSparse or AbundanceMatrix.funcGetDensity(npaData) <= c_dSparseDensity ):
+			npaData = AbundanceMatrix.funcMakeSparse(npaData) if not scipy.sparse.issparse(npaData) else npaData
+		elif scipy.sparse.issparse(npaData):
+			npaData = npaData.toarray()
+
+		if fColumnar or fSparse:
+			BiomCommonArea[ConstantsBreadCrumbs.c_BiomTaxData] = AbundanceMatrix(npaData = npaData, lsFeatureIDs = npaBugNames,
+				lsSampleIDs = lsSampleNames, strIDName = BiomDtype[0][0])
+		else:
+			BiomCommonArea[ConstantsBreadCrumbs.c_BiomTaxData] = AbundanceMatrix.funcMakeStructuredArray(npaData, npaBugNames,
+				lsSampleNames, BiomDtype[0][0], dtID = npaBugNames.dtype, dtValue = np.dtype(ConstantsBreadCrumbs.c_f4))
 		BiomCommonArea[ConstantsBreadCrumbs.c_dRowsMetadata] = RowMetadata(dRowsMetadata)
 		del(BiomCommonArea[ConstantsBreadCrumbs.c_Dtype])			#Not needed anymore
  
- 
 		return BiomCommonArea
 	
 
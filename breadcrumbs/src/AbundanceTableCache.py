@@ -0,0 +1,312 @@
+"""
+Author: Timothy Tickle
+Description: On-disk binary cache of parsed abundance tables.
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+#Import libaries
+import cPickle as pickle
+import hashlib
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+class AbundanceTableCache:
+    """
+    Stores parsed abundance tables in a directory as numpy binary files (.npy) plus a pickled header.
+    Entries are keyed by the source file path, its modification time and size and the arguments used to parse it.
+    Arrays are memory-mapped (copy-on-write) when an entry is loaded.
+    An entry is invalidated when its source file changes and the least recently used entries are evicted
+    when the cache grows over its size limit.
+    Entries can also be keyed by their content (see funcGetContentKeys), for example results computed from a table.
+    """
+
+    #Name of the header file in an entry
+    c_strHeaderFile = "header.pkl"
+
+    #Keys in the header file for the source file path and the stored header
+    c_strHeaderSourceKey = "SourceFile"
+    c_strHeaderDataKey = "Header"
+
+    #Stamp key of entries keyed by their content, which are never stale
+    c_strContentStamp = "content"
+
+    #Extension of the array files in an entry
+    c_strArrayExtension = ".npy"
+
+    #Default limit to the size of the cache in bytes (2 GB)
+    c_iDefaultMaxBytes = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, strDirectory, iMaxBytes = c_iDefaultMaxBytes):
+        """
+        Constructor, will create the cache directory if needed.
+
+        :param strDirectory: Directory holding the cache entries
+        :type: String path
+        :param iMaxBytes: Limit to the size of the cache, the least recently used entries are removed when the cache is larger.
+        :type: Integer
+        """
+
+        self.strDirectory = strDirectory
+        self.iMaxBytes = iMaxBytes
+        if not os.path.isdir(strDirectory):
+            os.makedirs(strDirectory)
+
+    @staticmethod
+    def funcGetKeys(strFilePath, lParseArguments):
+        """
+        Returns the keys of a cache entry.
+        The source key identifies the file and how it is parsed, the stamp key identifies the version of the file.
+
+        :param strFilePath: Path of the source file
+        :type: String path
+        :param lParseArguments: Arguments used to parse the file (delimiter, ids, ...)
+        :type: List
+        :return List: [source key, stamp key] as strings, None if the file can not be found.
+        """
+
+        if not os.path.isfile(strFilePath):
+            return None
+        statFile = os.stat(strFilePath)
+        strSourceKey = hashlib.sha1(repr([os.path.abspath(strFilePath)]+list(lParseArguments))).hexdigest()
+        strStampKey = hashlib.sha1(repr([statFile.st_mtime, statFile.st_size])).hexdigest()
+        return [strSourceKey, strStampKey]
+
+    @staticmethod
+    def funcGetContentKeys(lKey):
+        """
+        Returns the keys of a cache entry identified by its content rather than by a source file.
+
+        :param lKey: What identifies the entry (hashes of the data, arguments of a computation, ...)
+        :type: List
+        :return List: [source key, stamp key] as strings
+        """
+
+        return [hashlib.sha1(repr(list(lKey))).hexdigest(), AbundanceTableCache.c_strContentStamp]
+
+    def _funcGetEntries(self, strSourceKey = None):
+        """
+        Returns the entry directory names in the cache, optionally only those of one source key.
+        """
+
+        return [sEntry for sEntry in os.listdir(self.strDirectory)
+                if ( "-" in sEntry ) and ( not sEntry.startswith(".") ) and ( ( strSourceKey is None ) or sEntry.split("-")[0] == strSourceKey )]
+
+    def funcLoad(self, strFilePath, lParseArguments):
+        """
+        Loads an entry from the cache.
+
+        :param strFilePath: Path of the source file
+        :type: String path
+        :param lParseArguments: Arguments used to parse the file (delimiter, ids, ...)
+        :type: List
+        :return List: [Dictionary of memory-mapped numpy arrays {name: array}, header] or None if not in the cache.
+        """
+
+        lsKeys = AbundanceTableCache.funcGetKeys(strFilePath, lParseArguments)
+        if not lsKeys:
+            return None
+        lCached = self._funcLoadEntry(lsKeys)
+        if lCached is None:
+            #Entries of older versions of the file are stale
+            self.funcInvalidate(strFilePath, lParseArguments)
+        return lCached
+
+    def funcLoadContent(self, lKey):
+        """
+        Loads an entry keyed by its content from the cache.
+
+        :param lKey: What identifies the entry (see funcGetContentKeys)
+        :type: List
+        :return List: [Dictionary of memory-mapped numpy arrays {name: array}, header] or None if not in the cache.
+        """
+
+        return self._funcLoadEntry(AbundanceTableCache.funcGetContentKeys(lKey))
+
+    def _funcLoadEntry(self, lsKeys):
+        """
+        Loads the entry of the given keys, None if it is not in the cache or can not be read.
+        """
+
+        strEntry = os.path.join(self.strDirectory, "-".join(lsKeys))
+        strHeader = os.path.join(strEntry, AbundanceTableCache.c_strHeaderFile)
+        if not os.path.isfile(strHeader):
+            return None
+
+        try:
+            with open(strHeader, "rb") as hndlHeader:
+                xHeader = pickle.load(hndlHeader)[AbundanceTableCache.c_strHeaderDataKey]
+            dictArrays = {}
+            for sFile in os.listdir(strEntry):
+                if sFile.endswith(AbundanceTableCache.c_strArrayExtension):
+                    dictArrays[sFile[:-len(AbundanceTableCache.c_strArrayExtension)]] = np.load(os.path.join(strEntry, sFile), mmap_mode = "c")
+        except Exception as e:
+            sys.stderr.write("AbundanceTableCache::funcLoad. Could not read cache entry " + strEntry + ". " + str(e) + "\n")
+            shutil.rmtree(strEntry, ignore_errors = True)
+            return None
+
+        #Mark as recently used
+        os.utime(strHeader, None)
+        return [dictArrays, xHeader]
+
+    def funcStore(self, strFilePath, lParseArguments, dictArrays, xHeader):
+        """
+        Stores an entry in the cache, replacing entries for older versions of the file and evicting
+        the least recently used entries if the cache is over its size limit.
+
+        :param strFilePath: Path of the source file
+        :type: String path
+        :param lParseArguments: Arguments used to parse the file (delimiter, ids, ...)
+        :type: List
+        :param dictArrays: Numpy arrays to store {name: array}, names must be usable as file names
+        :type: Dictionary
+        :param xHeader: Any other (picklable) data of the entry
+        :type: Object
+        :return Boolean: Indicator of success
+        """
+
+        lsKeys = AbundanceTableCache.funcGetKeys(strFilePath, lParseArguments)
+        if not lsKeys:
+            return False
+        self.funcInvalidate(strFilePath, lParseArguments)
+        return self._funcStoreEntry(lsKeys, dictArrays, xHeader, os.path.abspath(strFilePath))
+
+    def funcStoreContent(self, lKey, dictArrays, xHeader):
+        """
+        Stores an entry keyed by its content in the cache, evicting the least recently used entries
+        if the cache is over its size limit.
+
+        :param lKey: What identifies the entry (see funcGetContentKeys)
+        :type: List
+        :param dictArrays: Numpy arrays to store {name: array}, names must be usable as file names
+        :type: Dictionary
+        :param xHeader: Any other (picklable) data of the entry
+        :type: Object
+        :return Boolean: Indicator of success
+        """
+
+        lsKeys = AbundanceTableCache.funcGetContentKeys(lKey)
+        shutil.rmtree(os.path.join(self.strDirectory, "-".join(lsKeys)), ignore_errors = True)
+        return self._funcStoreEntry(lsKeys, dictArrays, xHeader, None)
+
+    def _funcStoreEntry(self, lsKeys, dictArrays, xHeader, strSource):
+        """
+        Stores the entry of the given keys, strSource is the absolute path of its source file (None for content entries).
+        """
+
+        #Write to a temporary directory and move it in place so partial entries are never read
+        strTemp = tempfile.mkdtemp(prefix = ".", dir = self.strDirectory)
+        try:
+            for sName, npaArray in dictArrays.items():
+                np.save(os.path.join(strTemp, sName + AbundanceTableCache.c_strArrayExtension), np.asarray(npaArray))
+            with open(os.path.join(strTemp, AbundanceTableCache.c_strHeaderFile), "wb") as hndlHeader:
+                pickle.dump({AbundanceTableCache.c_strHeaderSourceKey:strSource,
+                    AbundanceTableCache.c_strHeaderDataKey:xHeader}, hndlHeader, pickle.HIGHEST_PROTOCOL)
+            os.rename(strTemp, os.path.join(self.strDirectory, "-".join(lsKeys)))
+        except Exception as e:
+            sys.stderr.write("AbundanceTableCache::funcStore. Could not write cache entry " + "-".join(lsKeys) + " (" + str(strSource) + "). " + str(e) + "\n")
+            shutil.rmtree(strTemp, ignore_errors = True)
+            return False
+
+        self.funcEvict()
+        return True
+
+    def funcInvalidate(self, strFilePath, lParseArguments = None):
+        """
+        Removes the entries of a source file.
+
+        :param strFilePath: Path of the source file
+        :type: String path
+        :param lParseArguments: Arguments used to parse the file, if None the entries for all parse arguments are removed.
+        :type: List
+        """
+
+        if lParseArguments is None:
+            strFile = os.path.abspath(strFilePath)
+            for sEntry in self._funcGetEntries():
+                try:
+                    with open(os.path.join(self.strDirectory, sEntry, AbundanceTableCache.c_strHeaderFile), "rb") as hndlHeader:
+                        fRemove = ( pickle.load(hndlHeader).get(AbundanceTableCache.c_strHeaderSourceKey) == strFile )
+                except Exception:
+                    fRemove = True
+                if fRemove:
+                    shutil.rmtree(os.path.join(self.strDirectory, sEntry), ignore_errors = True)
+            return
+
+        lsKeys = AbundanceTableCache.funcGetKeys(strFilePath, lParseArguments)
+        strSourceKey = lsKeys[0] if lsKeys else hashlib.sha1(repr([os.path.abspath(strFilePath)]+list(lParseArguments))).hexdigest()
+        for sEntry in self._funcGetEntries(strSourceKey):
+            shutil.rmtree(os.path.join(self.strDirectory, sEntry), ignore_errors = True)
+
+    def funcClear(self):
+        """
+        Removes all entries from the cache.
+        """
+
+        for sEntry in self._funcGetEntries():
+            shutil.rmtree(os.path.join(self.strDirectory, sEntry), ignore_errors = True)
+
+    def _funcGetEntrySize(self, sEntry):
+        """
+        Returns the size in bytes of an entry.
+        """
+
+        strEntry = os.path.join(self.strDirectory, sEntry)
+        return sum([os.path.getsize(os.path.join(strEntry, sFile)) for sFile in os.listdir(strEntry)])
+
+    def funcGetSize(self):
+        """
+        Returns the size in bytes of all entries in the cache.
+
+        :return Integer: Bytes
+        """
+
+        return sum([self._funcGetEntrySize(sEntry) for sEntry in self._funcGetEntries()])
+
+    def funcEvict(self):
+        """
+        Removes the least recently used entries until the cache is within its size limit.
+        """
+
+        lEntries = []
+        for sEntry in self._funcGetEntries():
+            strHeader = os.path.join(self.strDirectory, sEntry, AbundanceTableCache.c_strHeaderFile)
+            dTime = os.path.getmtime(strHeader) if os.path.isfile(strHeader) else 0
+            lEntries.append([dTime, sEntry, self._funcGetEntrySize(sEntry)])
+
+        iSize = sum([lEntry[2] for lEntry in lEntries])
+        for dTime, sEntry, iEntrySize in sorted(lEntries):
+            if iSize <= self.iMaxBytes:
+                break
+            shutil.rmtree(os.path.join(self.strDirectory, sEntry), ignore_errors = True)
+            iSize -= iEntrySize
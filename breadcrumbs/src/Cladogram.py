@@ -37,11 +37,18 @@ from AbundanceTable import AbundanceTable
 from CommandLine import CommandLine
 from ConstantsBreadCrumbs import ConstantsBreadCrumbs
 from ConstantsFiguresBreadCrumbs import ConstantsFiguresBreadCrumbs
+from LineageIndex import LineageIndex
+import collections
+import copy
+import imp
 import math
+import multiprocessing
 import numpy as np
 import os
 import re
 import scipy.stats
+import sys
+import time
 from ValidateData import ValidateData
 #import scipy.stats.stats as stats
 
@@ -61,6 +68,14 @@ class Cladogram:
   c_sAlpha="Alpha"
   c_sForced="Forced"
 
+  #Keys of the circlader file data held for in-process rendering
+  c_sTreeFile="TreeFile"
+  c_sCircleFile="CircleFile"
+  c_sColorFile="ColorFile"
+  c_sTickFile="TickFile"
+  c_sHighLightFile="HighLightFile"
+  c_sSizeFile="SizeFile"
+
   #Numpy array (structured array) holding data
   #Should be SampleID, Sample Abundances/Data (samples = columns).....
   npaAbundance = None
@@ -100,6 +115,17 @@ class Cladogram:
   strSizeFilePath="_Size.txt"
   strStyleFilePath=""
 
+  #Lines of the circlader files {file key: list of strings} when rendering in process, None when the files are written
+  dictCircladerData = None
+  #Parsed circlader styles shared by all cladograms {(style file path, modification time): style options}
+  dictStyleCache = dict()
+
+  #Batch generation
+  #Number of jobs waiting for or being drawn by each process
+  c_iBatchJobsPerProcess = 2
+  #Number of cladograms a process draws before it is replaced (releases the memory held by the plotting libraries)
+  c_iBatchJobsPerChild = 50
+
   #Thresholds
   #Controls the showing of taxa
   c_dPercentileCutOff = 90.0
@@ -172,9 +198,15 @@ class Cladogram:
     """
     self.strRoot = strRoot
 
-  def generate(self, strImageName, strStyleFile, sTaxaFileName, strCircladerScript = ConstantsBreadCrumbs.c_strCircladerScript, iTerminalCladeLevel = 10, sColorFileName=None, sTickFileName=None, sHighlightFileName=None, sSizeFileName=None, sCircleFileName=None):
+  def generate(self, strImageName, strStyleFile, sTaxaFileName, strCircladerScript = ConstantsBreadCrumbs.c_strCircladerScript, iTerminalCladeLevel = 10, sColorFileName=None, sTickFileName=None, sHighlightFileName=None, sSizeFileName=None, sCircleFileName=None, fInProcess=True):
     """
     This is the method to call to generate a cladogram using circlader.
+    In both modes the image and each circlader file given a name and having data are written:
+    the taxa (tree) file, and the color, tick, highlight, size and circle files when their data is set.
+    With fInProcess the cladogram is drawn in this process with the circlader library from the data held in memory,
+    a file without a name is then only held in memory.
+    Otherwise, or if the library can not be imported (or fails), the circlader script is called on the files,
+    data of a file without a name can then not be drawn.
     The default data file is an abundance table unless the getDa function is overwritten.
 
     :param strImageName: File name to save the output cladogram image
@@ -197,6 +229,9 @@ class Cladogram:
     :type: strSizeFile File path (string)
     :param sCircleFileName: File path of circlader circle file.
     :type: String
+    :param fInProcess: Indicates the cladogram should be drawn in this process (True) or by calling the circlader script (False).
+    :type: Boolean
+    :return boolean: True indicates success, false indicates error
     """
 
     if self.npaAbundance == None:
@@ -212,6 +247,10 @@ class Cladogram:
     #Check files exist and remove files which will be written
     self.manageFilePaths(sTaxaFileName, strStyleFile, sColorFileName, sTickFileName, sHighlightFileName, sSizeFileName, sCircleFileName)
 
+    #Hold the circlader data in memory if drawing in process
+    circlader = Cladogram.funcGetCircladerLibrary(strCircladerScript) if fInProcess else None
+    self.dictCircladerData = dict() if circlader else None
+
     #Get IDs
     lsIDs = [strId for strId in list(self.npaAbundance[self.strSampleID])]
 
@@ -258,18 +297,19 @@ class Cladogram:
       lsIDs = self.filterByCladeSize(lsIDs)
 
     #Add in forced highlighting
-    lsIDs.extend(self.dictForcedHighLights.keys())
-    lsIDs = list(set(lsIDs))
+    if self.dictForcedHighLights is not None:
+      lsIDs.extend(sorted(self.dictForcedHighLights.keys()))
+      lsIDs = Cladogram.funcGetUniqueInOrder(lsIDs)
 
     #Add in forced circle data
-    for dictCircleData in self.ldictCircleData:
+    for dictCircleData in (self.ldictCircleData or []):
       if(dictCircleData[self.c_sForced]):
         lsTaxa = dictCircleData[self.c_sTaxa]
         lsAlpha = dictCircleData[self.c_sAlpha]
         lsAddTaxa = []
         [lsAddTaxa.append(lsTaxa[tpleAlpha[0]]) if not tpleAlpha[1] == '0.0' else 0 for tpleAlpha in enumerate(lsAlpha)]
         lsIDs.extend(lsAddTaxa)
-    lsIDs = list(set(lsIDs))
+    lsIDs = Cladogram.funcGetUniqueInOrder(lsIDs)
 
     #Create circle files (needs to be after any filtering because it has a forcing option).
     if not self.createCircleFile(lsIDs):
@@ -285,20 +325,27 @@ class Cladogram:
 
     #Generate / write color file
     if(self.dictColors is not None):
-        lsColorData = [ConstantsBreadCrumbs.c_cTab.join([sColorKey,self.dictColors[sColorKey]]) for sColorKey in self.dictColors]
-        self.writeToFile(self.strColorFilePath, ConstantsBreadCrumbs.c_strEndline.join(lsColorData), False)
+        lsColorData = [ConstantsBreadCrumbs.c_cTab.join([sColorKey,self.dictColors[sColorKey]]) for sColorKey in sorted(self.dictColors)]
+        self.outputCircladerFile(self.c_sColorFile, self.strColorFilePath, lsColorData)
         self.fColorFileMade=True
 
     #Generate / write tick file
     if(self.llsTicks is not None):
         lsTickData = [ConstantsBreadCrumbs.c_cTab.join(lsTicks) for lsTicks in self.llsTicks]
-        self.writeToFile(self.strTickFilePath, ConstantsBreadCrumbs.c_strEndline.join(lsTickData), False)
+        self.outputCircladerFile(self.c_sTickFile, self.strTickFilePath, lsTickData)
         self.fTickFileMade=True
 
     #Generate / Write size data
     if not self.createSizeFile(lsIDs):
       return False
 
+    #Draw in process
+    if self.dictCircladerData is not None:
+      if self.renderInProcess(circlader):
+        return True
+      #Fall back on the circlader script
+      self.releaseCircladerData()
+
     #Call commandline
     lsCommand = [self.circladerScript, self.strTreeFilePath, self.strImageName, "--style_file", self.strStyleFilePath, "--tree_format", "tabular"]
     if(self.fSizeFileMade):
@@ -311,7 +358,7 @@ class Cladogram:
       lsCommand.extend(["--highlight_file", self.strHighLightFilePath])
     if(self.fCircleFileMade):
       lsCommand.extend(["--circle_file", self.strCircleFilePath])
-    CommandLine().runCommandLine(lsCommand)
+    return CommandLine().runCommandLine(lsCommand)
 
   #Happy path tested
   def setColorData(self, dictColors):
@@ -467,16 +514,16 @@ class Cladogram:
     """
     Write circle data to file.
 
-    :param lsIDs: Ids to include in the circle file
+    :param lsIDs: Ids to include in the circle file, the taxa of forced circles are added to it
     :type: lsIDs List of strings
     """
     #If there is circle data
     if(not self.ldictCircleData == None):
-      if self.strCircleFilePath == None:
+      if (self.strCircleFilePath == None) and (self.dictCircladerData is None):
         print("Error, there is no circle file specified to write to.")
         return False
-      #Holds circle data {Taxaname:string updates correctly for output to file}
-      dictCircleDataMethods = dict()
+      #Holds circle data {Taxaname:string updates correctly for output to file} in the order the taxa are found
+      dictCircleDataMethods = collections.OrderedDict()
       lsCircleData = list()
 
       for dictCircleData in self.ldictCircleData:
@@ -563,67 +610,41 @@ class Cladogram:
           if not fFound:
             self.llsTicks.append([str(iHighestNumber+1),strCircleName])
 
-        #If the circle is forced, add the taxa to the lsIDs
+        #If the circle is forced, add the taxa to the lsIDs (in place, for the caller)
         #Otherwise we will only plot those that are matching 
         #the lsIDs and the circle taxa list.
         if dictCircleData[self.c_sForced]:
-          for iAlpha in xrange(0,len(datAlpha)):
-            if(not datAlpha[iAlpha] == "0.0"):
-              lsIDs.append(lsTaxa[iAlpha])
-          lsIDs = list(set(lsIDs))
+          lsIDs.extend([lsTaxa[iAlpha] for iAlpha in xrange(0,len(datAlpha)) if not datAlpha[iAlpha] == "0.0"])
+          lsIDs[:] = Cladogram.funcGetUniqueInOrder(lsIDs)
+
+        #Index of each taxa in the circle data (first occurence)
+        dictTaxaIndex = dict()
+        for iTaxaIndex, sTaxa in enumerate(lsTaxa):
+          dictTaxaIndex.setdefault(sTaxa, iTaxaIndex)
 
         #For all taxa in the cladogram
         for sTaxa in lsTaxa:
-          #Store circle content name in dictionary
+          #Store circle content name (. delimited) in dictionary
           if not sTaxa in dictCircleDataMethods:
-            #Reset name to . delimited
-            asNameElements = filter(None,re.split("\|",sTaxa))
-
-            sCurTaxaName = asNameElements[len(asNameElements)-1]
-            if(len(asNameElements)>1):
-              if(sCurTaxaName=="unclassified"):
-                sCurTaxaName = ".".join([asNameElements[len(asNameElements)-2],sCurTaxaName])
-            sCurTaxa = ".".join(asNameElements)
-            #Add to dictionary
-            dictCircleDataMethods[sTaxa] = sCurTaxa
-
-          #If the taxa is in the selected method
-          if sTaxa in lsTaxa:
-            #Index of the id in the circle data
-            iTaxaIndex = lsTaxa.index(sTaxa)
-            #Get border
-            sBorder = ""
-            if(fBorderIsList):
-              sBorder = str(datBorder[iTaxaIndex])
-            else:
-              sBorder = str(datBorder)
-            #Get shape
-            sShape = ""
-            if(fShapeIsList):
-              sShape = datShape[iTaxaIndex]
-            else:
-              sShape = datShape
-            #Get alpha
-            sAlpha = ""
-            if(fAlphaIsList):
-              sAlpha = str(datAlpha[iTaxaIndex])
-            else:
-              sAlpha = str(datAlpha)
-            dictCircleDataMethods[sTaxa]=dictCircleDataMethods[sTaxa]+"".join([ConstantsBreadCrumbs.c_cTab,sCircleMethod,":",sAlpha,"!",sShape,"#",sBorder])
-          else:
-            dictCircleDataMethods[sTaxa]=dictCircleDataMethods[sTaxa]+"".join([ConstantsBreadCrumbs.c_cTab,sCircleMethod,":0.0!R#0.0"])
+            dictCircleDataMethods[sTaxa] = ".".join(filter(None,sTaxa.split("|")))
+
+          iTaxaIndex = dictTaxaIndex[sTaxa]
+          #Get border
+          sBorder = str(datBorder[iTaxaIndex]) if fBorderIsList else str(datBorder)
+          #Get shape
+          sShape = datShape[iTaxaIndex] if fShapeIsList else datShape
+          #Get alpha
+          sAlpha = str(datAlpha[iTaxaIndex]) if fAlphaIsList else str(datAlpha)
+          dictCircleDataMethods[sTaxa]=dictCircleDataMethods[sTaxa]+"".join([ConstantsBreadCrumbs.c_cTab,sCircleMethod,":",sAlpha,"!",sShape,"#",sBorder])
 
       if len(dictCircleDataMethods)>0:
-        lsTaxaKeys = dictCircleDataMethods.keys()
-        sCircleContent = dictCircleDataMethods[lsTaxaKeys[0]]
-        for sTaxaKey in lsTaxaKeys[1:len(lsTaxaKeys)]:
-          sCircleContent = ConstantsBreadCrumbs.c_strEndline.join([sCircleContent,dictCircleDataMethods[sTaxaKey]])
-        self.writeToFile(self.strCircleFilePath, sCircleContent, False)
+        self.outputCircladerFile(self.c_sCircleFile, self.strCircleFilePath, dictCircleDataMethods.values())
         self.fCircleFileMade=True
 
         return True
+    #No circle data to write is not an error
     self.fCircleFileMade=False
-    return False
+    return True
 
   #Happy Path tested
   def createHighlightFile(self, lsIDs):
@@ -634,11 +655,16 @@ class Cladogram:
     :type: lsIDs List of strings
     """
     lsHighLightData = list()
+    if self.dictForcedHighLights is None:
+      return True
     #Each taxa name
     for sID in lsIDs:
+      #Only forced highlights are written
+      if not sID in self.dictForcedHighLights:
+        continue
       sCurColor = ""
       #Rename taxa to be consisten with the . delimit format
-      asNameElements = filter(None,re.split("\|",sID))
+      asNameElements = filter(None,sID.split("|"))
       sCurTaxaName = asNameElements[len(asNameElements)-1]
       if(len(asNameElements)>1):
         if(sCurTaxaName=="unclassified"):
@@ -647,22 +673,20 @@ class Cladogram:
 
       sCurLabel = ""
       #Get color
-      sColorKey = ""
-      if(sID in self.dictForcedHighLights):
-        sColorKey = self.dictForcedHighLights[sID]
-        if(sColorKey in self.dictColors):
-          sCurColor = self.formatRGB(self.dictColors[sColorKey])
-        #Get label
-        if(self.dictRelabels is not None):
-          if(sID in self.dictRelabels):
-            sCurLabel = self.dictRelabels[sID]
-        if(sCurLabel == ""):
-          lsHighLightData.append(ConstantsBreadCrumbs.c_cTab.join([sCurTaxa,sCurTaxaName,sCurLabel,sCurColor]))
-        else:
-          lsHighLightData.append(ConstantsBreadCrumbs.c_cTab.join([sCurTaxa,sCurLabel,sCurLabel,sCurColor]))
+      sColorKey = self.dictForcedHighLights[sID]
+      if(self.dictColors is not None) and (sColorKey in self.dictColors):
+        sCurColor = self.formatRGB(self.dictColors[sColorKey])
+      #Get label
+      if(self.dictRelabels is not None):
+        if(sID in self.dictRelabels):
+          sCurLabel = self.dictRelabels[sID]
+      if(sCurLabel == ""):
+        lsHighLightData.append(ConstantsBreadCrumbs.c_cTab.join([sCurTaxa,sCurTaxaName,sCurLabel,sCurColor]))
+      else:
+        lsHighLightData.append(ConstantsBreadCrumbs.c_cTab.join([sCurTaxa,sCurLabel,sCurLabel,sCurColor]))
 
     if len(lsHighLightData)>0:
-      self.writeToFile(self.strHighLightFilePath, ConstantsBreadCrumbs.c_strEndline.join(lsHighLightData), False)
+      self.outputCircladerFile(self.c_sHighLightFile, self.strHighLightFilePath, lsHighLightData)
       self.fHighlightFileMade=True
     return True
 
@@ -677,19 +701,19 @@ class Cladogram:
     if self.npaAbundance is not None:
       dMinimumValue = (self.c_dMinLogSize*self.c_dLogScale)+1
       lsWriteData = list()
-      for rowData in self.npaAbundance:
-        strCurrentId = rowData[0]
+      setIDs = set(lsIDs)
+      #Average of each feature (row) over the samples
+      npaMeasurements = self._funcGetAbundanceMatrix()
+      npaAverages = npaMeasurements.mean(axis=1) if npaMeasurements.shape[1] else np.zeros(len(self.npaAbundance))
+      for strCurrentId, dAverage in zip(self.npaAbundance[self.npaAbundance.dtype.names[0]], npaAverages):
         #Reset to root if needed to match current data
         if(not self.strRoot == None):
-          strCurrentId = self.updateToRoot([strCurrentId])
-          if(len(strCurrentId) > 0):
-            strCurrentId = strCurrentId[0]
-        if(strCurrentId in lsIDs):
-          dAverage = np.average(list(rowData)[1:])
+          strCurrentId = self._funcUpdateIDToRoot(strCurrentId)
+        if(strCurrentId in setIDs):
           dSize = max([dMinimumValue,(dAverage*self.c_dLogScale)+1])
-          lsWriteData.append(".".join(re.split("\|",strCurrentId))+ConstantsBreadCrumbs.c_cTab+str(math.log10(dSize)*self.c_dCircleScale))
+          lsWriteData.append(".".join(strCurrentId.split("|"))+ConstantsBreadCrumbs.c_cTab+str(math.log10(dSize)*self.c_dCircleScale))
       if len(lsWriteData)>0:
-        self.writeToFile(self.strSizeFilePath, ConstantsBreadCrumbs.c_strEndline.join(lsWriteData), False)
+        self.outputCircladerFile(self.c_sSizeFile, self.strSizeFilePath, lsWriteData)
         self.fSizeFileMade=True
     return True
 
@@ -701,22 +725,20 @@ class Cladogram:
     :param lsIDs: Ids to include in the tree file as well as their ancestors
     :type: lsIDs List of strings
     """
-    lsFullTree = list()
+    #Each node (every ancestry of every id) is written once, in the order it is first found
+    dictFullTree = collections.OrderedDict()
     for sID in lsIDs:
-      lsIDElements = filter(None,re.split("\|",sID))
-      sElementCur = lsIDElements[0]
-      if(not sElementCur in lsFullTree):
-        lsFullTree.append(sElementCur)
-      if(len(lsIDElements) > 1):
-        sNodePath = ""
-        for iEndLevel in xrange(1,len(lsIDElements)+1):
-          sCurAncestry = lsIDElements[0:iEndLevel]
-          sNodePath = ".".join(sCurAncestry)
-          if(not sNodePath in lsFullTree):
-            lsFullTree.append(sNodePath)
-
-    if len(lsFullTree)>0:
-      self.writeToFile(self.strTreeFilePath, ConstantsBreadCrumbs.c_strEndline.join(lsFullTree), False)
+      lsIDElements = filter(None,sID.split("|"))
+      #The ancestors of a node already in the tree are in the tree
+      if ".".join(lsIDElements) in dictFullTree:
+        continue
+      sNodePath = None
+      for sElement in lsIDElements:
+        sNodePath = sElement if sNodePath is None else ".".join([sNodePath,sElement])
+        dictFullTree[sNodePath] = None
+
+    if len(dictFullTree)>0:
+      self.outputCircladerFile(self.c_sTreeFile, self.strTreeFilePath, dictFullTree.keys())
     return True
 
   #Happy Path tested
@@ -731,31 +753,36 @@ class Cladogram:
     #list of ids to return that survived the filtering
     retls = list()
     if not self.npaAbundance is None:
-      #Hold the cuttoff score (threshold) for the percentile of interest {SampleName(string):score(double)}
-      dictPercentiles = dict()
-      for index in xrange(1,len(self.npaAbundance.dtype.names)):
-        dScore = scipy.stats.scoreatpercentile(self.npaAbundance[self.npaAbundance.dtype.names[index]],self.c_dPercentileCutOff)
-        dictPercentiles[self.npaAbundance.dtype.names[index]] = dScore
-
+      npaMeasurements = self._funcGetAbundanceMatrix()
       #Sample count (Ignore sample id [position 0] which is not a name)
-      dSampleCount = float(len(self.npaAbundance.dtype.names[1:]))
-
-      #Check each taxa
-      for rowTaxaData in self.npaAbundance:
-        sCurTaxaName = rowTaxaData[0]
-        #Only look at the IDs given
-        if(sCurTaxaName in lsIDs):
-          dCountAbovePercentile = 0.0
-          ldAbundanceMeasures = list(rowTaxaData)[1:]
-          #Check to see if the abundance score meets the threshold and count if it does
-          for iScoreIndex in xrange(0,len(ldAbundanceMeasures)):
-            if(ldAbundanceMeasures[iScoreIndex] >= dictPercentiles[self.lsSampleNames[iScoreIndex]]):
-              dCountAbovePercentile = dCountAbovePercentile + 1.0
-          dPercentOverPercentile = dCountAbovePercentile / dSampleCount
-          if(dPercentOverPercentile >= (self.c_dPercentageAbovePercentile/100.0)):
-            retls.append(sCurTaxaName)
+      iSampleCount = npaMeasurements.shape[1]
+      if not iSampleCount:
+        return retls
+
+      #The cuttoff score (threshold) for the percentile of interest of each sample (column)
+      npaPercentiles = scipy.stats.scoreatpercentile(npaMeasurements,self.c_dPercentileCutOff,axis=0)
+
+      #Percent of the samples of each taxa (row) where the abundance score meets the threshold
+      npaPercentOverPercentile = np.sum(npaMeasurements >= npaPercentiles, axis=1) / float(iSampleCount)
+      npaPassing = npaPercentOverPercentile >= (self.c_dPercentageAbovePercentile/100.0)
+
+      #Only look at the IDs given
+      setIDs = set(lsIDs)
+      retls = [sCurTaxaName for sCurTaxaName, fPassing in zip(self.npaAbundance[self.npaAbundance.dtype.names[0]], npaPassing) if fPassing and sCurTaxaName in setIDs]
     return retls
 
+  def _funcGetAbundanceMatrix(self):
+    """
+    Returns the abundance data as a matrix.
+
+    :return Numpy array: Measurements (features as rows, samples as columns)
+    """
+
+    lsColumns = self.npaAbundance.dtype.names[1:]
+    if not len(lsColumns):
+      return np.zeros((len(self.npaAbundance),0))
+    return np.column_stack([self.npaAbundance[sColumn] for sColumn in lsColumns])
+
   #Happy Path Tested
   def filterByCladeSize(self, lsIDs):
     """
@@ -764,42 +791,35 @@ class Cladogram:
     :param lsIDs: Ids to filter
     :type: lsIDs List of strings
     """
-    #First get terminal nodes
-    lsTerminalNodes = AbundanceTable.funcGetTerminalNodesFromList(lsIDs,self.cFeatureDelimiter)
+    if not len(lsIDs):
+      return []
+
+    #Index the lineages of the IDs, empty clades are ignored (A||B is A|B)
+    lineage = LineageIndex(lsIDs, self.cFeatureDelimiter)
+    if lineage.fHasEmptyClades:
+      lineage = LineageIndex([self.cFeatureDelimiter.join(filter(None,sID.split(self.cFeatureDelimiter))) for sID in lsIDs], self.cFeatureDelimiter)
+    npaLineageCounts = lineage.npaDepth + 1
+
+    #If the lineage is longer than the reduced clade level and measuring clade level then count
+    #or If the lineage is longer than the reduced clade level but shorter than the measuring clade,
+    #only count if the last element is unclassified
+    fCounted = ( npaLineageCounts >= self.iCladeLevelToReduce ) & ( ( npaLineageCounts >= self.iCladeLevelToMeasure ) |
+      ( np.array(lineage.lsClades) == self.strUnclassified ) )
+    if self.iCladeLevelToReduce > 0:
+      npaReduced = lineage.funcGetAncestorsAtDepth(self.iCladeLevelToReduce - 1)
+    else:
+      npaReduced = np.zeros(lineage.funcGetCladeCount(), dtype=int)
 
-    #Count up clades
-    cladeCounts = dict()
-    
     #For each terminal node count the
     #Clades at clade levels
-    for sTerminalNode in lsTerminalNodes:
-        lsLineage = sTerminalNode.split(self.cFeatureDelimiter)
-        iLineageCount = len(lsLineage)
-        #If the lineage is shorter than the reduced clade level then no need to filter it
-        if iLineageCount >= self.iCladeLevelToReduce:
-            #If the lineage is longer than the reduced clade level and measuring clade level then count
-            #or If the lineage is longer than the reduced clade level but shorter than the measuring clade,
-            #only count if the last element is unclassified
-            if (iLineageCount >= self.iCladeLevelToMeasure) or (lsLineage[-1] == self.strUnclassified):
-                sLineage = self.cFeatureDelimiter.join(lsLineage[0:self.iCladeLevelToReduce])
-                cladeCounts[sLineage] = cladeCounts.get(sLineage,0) + 1
+    npaTerminalNodes = lineage.npaFeatureClade[lineage.funcGetTerminalFeatures()]
+    npaTerminalNodes = npaTerminalNodes[fCounted[npaTerminalNodes]]
+    npaCladeCounts = np.bincount(npaReduced[npaTerminalNodes], minlength=lineage.funcGetCladeCount())
 
     #Go through the IDs and reduce as needed using the clade counts
-    retls = list()
-    for sID in lsIDs:
-        lsID = sID.split(self.cFeatureDelimiter)
-        iIDCount = len(lsID)
-
-        #Too short to filter
-        if iLineageCount < self.iCladeLevelToReduce:
-            retls.append(sID)
-        #Check to see if the clade which is being reduced made the cut
-        if iIDCount >= self.iCladeLevelToReduce:
-            if (iIDCount >= self.iCladeLevelToMeasure) or (lsID[-1] == self.strUnclassified):
-                if cladeCounts[self.cFeatureDelimiter.join(lsID[0:self.iCladeLevelToReduce])] >= self.iMinCladeSize:
-                    retls.append(sID)
-
-    return retls
+    #Too short to filter or the clade which is being reduced made the cut
+    fKeep = ( npaLineageCounts < self.iCladeLevelToReduce ) | ( fCounted & ( np.where(fCounted, npaCladeCounts[npaReduced], 0) >= self.iMinCladeSize ) )
+    return [sID for sID, fKeepID in zip(lsIDs, fKeep[lineage.npaFeatureClade]) if fKeepID]
 
   #Happy path tested
   def formatRGB(self, sColor):
@@ -917,18 +937,38 @@ class Cladogram:
     if(self.strRoot is None):
       return lsIDs
     #Force root tree if indicated to do so
-    lsRootedIDs = list()
-    for sID in lsIDs:
-      sIDElements = filter(None,re.split("\|",sID))
-      if(self.strRoot in sIDElements):
-        iRootIndex = sIDElements.index(self.strRoot)
-        #If multiple levels of the clade exist after the new root merge them.
-        if(len(sIDElements)>iRootIndex+2):
-          lsRootedIDs.append("|".join(sIDElements[iRootIndex+1:]))
-        #If only one level of the clade exists after the new root, return it.
-        elif(len(sIDElements)>iRootIndex+1):
-          lsRootedIDs.append(sIDElements[iRootIndex+1])
-    return(lsRootedIDs)
+    lsRootedIDs = [self._funcUpdateIDToRoot(sID) for sID in lsIDs]
+    return([sID for sID in lsRootedIDs if sID is not None])
+
+  def _funcUpdateIDToRoot(self, sID):
+    """
+    Updates a clade to the root given (see updateToRoot).
+
+    :param sID: Clade
+    :type: String
+    :return String: The clade below the root, None if the clade does not hold the root or ends at it.
+    """
+
+    sIDElements = filter(None,sID.split("|"))
+    if(not self.strRoot in sIDElements):
+      return None
+    #All levels of the clade after the new root are merged
+    iRootIndex = sIDElements.index(self.strRoot)
+    if(len(sIDElements)>iRootIndex+1):
+      return "|".join(sIDElements[iRootIndex+1:])
+    return None
+
+  @staticmethod
+  def funcGetUniqueInOrder(lsIDs):
+    """
+    Removes duplicate ids in linear time, keeping the order in which ids are first found (unlike list(set()) the order is deterministic).
+
+    :param lsIDs: Ids
+    :type: List of strings
+    :return List: Unique ids
+    """
+
+    return collections.OrderedDict.fromkeys(lsIDs).keys()
 
   #Testing: Used extensively in other tests
   def writeToFile(self, strFileName, strDataToWrite, fAppend):
@@ -948,3 +988,236 @@ class Cladogram:
       cMode = 'a'
     with open(strFileName,cMode) as f:
         f.write(strDataToWrite)
+
+  #Not tested
+  def outputCircladerFile(self, sFileKey, strFileName, lsData):
+    """
+    Writes the lines of a circlader file, they are also held if drawing in process.
+    When drawing in process a file without a name is only held.
+
+    :param sFileKey: Key of the file (c_sTreeFile, c_sCircleFile...)
+    :type: String
+    :param strFileName: File to write to
+    :type: strFileName File path (string)
+    :param lsData: Lines of the file
+    :type: List of strings
+    """
+
+    if self.dictCircladerData is not None:
+      self.dictCircladerData[sFileKey] = list(lsData)
+      if strFileName is None:
+        return
+    self.writeToFile(strFileName, ConstantsBreadCrumbs.c_strEndline.join(lsData), False)
+
+  #Not tested
+  def releaseCircladerData(self):
+    """
+    Stops holding the circlader file data held for drawing in process (the named files are already written).
+    Files without a name are reported as they can not be drawn by the circlader script.
+    """
+
+    dictFilePaths = {self.c_sTreeFile:self.strTreeFilePath, self.c_sCircleFile:self.strCircleFilePath,
+                     self.c_sColorFile:self.strColorFilePath, self.c_sTickFile:self.strTickFilePath,
+                     self.c_sHighLightFile:self.strHighLightFilePath, self.c_sSizeFile:self.strSizeFilePath}
+    #Flags of the optional files
+    dictFileMade = {self.c_sCircleFile:"fCircleFileMade", self.c_sColorFile:"fColorFileMade", self.c_sTickFile:"fTickFileMade",
+                    self.c_sHighLightFile:"fHighlightFileMade", self.c_sSizeFile:"fSizeFileMade"}
+    for sFileKey in self.dictCircladerData:
+      if dictFilePaths[sFileKey] is None:
+        print "Cladogram::releaseCircladerData. No file was given for the "+sFileKey+", it can not be drawn by the circlader script."
+        if sFileKey in dictFileMade:
+          setattr(self, dictFileMade[sFileKey], False)
+    self.dictCircladerData = None
+
+  #Not tested
+  def renderInProcess(self, circlader):
+    """
+    Draws the cladogram in this process from the circlader file data held in memory.
+
+    :param circlader: The circlader library module
+    :type: Module
+    :return boolean: True indicates success, false indicates error
+    """
+
+    try:
+      circlader.draw_cladogram(self.strImageName, self.dictCircladerData.get(self.c_sTreeFile,[]), Cladogram.funcGetStyleOptions(circlader, self.strStyleFilePath),
+        colors=self.dictCircladerData.get(self.c_sColorFile), sizes=self.dictCircladerData.get(self.c_sSizeFile),
+        circles=self.dictCircladerData.get(self.c_sCircleFile), highlights=self.dictCircladerData.get(self.c_sHighLightFile),
+        ticks=self.dictCircladerData.get(self.c_sTickFile))
+    except Exception as e:
+      print "Cladogram::renderInProcess. Could not draw the cladogram in process, the circlader script will be used. "+str(e)
+      return False
+    return True
+
+  @staticmethod
+  def funcGetStyleOptions(circlader, strStyleFile):
+    """
+    Returns the parsed options of a circlader style file, the file is parsed once per version of the file.
+
+    :param circlader: The circlader library module
+    :type: Module
+    :param strStyleFile: File path of the style file
+    :type: String
+    :return Dictionary: Style options {option name: value}
+    """
+
+    tpleStyleKey = (os.path.abspath(strStyleFile), os.path.getmtime(strStyleFile))
+    if not tpleStyleKey in Cladogram.dictStyleCache:
+      treeStyle = circlader.Tree()
+      with open(strStyleFile) as hndlStyle:
+        treeStyle.set_style(hndlStyle)
+      Cladogram.dictStyleCache[tpleStyleKey] = treeStyle.opt
+    return Cladogram.dictStyleCache[tpleStyleKey]
+
+  @staticmethod
+  def funcGetCircladerLibrary(strCircladerScript = ConstantsBreadCrumbs.c_strCircladerScript):
+    """
+    Imports the circlader library to draw cladograms in process.
+    The library is looked for next to the circlader script then in the circlader directory of this package.
+
+    :param strCircladerScript: File path to the Circlader script
+    :type: String
+    :return Module: The circlader library or None if it can not be imported (for instance if matplotlib or Biopython are missing).
+    """
+
+    strLibrary = ConstantsBreadCrumbs.c_strCircladerLibrary
+    if strLibrary in sys.modules:
+      return sys.modules[strLibrary]
+    lsDirectories = [os.path.dirname(os.path.abspath(strCircladerScript)), os.path.join(os.path.dirname(os.path.abspath(__file__)),"circlader")]
+    try:
+      hndlModule, strPath, tplDescription = imp.find_module(strLibrary, lsDirectories)
+    except ImportError:
+      return None
+    try:
+      return imp.load_module(strLibrary, hndlModule, strPath, tplDescription)
+    except Exception as e:
+      print "Cladogram::funcGetCircladerLibrary. Could not import the circlader library, the circlader script will be used. "+str(e)
+      return None
+    finally:
+      if hndlModule:
+        hndlModule.close()
+
+  #Happy path tested
+  def generateBatch(self, lJobs, iProcesses = None, strCircladerScript = ConstantsBreadCrumbs.c_strCircladerScript, iTerminalCladeLevel = 10, fInProcess = True):
+    """
+    Generates a cladogram for each of many abundance tables (for instance strata of a table) in parallel.
+    This cladogram is the template of the configuration of all cladograms (colors, highlights, circles, ticks, filters...),
+    only the abundance data changes between cladograms. Styles are parsed once and shared by the cladograms.
+    Cladograms are drawn on a pool of processes, only a few jobs per process are prepared at a time to bound memory.
+    The circlader files (see generate) are written named after the image (image name without extension + _Taxa.txt...).
+
+    :param lJobs: Cladograms to generate as [AbundanceTable, output image file name, style file path]
+    :type: List of lists
+    :param iProcesses: Number of processes, None uses all processors, 1 draws in this process.
+    :type: Integer
+    :param strCircladerScript: File path to the Circlader script
+    :type: String
+    :param iTerminalCladeLevel: Clade level to use as terminal in plotting
+    :type: iTerminalCladeLevel integer starting with 1
+    :param fInProcess: Indicates the cladograms should be drawn with the circlader library (True) or by calling the circlader script (False).
+    :type: Boolean
+    :return List: Per job (in the order of the jobs) [output image file name, boolean success, seconds to generate, error message or None]
+    """
+
+    if not iProcesses:
+      iProcesses = multiprocessing.cpu_count()
+
+    #Import the library and parse the styles once, processes get them when they are started
+    circlader = Cladogram.funcGetCircladerLibrary(strCircladerScript) if fInProcess else None
+    if circlader:
+      for strStyleFile in set([lJob[2] for lJob in lJobs]):
+        if os.path.exists(strStyleFile):
+          Cladogram.funcGetStyleOptions(circlader, strStyleFile)
+
+    #Results in the order of the jobs
+    llResults = [None] * len(lJobs)
+
+    if iProcesses == 1:
+      for iJob in xrange(len(lJobs)):
+        llResults[iJob] = funcGenerateCladogramJob(self._funcMakeBatchJob(lJobs[iJob], strCircladerScript, iTerminalCladeLevel, fInProcess))
+    else:
+      #A job is prepared only when a place is free so that a few jobs are held in memory at a time
+      iMaxPending = iProcesses * self.c_iBatchJobsPerProcess
+      lPending = []
+      pool = multiprocessing.Pool(processes = iProcesses, maxtasksperchild = self.c_iBatchJobsPerChild)
+      try:
+        for iJob in xrange(len(lJobs)):
+          lPending = [lJobResult for lJobResult in lPending if not self._funcStoreBatchResult(lJobResult, lJobs, llResults)]
+          while len(lPending) >= iMaxPending:
+            lPending[0][1].wait()
+            lPending = [lJobResult for lJobResult in lPending if not self._funcStoreBatchResult(lJobResult, lJobs, llResults)]
+          lPending.append([iJob, pool.apply_async(funcGenerateCladogramJob, [self._funcMakeBatchJob(lJobs[iJob], strCircladerScript, iTerminalCladeLevel, fInProcess)])])
+        pool.close()
+        for lJobResult in lPending:
+          lJobResult[1].wait()
+          self._funcStoreBatchResult(lJobResult, lJobs, llResults)
+        pool.join()
+      except:
+        pool.terminate()
+        raise
+
+    #Report
+    for lResult in llResults:
+      if not lResult[1]:
+        sys.stderr.write("Cladogram::generateBatch. Could not generate "+str(lResult[0])+". "+str(lResult[3])+"\n")
+    return llResults
+
+  @staticmethod
+  def _funcStoreBatchResult(lJobResult, lJobs, llResults):
+    """
+    Stores the result of a batch job if it is finished.
+
+    :param lJobResult: [index of the job, multiprocessing AsyncResult]
+    :type: List
+    :param lJobs: Jobs of the batch
+    :type: List of lists
+    :param llResults: Results of the batch (updated)
+    :type: List of lists
+    :return boolean: True indicates the job is finished
+    """
+
+    iJob, asyncResult = lJobResult
+    if not asyncResult.ready():
+      return False
+    try:
+      llResults[iJob] = asyncResult.get()
+    except Exception as e:
+      llResults[iJob] = [lJobs[iJob][1], False, 0.0, str(e)]
+    return True
+
+  def _funcMakeBatchJob(self, lJob, strCircladerScript, iTerminalCladeLevel, fInProcess):
+    """
+    Makes the job of a cladogram of a batch: a copy of this cladogram holding the abundance data and the arguments of generate.
+
+    :param lJob: Cladogram to generate as [AbundanceTable, output image file name, style file path]
+    :type: List
+    :return List: [Cladogram, output image file name, style file path, dictionary of the other arguments of generate]
+    """
+
+    abndTable, strImageName, strStyleFile = lJob
+    cladogram = copy.deepcopy(self)
+    cladogram.setAbundanceData(abndTable)
+    strBaseName = os.path.splitext(strImageName)[0]
+    dictArguments = {"sTaxaFileName":strBaseName+Cladogram.strTreeFilePath, "strCircladerScript":strCircladerScript,
+      "iTerminalCladeLevel":iTerminalCladeLevel, "sColorFileName":strBaseName+Cladogram.strColorFilePath,
+      "sTickFileName":strBaseName+Cladogram.strTickFilePath, "sHighlightFileName":strBaseName+Cladogram.strHighLightFilePath,
+      "sSizeFileName":strBaseName+Cladogram.strSizeFilePath, "sCircleFileName":strBaseName+Cladogram.strCircleFilePath,
+      "fInProcess":fInProcess}
+    return [cladogram, strImageName, strStyleFile, dictArguments]
+
+def funcGenerateCladogramJob(lJob):
+  """
+  Generates the cladogram of a batch job (see Cladogram.generateBatch), this is run in the processes of the batch.
+
+  :param lJob: [Cladogram, output image file name, style file path, dictionary of the other arguments of generate]
+  :type: List
+  :return List: [output image file name, boolean success, seconds to generate, error message or None]
+  """
+
+  cladogram, strImageName, strStyleFile, dictArguments = lJob
+  dStart = time.time()
+  try:
+    fSuccess = cladogram.generate(strImageName, strStyleFile, **dictArguments)
+  except Exception as e:
+    return [strImageName, False, time.time() - dStart, str(e)]
+  return [strImageName, bool(fSuccess), time.time() - dStart, None if fSuccess else "The cladogram could not be drawn."]
@@ -0,0 +1,211 @@
+"""
+Author: Timothy Tickle
+Description: Classical (metric) multidimensional scaling, the eigendecomposition engine of PCoA.
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+#Import libaries
+import numpy as np
+import scipy.linalg
+import scipy.sparse.linalg
+from scipy.spatial.distance import squareform
+
+class ClassicalMDS:
+    """
+    Classical (Torgerson-Gower) multidimensional scaling of a distance matrix.
+    The squared distances are double centered and the top eigenvectors give the coordinates, the eigenvalues
+    the variance of each axis. Only the requested axes are solved (dense LAPACK subset, ARPACK or a randomized solver).
+    Holds the same getPoints interface as cogent's NMDS so PCoA can use either engine.
+    The fit (eigenvectors, eigenvalues and centering terms) is kept so new samples can be placed
+    from their distances to the reference samples (see funcProject).
+    """
+
+    #Keys of the fit (see funcGetFit)
+    c_strFitEigenvalues = "eigenvalues"
+    c_strFitEigenvectors = "eigenvectors"
+    c_strFitCenteringMeans = "centering_means"
+    c_strFitCenteringMean = "centering_mean"
+    c_strFitTotalVariance = "total_variance"
+
+    #Eigen solvers
+    #Dense symmetric solver computing only the requested eigenvalues
+    c_strEigenSolverDense = "dense"
+    #Lanczos iterations (scipy.sparse.linalg.eigsh)
+    c_strEigenSolverArpack = "arpack"
+    #Randomized range finder with power iterations, approximate when the leading eigenvalues are close
+    c_strEigenSolverRandomized = "randomized"
+    lsEigenSolvers = [c_strEigenSolverDense, c_strEigenSolverArpack, c_strEigenSolverRandomized]
+
+    #Extra dimensions and power iterations of the randomized solver
+    c_iRandomizedOversamples = 10
+    c_iRandomizedPowerIterations = 4
+    #Seed of the randomized solver so ordinations are repeatable
+    c_iRandomSeed = 0
+
+    def __init__(self, npaDistances=None, dimension=2, strEigenSolver=c_strEigenSolverDense, dictFit=None):
+        """
+        Constructor performs the ordination or restores a previous one.
+
+        :param npaDistances: Square or condensed distance matrix
+        :type: Numpy array
+        :param dimension: Number of axes to compute
+        :type: Integer
+        :param strEigenSolver: One of lsEigenSolvers
+        :type: String
+        :param dictFit: Fit of a previous ordination (see funcGetFit), used instead of the distances.
+        :type: Dictionary
+        """
+
+        if not dictFit is None:
+            self.npaEigenvalues = np.asarray(dictFit[ClassicalMDS.c_strFitEigenvalues], dtype=np.float64)
+            self.npaEigenvectors = np.asarray(dictFit[ClassicalMDS.c_strFitEigenvectors], dtype=np.float64)
+            self.npaCenteringMeans = np.asarray(dictFit[ClassicalMDS.c_strFitCenteringMeans], dtype=np.float64)
+            self.dCenteringMean = float(dictFit[ClassicalMDS.c_strFitCenteringMean])
+            self.dTotalVariance = float(dictFit[ClassicalMDS.c_strFitTotalVariance])
+            self.npaPoints = self.npaEigenvectors * np.sqrt(np.maximum(self.npaEigenvalues, 0))
+            return
+
+        npaDistances = np.asarray(npaDistances, dtype=np.float64)
+        if npaDistances.ndim == 1:
+            npaDistances = squareform(npaDistances)
+        iSampleCount = npaDistances.shape[0]
+        iDimensions = max(1, min(dimension, iSampleCount))
+
+        #Double centered -1/2 squared distances, the row (and column) means are kept to place new samples
+        npaCentered = np.square(npaDistances)
+        npaCentered *= -0.5
+        self.npaCenteringMeans = npaCentered.mean(axis=0)
+        self.dCenteringMean = self.npaCenteringMeans.mean()
+        npaCentered -= self.npaCenteringMeans[np.newaxis,:]
+        npaCentered -= self.npaCenteringMeans[:,np.newaxis]
+        npaCentered += self.dCenteringMean
+
+        #The total variance is the trace (sum of all the eigenvalues)
+        self.dTotalVariance = np.trace(npaCentered)
+
+        npaValues, npaVectors = ClassicalMDS.funcGetTopEigenvectors(npaCentered, iDimensions, strEigenSolver)
+        #Orient each axis so its largest loading is positive, keeping ordinations repeatable
+        npaSigns = np.sign(npaVectors[np.abs(npaVectors).argmax(axis=0),np.arange(npaVectors.shape[1])])
+        npaSigns[npaSigns == 0] = 1
+        npaVectors *= npaSigns
+
+        self.npaEigenvalues = npaValues
+        self.npaEigenvectors = npaVectors
+        self.npaPoints = npaVectors * np.sqrt(np.maximum(npaValues, 0))
+
+    @staticmethod
+    def funcGetTopEigenvectors(npaMatrix, iCount, strEigenSolver=c_strEigenSolverDense):
+        """
+        Returns the largest eigenvalues and their eigenvectors of a symmetric matrix.
+
+        :param npaMatrix: Symmetric matrix, the dense solver may overwrite it
+        :type: Numpy array
+        :param iCount: Number of eigenvalues
+        :type: Integer
+        :param strEigenSolver: One of lsEigenSolvers
+        :type: String
+        :return Tuple: (eigenvalues from the largest, eigenvectors as columns)
+        """
+
+        iSize = npaMatrix.shape[0]
+        #ARPACK needs fewer eigenvalues than the size of the matrix
+        if ( strEigenSolver == ClassicalMDS.c_strEigenSolverArpack ) and ( iCount < iSize - 1 ):
+            npaValues, npaVectors = scipy.sparse.linalg.eigsh(npaMatrix, k=iCount, which="LA",
+                v0=np.random.RandomState(ClassicalMDS.c_iRandomSeed).uniform(-1, 1, iSize))
+        elif ( strEigenSolver == ClassicalMDS.c_strEigenSolverRandomized ) and ( iCount + ClassicalMDS.c_iRandomizedOversamples < iSize ):
+            npaRandom = np.random.RandomState(ClassicalMDS.c_iRandomSeed).normal(size=(iSize, iCount + ClassicalMDS.c_iRandomizedOversamples))
+            npaBasis = np.linalg.qr(npaMatrix.dot(npaRandom))[0]
+            for iIteration in xrange(ClassicalMDS.c_iRandomizedPowerIterations):
+                npaBasis = np.linalg.qr(npaMatrix.dot(npaBasis))[0]
+            npaValues, npaVectors = scipy.linalg.eigh(npaBasis.T.dot(npaMatrix).dot(npaBasis))
+            npaVectors = npaBasis.dot(npaVectors)
+        elif strEigenSolver in ClassicalMDS.lsEigenSolvers:
+            npaValues, npaVectors = scipy.linalg.eigh(npaMatrix, eigvals=(iSize - iCount, iSize - 1), overwrite_a=True)
+        else:
+            raise ValueError("".join(["ClassicalMDS. Unknown eigen solver ",str(strEigenSolver)]))
+        liOrder = np.argsort(npaValues)[::-1][:iCount]
+        return (npaValues[liOrder], npaVectors[:,liOrder])
+
+    def getPoints(self):
+        """
+        Returns the coordinates of the samples (rows) on each axis (columns).
+        """
+
+        return self.npaPoints
+
+    def funcGetEigenvalues(self):
+        """
+        Returns the eigenvalues of the axes.
+        """
+
+        return self.npaEigenvalues
+
+    def funcGetFit(self):
+        """
+        Returns the fit of the ordination, what is needed to restore it (see the constructor) and to place new samples.
+
+        :return Dictionary: {key of the fit: numpy array}
+        """
+
+        return {ClassicalMDS.c_strFitEigenvalues:self.npaEigenvalues, ClassicalMDS.c_strFitEigenvectors:self.npaEigenvectors,
+            ClassicalMDS.c_strFitCenteringMeans:self.npaCenteringMeans, ClassicalMDS.c_strFitCenteringMean:np.float64(self.dCenteringMean),
+            ClassicalMDS.c_strFitTotalVariance:np.float64(self.dTotalVariance)}
+
+    def funcProject(self, npaDistances):
+        """
+        Places new samples in the ordination from their distances to the reference samples (Gower 1968).
+        The squared distances are centered with the terms of the reference samples and projected on the eigenvectors.
+        A reference sample is placed at its own coordinates only if the metric puts it at 0 from itself, this is not so
+        for inverse Bray-Curtis (1 - dissimilarity, 1 between identical samples). Axes without positive variance are placed at 0.
+
+        :param npaDistances: Distances of the new samples (rows) to the reference samples (columns, in the order of the ordination)
+        :type: Numpy array
+        :return Numpy array: Coordinates of the new samples (rows) on each axis (columns)
+        """
+
+        npaCentered = np.square(np.asarray(npaDistances, dtype=np.float64).reshape(-1, len(self.npaCenteringMeans)))
+        npaCentered *= -0.5
+        npaCentered -= npaCentered.mean(axis=1)[:,np.newaxis]
+        npaCentered -= self.npaCenteringMeans[np.newaxis,:]
+        npaCentered += self.dCenteringMean
+        npaScales = np.zeros(len(self.npaEigenvalues))
+        npaPositive = self.npaEigenvalues > 0
+        npaScales[npaPositive] = 1.0 / np.sqrt(self.npaEigenvalues[npaPositive])
+        return npaCentered.dot(self.npaEigenvectors) * npaScales
+
+    def funcGetExplainedVariance(self):
+        """
+        Returns the fraction of the total variance (the trace of the centered matrix) explained by each axis.
+        """
+
+        if self.dTotalVariance <= 0:
+            return np.zeros(len(self.npaEigenvalues))
+        return self.npaEigenvalues / self.dTotalVariance
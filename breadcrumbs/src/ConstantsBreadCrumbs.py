@@ -54,6 +54,13 @@ class ConstantsBreadCrumbs():
     c_strWhiteSpace = ' '
     c_matrixFileDelim = '\t'
 
+    #Binary distance matrix files (see Metric.funcWriteBinaryMatrixFile)
+    #A text header line (magic, version, data type, sample count, data offset), a sample id per line,
+    #then the condensed matrix in little endian aligned to c_iBinaryMatrixFileAlignment bytes.
+    c_strBinaryMatrixFileMagic = "BREADCRUMBS_CONDENSED_MATRIX"
+    c_strBinaryMatrixFileVersion = "1"
+    c_iBinaryMatrixFileAlignment = 16
+
     c_strBreadCrumbsSVMSpace = c_strWhiteSpace
 
     #Default values for missing data in the Abundance Table
@@ -66,6 +73,8 @@ class ConstantsBreadCrumbs():
     #TODO remove
     #Reference to circlader
     c_strCircladerScript = "circlader/circlader.py"
+    #Module of the circlader library used to render cladograms in process
+    c_strCircladerLibrary = "circlader_lib"
 
     #AbundanceTable
     #Suffix given to a file that is check with the checkRawDataFile method
@@ -134,6 +143,9 @@ class ConstantsBreadCrumbs():
     c_sLastMetadata = "sLastMetadata"
     c_columns = "columns"	
     c_rows = "rows"
+    c_strBiomDataKey = "data"
+    c_strBiomJSONFormat = "Biological Observation Matrix 1.0.0"
+    c_strBiomFormatURL = "http://biom-format.org"
     c_ascii = "ascii"	
     c_ignore = "ignore"	
     c_Dtype = "Dtype"	
@@ -146,6 +158,7 @@ class ConstantsBreadCrumbs():
     c_dRowsMetadata = "dRowsMetadata"
     c_BiomFileInfo = "BiomFileInfo"
     c_MatrixTtype = "matrix_type"
+    c_strSparseMatrixType = "sparse"
     c_GeneratedBy = "generated_by"
     c_MetadataEntriesTotal = "MetadataEntriesTotal"
     c_MaximumLength = "MaximumLength"
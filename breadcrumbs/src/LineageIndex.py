@@ -0,0 +1,329 @@
+"""
+Author: Timothy Tickle
+Description: Array-backed index of the clades in consensus lineage feature names.
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+#Import libaries
+import numpy as np
+import scipy.sparse
+
+class LineageIndex:
+    """
+    Index of the clades of consensus lineage feature names (for example Bacteria|Firmicutes|Bacilli).
+    Every clade (every prefix of a feature name) is a node numbered in the order it is first seen,
+    the tree is held in integer arrays (parent, depth, measuring row) instead of CClade objects.
+    """
+
+    #Types of the sums held for float32 measurements (see funcSumClades)
+    c_iZero = 0
+    c_iSingle = 1
+    c_iDouble = 2
+
+    #Number of rows copied or compared at once
+    c_iBlockSize = 10000
+
+    #Largest number of values summed at once for sparse measurements, which are summed in blocks of samples
+    c_iSparseBlockValues = 2 ** 24
+
+    def __init__(self, lsFeatureNames, cDelimiter = "|"):
+        """
+        Constructor parses the feature names once.
+
+        :param lsFeatureNames: Feature names (consensus lineages) in the order of the rows of the measurements
+        :type: List of strings
+        :param cDelimiter: Delimiter of the clades in the feature names
+        :type: Character
+        """
+
+        self.cDelimiter = cDelimiter
+
+        liParent, liDepth, liRow, lsNames, lsClades, liFeatureClade = [], [], [], [], [], []
+        #Children {clade name: node} of each node, index 0 is the (unnamed) root
+        ldictChildren = [{}]
+        for iRow, sFeature in enumerate(lsFeatureNames):
+            iClade = -1
+            for sClade in sFeature.split(cDelimiter):
+                dictChildren = ldictChildren[iClade + 1]
+                if dictChildren is None:
+                    dictChildren = ldictChildren[iClade + 1] = {}
+                iChild = dictChildren.get(sClade)
+                if iChild is None:
+                    iChild = len(liParent)
+                    dictChildren[sClade] = iChild
+                    ldictChildren.append(None)
+                    liParent.append(iClade)
+                    liDepth.append(liDepth[iClade] + 1 if iClade >= 0 else 0)
+                    liRow.append(-1)
+                    lsNames.append(lsNames[iClade] + cDelimiter + sClade if iClade >= 0 else sClade)
+                    lsClades.append(sClade)
+                iClade = iChild
+            #A feature given twice keeps the last measurements
+            liRow[iClade] = iRow
+            liFeatureClade.append(iClade)
+
+        #Position of each node among its siblings, in the order a dict of the children iterates (as CClade visits them)
+        liRank = [0] * len(liParent)
+        for dictChildren in ldictChildren:
+            if dictChildren:
+                for iRank, iChild in enumerate(dictChildren.values()):
+                    liRank[iChild] = iRank
+
+        #Parent node (-1 for the top level), depth (0 for the top level), rank among siblings and
+        #row of the measurements (-1 if the clade is not measured) of each node
+        self.npaParent = np.array(liParent, dtype=int)
+        self.npaDepth = np.array(liDepth, dtype=int)
+        self.npaRank = np.array(liRank, dtype=int)
+        self.npaRow = np.array(liRow, dtype=int)
+        #Full name of each node (clades joined by the delimiter) and name of its last clade
+        self.lsNames = lsNames
+        self.lsClades = lsClades
+        #Node of each feature (row)
+        self.npaFeatureClade = np.array(liFeatureClade, dtype=int)
+        #Indicates a feature name has an empty clade (for example A||B)
+        self.fHasEmptyClades = "" in lsClades
+
+    def funcGetCladeCount(self):
+        """
+        Returns the number of clades (nodes) in the index.
+
+        :return Integer: Count of clades
+        """
+
+        return len(self.lsNames)
+
+    def funcGetLevels(self):
+        """
+        Returns the nodes of each depth.
+
+        :return List: List of numpy integer arrays, the nodes at depth 0, 1, ...
+        """
+
+        if not len(self.npaDepth):
+            return []
+        npaOrder = np.argsort(self.npaDepth, kind="mergesort")
+        npaBounds = np.searchsorted(self.npaDepth[npaOrder], np.arange(self.npaDepth.max() + 2))
+        return [npaOrder[npaBounds[iDepth]:npaBounds[iDepth + 1]] for iDepth in xrange(len(npaBounds) - 1)]
+
+    def funcGetFeatureDepths(self):
+        """
+        Returns the number of clades in each feature name.
+
+        :return Numpy array: Integer count per feature
+        """
+
+        return self.npaDepth[self.npaFeatureClade] + 1
+
+    def funcGetAncestorsAtDepth(self, iDepth):
+        """
+        Returns the ancestor of each node at a depth (the node itself for the nodes at the depth).
+
+        :param iDepth: Depth of the ancestors, 0 gives the top level clade (root) of each node.
+        :type: Integer
+        :return Numpy array: Ancestor node per node, -1 for nodes above the depth
+        """
+
+        npaAncestors = np.zeros(self.funcGetCladeCount(), dtype=int) - 1
+        for liLevel in self.funcGetLevels()[iDepth:]:
+            npaAncestors[liLevel] = np.where(self.npaDepth[liLevel] == iDepth, liLevel, npaAncestors[self.npaParent[liLevel]])
+        return npaAncestors
+
+    def funcGetRootRows(self):
+        """
+        Returns for each feature the row of the feature measuring its top level clade (root): the first of the features
+        with the shortest name among the features sharing the top level clade.
+
+        :return Numpy array: Row per feature
+        """
+
+        npaRoots = self.funcGetAncestorsAtDepth(0)[self.npaFeatureClade]
+        npaOrder = np.lexsort((np.arange(len(npaRoots)), self.funcGetFeatureDepths(), npaRoots))
+        npaFirst = npaOrder[np.concatenate(([True], np.diff(npaRoots[npaOrder]) != 0))] if len(npaOrder) else npaOrder
+        npaRootRows = np.zeros(self.funcGetCladeCount(), dtype=int)
+        npaRootRows[npaRoots[npaFirst]] = npaFirst
+        return npaRootRows[npaRoots]
+
+    def funcGetTerminalFeatures(self):
+        """
+        Indicates the features which are terminal: clades without children which are given by only one feature.
+
+        :return Numpy array: Boolean indicator per feature
+        """
+
+        iClades = self.funcGetCladeCount()
+        npaChildCounts = np.bincount(self.npaParent[self.npaParent >= 0], minlength=iClades)
+        npaFeatureCounts = np.bincount(self.npaFeatureClade, minlength=iClades)
+        fTerminal = ( npaChildCounts == 0 ) & ( npaFeatureCounts == 1 )
+        return fTerminal[self.npaFeatureClade]
+
+    def funcGetSummedClades(self):
+        """
+        Indicates the clades which are given measurements when summing clades (as by CClade.impute):
+        the measured clades and the clades without a measured ancestor.
+        A clade without measurements under a measured clade is not summed.
+
+        :return Numpy array: Boolean indicator per clade
+        """
+
+        fMeasured = self.npaRow >= 0
+        fUnderMeasured = np.zeros(self.funcGetCladeCount(), dtype=bool)
+        for liLevel in self.funcGetLevels()[1:]:
+            npaParents = self.npaParent[liLevel]
+            fUnderMeasured[liLevel] = fMeasured[npaParents] | fUnderMeasured[npaParents]
+        return fMeasured | ~fUnderMeasured
+
+    def funcSumClades(self, npaData):
+        """
+        Returns the measurements of the clades: measured clades keep their measurements, the others
+        take the sum of their children, summed one level at a time from the deepest level.
+        Clades which are not summed (see funcGetSummedClades) are left at zero.
+        Children are added in the order and with the precision of CClade.impute (which adds python scalars:
+        a zero starts as an integer and float32 values are summed in float32 until a float64 is involved),
+        so the sums are identical to those of the CClade tree.
+        Sparse measurements are summed in blocks of samples.
+
+        :param npaData: Measurements (Row=Features, Columns=Samples) in the order of the feature names of the index
+        :type: Numpy 2-D array or scipy sparse matrix
+        :return Numpy array: Float64 measurements of the clades (Row=Clades in node order, Columns=Samples), CSR if the measurements are sparse
+        """
+
+        if not scipy.sparse.issparse(npaData):
+            return self._funcSumDenseClades(npaData)
+
+        npaData = npaData.tocsc()
+        iBlock = max(1, LineageIndex.c_iSparseBlockValues // max(1, self.funcGetCladeCount()))
+        lBlocks = [scipy.sparse.csr_matrix(self._funcSumDenseClades(npaData[:, iStart:iStart + iBlock].toarray()))
+            for iStart in xrange(0, npaData.shape[1], iBlock)]
+        npaValues = scipy.sparse.hstack(lBlocks, format="csr") if lBlocks else scipy.sparse.csr_matrix((self.funcGetCladeCount(), 0))
+        npaValues.eliminate_zeros()
+        npaValues.sort_indices()
+        return npaValues
+
+    def _funcSumDenseClades(self, npaData):
+        """
+        Sums the clades of dense measurements (see funcSumClades).
+        """
+
+        iClades, iSamples = self.funcGetCladeCount(), npaData.shape[1]
+        fSingle = ( npaData.dtype == np.float32 )
+        npaValues = np.zeros((iClades, iSamples))
+        npaTypes = np.zeros((iClades, iSamples), dtype=np.int8) if fSingle else None
+
+        #Measured clades
+        liMeasured = np.flatnonzero(self.npaRow >= 0)
+        for iStart in xrange(0, len(liMeasured), LineageIndex.c_iBlockSize):
+            liBlock = liMeasured[iStart:iStart + LineageIndex.c_iBlockSize]
+            npaValues[liBlock] = npaData[self.npaRow[liBlock]]
+            if fSingle:
+                npaTypes[liBlock] = np.where(npaValues[liBlock] != 0, LineageIndex.c_iSingle, LineageIndex.c_iZero)
+
+        #From the deepest level up, add the children of the summed clades which are not measured in order of their rank
+        fSummed = self.funcGetSummedClades() & ( self.npaRow < 0 )
+        for liLevel in reversed(self.funcGetLevels()[1:]):
+            liLevel = liLevel[fSummed[self.npaParent[liLevel]]]
+            liLevel = liLevel[np.argsort(self.npaRank[liLevel], kind="mergesort")]
+            npaBounds = np.searchsorted(self.npaRank[liLevel], np.arange(self.npaRank[liLevel].max() + 2)) if len(liLevel) else [0]
+            for iRank in xrange(len(npaBounds) - 1):
+                liChildren = liLevel[npaBounds[iRank]:npaBounds[iRank + 1]]
+                liParents = self.npaParent[liChildren]
+                if not iRank:
+                    npaValues[liParents] = npaValues[liChildren]
+                    if fSingle:
+                        npaTypes[liParents] = npaTypes[liChildren]
+                    continue
+                npaSum, npaChild = npaValues[liParents], npaValues[liChildren]
+                npaAdd = npaChild != 0
+                if fSingle:
+                    npaSumTypes = npaTypes[liParents]
+                    npaSingle = ( npaSumTypes == LineageIndex.c_iSingle ) & ( npaTypes[liChildren] == LineageIndex.c_iSingle )
+                    npaAdded = np.where(npaSingle, npaSum.astype(np.float32) + npaChild.astype(np.float32), npaSum + npaChild)
+                    npaTypes[liParents] = np.where(npaAdd, np.where(npaSingle, LineageIndex.c_iSingle, LineageIndex.c_iDouble), npaSumTypes)
+                else:
+                    npaAdded = npaSum + npaChild
+                npaValues[liParents] = np.where(npaAdd, npaAdded, npaSum)
+
+        return npaValues
+
+    def funcGetCladesEqualToDescendant(self, npaValues, fClades = None):
+        """
+        Indicates the clades with measurements equal to those of any of their descendants.
+
+        :param npaValues: Measurements of every clade (Row=Clades in node order, Columns=Samples)
+        :type: Numpy 2-D array
+        :param fClades: Indicator of the clades to compare, defaults to all clades
+        :type: Numpy boolean array
+        :return Numpy array: Boolean indicator per clade
+        """
+
+        fRemove = np.zeros(self.funcGetCladeCount(), dtype=bool)
+        if fClades is None:
+            fClades = np.ones(self.funcGetCladeCount(), dtype=bool)
+
+        #Equal rows have equal sums, only rows with equal sums are compared
+        #Sparse rows are compared by their contents, rows with the same contents have the same key
+        fSparse = scipy.sparse.issparse(npaValues)
+        npaSums = self._funcGetRowKeys(npaValues) if fSparse else npaValues.sum(axis=1)
+        liClades = np.flatnonzero(fClades)
+        liAncestors = self.npaParent[liClades]
+        while len(liClades):
+            fActive = liAncestors >= 0
+            liClades, liAncestors = liClades[fActive], liAncestors[fActive]
+            liCandidates = np.flatnonzero(fClades[liAncestors] & ( npaSums[liClades] == npaSums[liAncestors] ))
+            if fSparse:
+                fRemove[liAncestors[liCandidates]] = True
+                liCandidates = []
+            for iStart in xrange(0, len(liCandidates), LineageIndex.c_iBlockSize):
+                liBlock = liCandidates[iStart:iStart + LineageIndex.c_iBlockSize]
+                fEqual = np.all(npaValues[liClades[liBlock]] == npaValues[liAncestors[liBlock]], axis=1)
+                fRemove[liAncestors[liBlock[fEqual]]] = True
+            liAncestors = self.npaParent[liAncestors]
+        return fRemove
+
+    @staticmethod
+    def _funcGetRowKeys(npaValues):
+        """
+        Returns an integer key per row of a sparse matrix, rows have the same key if their values are equal.
+        Rows holding NaN are never equal and get unique (negative) keys.
+        """
+
+        npaValues = scipy.sparse.csr_matrix(npaValues, copy=True)
+        npaValues.eliminate_zeros()
+        npaValues.sort_indices()
+        fNaN = np.zeros(npaValues.shape[0], dtype=bool)
+        fNaN[np.repeat(np.arange(npaValues.shape[0]), np.diff(npaValues.indptr))[np.isnan(npaValues.data)]] = True
+
+        dictKeys = {}
+        npaKeys = np.zeros(npaValues.shape[0], dtype=int)
+        for iRow in xrange(npaValues.shape[0]):
+            iStart, iEnd = npaValues.indptr[iRow], npaValues.indptr[iRow + 1]
+            npaKeys[iRow] = dictKeys.setdefault(npaValues.indices[iStart:iEnd].tostring() + npaValues.data[iStart:iEnd].tostring(), len(dictKeys))
+        npaKeys[fNaN] = -1 - np.flatnonzero(fNaN)
+        return npaKeys
@@ -49,12 +49,19 @@ class MLPYDistanceAdaptor:
         """
         Constructor requires a matrix of distances, could be condensed or square matrices
 
-    	:param	npaDistanceMatrix:	The distance matrix to be used
-	:type	Numpy array
+    	:param	npaDistanceMatrix:	The distance matrix to be used, or the path to a binary distance matrix file
+	                                (see Metric.funcWriteBinaryMatrixFile) which is read as a condensed matrix.
+	:type	Numpy array or String
 	:param	fIsCondensedMatrix:	Indicator of the matrix being square (true = condensed; false = square)
 	:type	Boolean
         """
 
+        if isinstance(npaDistanceMatrix, basestring):
+            #Metric (and its dependencies) is only needed to read binary distance matrix files
+            from Metric import Metric
+            if Metric.funcIsBinaryMatrixFile(npaDistanceMatrix):
+                npaDistanceMatrix = Metric.funcReadBinaryMatrixFile(npaDistanceMatrix)[0]
+                fIsCondensedMatrix = True
         if fIsCondensedMatrix:
             self.npaMatrix = squareform(npaDistanceMatrix)
         else:
@@ -71,6 +78,6 @@ class MLPYDistanceAdaptor:
 	:type	Boolean
         """
 
-        if(self.npaMatrix == None):
+        if(self.npaMatrix is None):
             raise Exception("".join(["MLPYDistanceAdaptor. Attempted to compute distance with out a distance matrix passed in during construction."]))
         return self.npaMatrix[x[0],y[0]]
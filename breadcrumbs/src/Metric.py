@@ -35,13 +35,18 @@ __status__ = "Development"
 #Update path
 from ConstantsBreadCrumbs import ConstantsBreadCrumbs
 import csv
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
 import numpy as np
 from types import *
+from UtilityMath import UtilityMath
 from ValidateData import ValidateData
 
 #External libraries
 from cogent.maths.unifrac.fast_unifrac import fast_unifrac_file
 import cogent.maths.stats.alpha_diversity
+import scipy.sparse
 import scipy.spatial.distance
 
 class Metric:
@@ -62,6 +67,21 @@ class Metric:
     #Additive inverses of beta metrics
     c_strInvBrayCurtisDissimilarity = "InB_Curtis"
 
+    #Rank based beta metric, 1 - Spearman correlation (the correlation distance of ranked samples)
+    c_strSpearmanDissimilarity = "spearman"
+
+    #Approximate number of sample pairs measured at once by funcGetBlockedDissimilarity
+    c_iBetaBlockPairs = 2 ** 22
+
+    #Samples measured at once within a block, the pairs measured twice are at most half the square of this
+    c_iBetaSlabSamples = 64
+
+    #Keys of the data shared by the processes measuring blocks of beta metrics
+    c_strBlockSamplesKey = "Samples"
+    c_strBlockMetricKey = "Metric"
+    c_strBlockOutputKey = "Output"
+    c_strBlockSparseKey = "Sparse"
+
     #Richness
     c_strShannonRichness = "ShannonR"
     c_strObservedCount = "Observed_Count"
@@ -72,6 +92,11 @@ class Metric:
 	"mcintosh_d","brillouin_d","strong","fisher_alpha","simpson",
 	"mcintosh_e","heip_e","simpson_e","robbins","michaelis_menten_fit","chao1","ACE"])
 
+    #Alpha metrics which do not change with measurements of zero, these are measured on all samples at once
+    #and on only the non-zero measurements of samples in sparse matrices (see funcBuildAlphaMetricsMatrix)
+    setSparseAlphaDiversities = set([c_strShannonRichness, c_strSimpsonDiversity, c_strInvSimpsonDiversity,
+	c_strObservedCount, c_strChao1Diversity])
+
     #Different beta diversity metrics
     setBetaDiversities = set(["braycurtis","canberra","chebyshev","cityblock",
 	"correlation","cosine","euclidean","hamming","sqeuclidean"])
@@ -215,6 +240,9 @@ class Metric:
         :return	Double:	Dissimilarity metric
         """
 
+        if scipy.sparse.issparse(ldSampleTaxaAbundancies):
+            ldSampleTaxaAbundancies = ldSampleTaxaAbundancies.toarray()
+
         #Calculate metric
         try:
             return scipy.spatial.distance.pdist(ldSampleTaxaAbundancies, funcDistanceFunction)
@@ -236,6 +264,8 @@ class Metric:
         :return	list double:	Dissimilarity metrics between each sample
         """
 
+        if scipy.sparse.issparse(ldSampleTaxaAbundancies):
+            ldSampleTaxaAbundancies = ldSampleTaxaAbundancies.toarray()
         return scipy.spatial.distance.pdist(ldSampleTaxaAbundancies,strMetric)
 
     #Test 3
@@ -250,17 +280,233 @@ class Metric:
         Note***: Assumes that the abundance measurements are already normalized by the total population N.
 
         :param	ldSampleTaxaAbundancies:
-        :type:	List of doubles
+        :type:	List of doubles or scipy sparse matrix
         :return	Double Matrix:	Dissimilarity metric
         """
 
         #Calculate metric
         try:
+            if scipy.sparse.issparse(ldSampleTaxaAbundancies):
+                return Metric.funcGetSparseBrayCurtisDissimilarity(ldSampleTaxaAbundancies)
             return scipy.spatial.distance.pdist(X=ldSampleTaxaAbundancies, metric='braycurtis')
         except ValueError as error:
             print "".join(["Metric.getBrayCurtisDissimilarity. Error=",str(error)])
             return False
 
+    @staticmethod
+    def funcGetSparseBrayCurtisDissimilarity(npaSampleTaxaAbundancies):
+        """
+        Calculates the BrayCurtis Beta dissimilarity index on a sparse matrix of samples (rows) x measurements (columns).
+        For non-negative measurements sum(abs(row1-row2)) = sum(row1)+sum(row2)-2*sum(min(row1,row2)) so only
+        measurements which are not zero in both samples are compared. Matrices with negative measurements are compared densely.
+        Distances are in the condensed form given by funcGetBrayCurtisDissimilarity.
+
+        :param	npaSampleTaxaAbundancies:	Samples (rows) x measurements (columns)
+        :type:	Scipy sparse matrix
+        :return	Double Matrix:	Dissimilarity metric
+        """
+
+        npaSamples = scipy.sparse.csr_matrix(npaSampleTaxaAbundancies, dtype=float)
+        npaSamples.sum_duplicates()
+        if npaSamples.nnz and ( npaSamples.data.min() < 0 ):
+            return scipy.spatial.distance.pdist(X=npaSamples.toarray(), metric='braycurtis')
+
+        npaTotals, npaRows = Metric._funcGetSparseBrayCurtisSummaries(npaSamples)
+        return Metric._funcGetSparseBrayCurtisRows(npaSamples, npaTotals, npaRows, 0, npaSamples.shape[0] - 1)
+
+    @staticmethod
+    def _funcGetSparseBrayCurtisSummaries(npaSamples):
+        """
+        Returns the totals of the samples (rows) of a sparse CSR matrix and the sample of each stored measurement.
+        """
+
+        return [np.asarray(npaSamples.sum(axis=1)).ravel(), np.repeat(np.arange(npaSamples.shape[0]), np.diff(npaSamples.indptr))]
+
+    @staticmethod
+    def _funcGetSparseBrayCurtisRows(npaSamples, npaTotals, npaRows, iStart, iEnd):
+        """
+        Calculates the BrayCurtis dissimilarities of the samples iStart to iEnd (excluded) of a sparse CSR matrix of
+        non-negative measurements to the samples after them, in the condensed order.
+
+        :param	npaSamples:	Samples (rows) x measurements (columns), with duplicates summed
+        :type:	Scipy sparse CSR matrix
+        :param	npaTotals:	Totals of the samples
+        :type:	Numpy array
+        :param	npaRows:	Sample of each stored measurement
+        :type:	Numpy array
+        :param	iStart:	First sample
+        :type:	Integer
+        :param	iEnd:	Sample after the last sample
+        :type:	Integer
+        :return	Numpy array:	Dissimilarities
+        """
+
+        iSampleCount = npaSamples.shape[0]
+        npaSample = np.zeros(npaSamples.shape[1])
+        lnpaDistances = [np.zeros(0)]
+        #Compare each sample (expanded) to the samples after it (sparse)
+        for iSample in xrange(iStart, min(iEnd, iSampleCount - 1)):
+            iFirst, iNext = npaSamples.indptr[iSample], npaSamples.indptr[iSample + 1]
+            npaSample[:] = 0
+            npaSample[npaSamples.indices[iFirst:iNext]] = npaSamples.data[iFirst:iNext]
+            npaShared = np.minimum(npaSamples.data[iNext:], npaSample[npaSamples.indices[iNext:]])
+            npaSharedSums = np.bincount(npaRows[iNext:] - ( iSample + 1 ), weights=npaShared, minlength=iSampleCount - iSample - 1)
+            npaPairTotals = npaTotals[iSample] + npaTotals[iSample + 1:]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lnpaDistances.append(( npaPairTotals - ( 2.0 * npaSharedSums ) ) / npaPairTotals)
+        return np.concatenate(lnpaDistances)
+
+    @staticmethod
+    def funcGetBlockedDissimilarity(npaSamples, strMetric, iProcesses = 1, strOutputFile = None, iBlockPairs = None):
+        """
+        Calculates a beta-diversity metric between samples in blocks of sample pairs, on a pool of processes.
+        The pairs of samples are split into blocks of consecutive samples (each with the samples after them) of about
+        the same number of pairs, each block is measured and written into the condensed output
+        (see funcGetBrayCurtisDissimilarity for the order). Processes share the measurements and the output
+        (shared memory or a memory-mapped file) so neither the input nor the full square matrix is copied.
+        Spearman is measured as the correlation distance between the samples ranked once.
+        Sparse non-negative measurements are measured sparsely for Bray-Curtis, other metrics expand them.
+
+        :param	npaSamples:	Samples (rows) x measurements (columns)
+        :type:	Numpy array or scipy sparse matrix
+        :param	strMetric:	Metric name, Metric.c_strBrayCurtisDissimilarity, Metric.c_strSpearmanDissimilarity or one of setBetaDiversities
+        :type:	String
+        :param	iProcesses:	Number of processes, None uses all processors.
+        :type:	Integer
+        :param	strOutputFile:	If given, the condensed output is a float64 memory-mapped file (numpy.memmap) written to this path.
+        :type:	String
+        :param	iBlockPairs:	Approximate number of pairs measured at once (None is c_iBetaBlockPairs)
+        :type:	Integer
+        :return	Numpy array:	Condensed dissimilarities, False on error.
+        """
+
+        if not iProcesses:
+            iProcesses = multiprocessing.cpu_count()
+        iBlockPairs = iBlockPairs or Metric.c_iBetaBlockPairs
+
+        dictData = {}
+        if strMetric == Metric.c_strBrayCurtisDissimilarity:
+            strMetric = "braycurtis"
+        if scipy.sparse.issparse(npaSamples):
+            npaSamples = scipy.sparse.csr_matrix(npaSamples, dtype=float)
+            npaSamples.sum_duplicates()
+            if ( strMetric == "braycurtis" ) and not ( npaSamples.nnz and ( npaSamples.data.min() < 0 ) ):
+                dictData[Metric.c_strBlockSparseKey] = Metric._funcGetSparseBrayCurtisSummaries(npaSamples)
+            else:
+                npaSamples = npaSamples.toarray()
+        else:
+            npaSamples = np.asarray(npaSamples, dtype=float)
+        if strMetric == Metric.c_strSpearmanDissimilarity:
+            npaSamples = UtilityMath.funcRankRows(npaSamples)
+            strMetric = "correlation"
+        if not ( strMetric in Metric.setBetaDiversities ):
+            print "".join(["Metric.funcGetBlockedDissimilarity. Error=Unknown metric ",str(strMetric)])
+            return False
+        if ( len(npaSamples.shape) != 2 ):
+            print "Metric.funcGetBlockedDissimilarity. Error=A 2-dimensional array must be passed."
+            return False
+
+        #Condensed output shared with the processes
+        iSampleCount = npaSamples.shape[0]
+        iPairCount = iSampleCount * ( iSampleCount - 1 ) // 2
+        if strOutputFile:
+            npaDistances = np.memmap(strOutputFile, dtype=np.float64, mode="w+", shape=(max(iPairCount, 1),))[:iPairCount]
+        elif ( iProcesses > 1 ) and iPairCount:
+            npaDistances = np.frombuffer(multiprocessing.sharedctypes.RawArray(ctypes.c_double, iPairCount), dtype=np.float64)
+        else:
+            npaDistances = np.zeros(iPairCount)
+        dictData.update({Metric.c_strBlockSamplesKey:npaSamples, Metric.c_strBlockMetricKey:strMetric, Metric.c_strBlockOutputKey:npaDistances})
+
+        #Blocks of consecutive samples with about iBlockPairs pairs [first sample, sample after the last, offset in the output]
+        llBlocks = []
+        iStart = 0
+        while iStart < iSampleCount - 1:
+            iEnd = min(iSampleCount - 1, iStart + max(1, iBlockPairs // ( iSampleCount - iStart - 1 )))
+            llBlocks.append([iStart, iEnd, iStart * iSampleCount - iStart * ( iStart + 1 ) // 2])
+            iStart = iEnd
+
+        try:
+            if ( iProcesses > 1 ) and ( len(llBlocks) > 1 ):
+                pool = multiprocessing.Pool(processes = min(iProcesses, len(llBlocks)), initializer = funcSetDissimilarityBlockData, initargs = (dictData,))
+                try:
+                    pool.map(funcMeasureDissimilarityBlock, llBlocks, chunksize = 1)
+                    pool.close()
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                for lBlock in llBlocks:
+                    Metric._funcMeasureDissimilarityBlock(dictData, lBlock)
+        except ValueError as error:
+            print "".join(["Metric.funcGetBlockedDissimilarity. Error=",str(error)])
+            return False
+        if strOutputFile:
+            npaDistances.flush()
+        return npaDistances
+
+    @staticmethod
+    def _funcMeasureDissimilarityBlock(dictData, lBlock):
+        """
+        Measures a block of sample pairs and writes it into the condensed output (see funcGetBlockedDissimilarity).
+
+        :param	dictData:	Samples, metric and output of the measurement
+        :type:	Dictionary
+        :param	lBlock:	[first sample, sample after the last sample, offset of the block in the output]
+        :type:	List of integers
+        """
+
+        iStart, iEnd, iOffset = lBlock
+        npaSamples = dictData[Metric.c_strBlockSamplesKey]
+        if Metric.c_strBlockSparseKey in dictData:
+            npaTotals, npaRows = dictData[Metric.c_strBlockSparseKey]
+            npaBlock = Metric._funcGetSparseBrayCurtisRows(npaSamples, npaTotals, npaRows, iStart, iEnd)
+            dictData[Metric.c_strBlockOutputKey][iOffset:iOffset + len(npaBlock)] = npaBlock
+            return
+
+        #Slabs of samples against the samples after the first sample of the slab, keeping the pairs after each sample
+        iSampleCount = npaSamples.shape[0]
+        for iSlab in xrange(iStart, iEnd, Metric.c_iBetaSlabSamples):
+            iSlabEnd = min(iEnd, iSlab + Metric.c_iBetaSlabSamples)
+            npaTile = scipy.spatial.distance.cdist(npaSamples[iSlab:iSlabEnd], npaSamples[iSlab + 1:], dictData[Metric.c_strBlockMetricKey])
+            npaBlock = npaTile[np.arange(npaTile.shape[1])[np.newaxis,:] >= np.arange(npaTile.shape[0])[:,np.newaxis]]
+            iSlabOffset = iSlab * iSampleCount - iSlab * ( iSlab + 1 ) // 2
+            dictData[Metric.c_strBlockOutputKey][iSlabOffset:iSlabOffset + len(npaBlock)] = npaBlock
+
+    @staticmethod
+    def funcGetCrossDissimilarity(npaSamples, npaReferences, strMetric):
+        """
+        Calculates a beta-diversity metric between each sample and each reference sample
+        (for example to place new samples in an ordination of the reference samples).
+        Each pair is measured as given, for Metric.c_strInvBrayCurtisDissimilarity identical samples are at 1, not 0.
+
+        :param	npaSamples:	Samples (rows) x measurements (columns)
+        :type:	Numpy array or scipy sparse matrix
+        :param	npaReferences:	Reference samples (rows) x the same measurements (columns)
+        :type:	Numpy array or scipy sparse matrix
+        :param	strMetric:	Metric name, Metric.c_strBrayCurtisDissimilarity, Metric.c_strInvBrayCurtisDissimilarity,
+                                Metric.c_strSpearmanDissimilarity or one of setBetaDiversities
+        :type:	String
+        :return	Numpy array:	Samples (rows) x reference samples (columns), False on error.
+        """
+
+        npaSamples = npaSamples.toarray() if scipy.sparse.issparse(npaSamples) else np.asarray(npaSamples, dtype=float)
+        npaReferences = npaReferences.toarray() if scipy.sparse.issparse(npaReferences) else np.asarray(npaReferences, dtype=float)
+        strScipyMetric = "braycurtis" if strMetric in [Metric.c_strBrayCurtisDissimilarity, Metric.c_strInvBrayCurtisDissimilarity] else strMetric
+        if strMetric == Metric.c_strSpearmanDissimilarity:
+            npaSamples, npaReferences = UtilityMath.funcRankRows(npaSamples), UtilityMath.funcRankRows(npaReferences)
+            strScipyMetric = "correlation"
+        if not ( strScipyMetric in Metric.setBetaDiversities ):
+            print "".join(["Metric.funcGetCrossDissimilarity. Error=Unknown metric ",str(strMetric)])
+            return False
+        try:
+            npaDistances = scipy.spatial.distance.cdist(npaSamples, npaReferences, strScipyMetric)
+        except ValueError as error:
+            print "".join(["Metric.funcGetCrossDissimilarity. Error=",str(error)])
+            return False
+        if strMetric == Metric.c_strInvBrayCurtisDissimilarity:
+            np.subtract(1.0, npaDistances, out=npaDistances)
+        return npaDistances
+
     #Test 3
     @staticmethod
     def funcGetInverseBrayCurtisDissimilarity(ldSampleTaxaAbundancies):
@@ -363,8 +609,9 @@ class Metric:
         Row = metric, column = sample
 
         :param	npaSampleAbundance:	Observations (Taxa (row) x sample (column))
-        :type:	Numpy Array
+        :type:	Numpy Array or scipy sparse matrix
         :param	lsSampleNames:	List of sample names of samples to measure (do not include the taxa id column name or other column names which should not be read).
+            For a sparse matrix these are the names of all its columns in order.
         :type:	List of strings	Strings being samples to measure from the npaSampleAbundance.
         :param	lsDiversityMetricAlpha:	List of diversity metrics to use in measuring.
         :type:	List of strings	Strings being metrics to derived from the indicated samples.
@@ -375,40 +622,103 @@ class Metric:
         if not ValidateData.funcIsValidList(lsDiversityMetricAlpha):
             lsDiversityMetricAlpha = [lsDiversityMetricAlpha]
 
-        #Get amount of metrics
-        metricsCount = len(lsDiversityMetricAlpha)
-
         #Create return
         returnMetricsMatrixRet = [[] for index in lsDiversityMetricAlpha]
+        iSampleCount = len(lsSampleNames)
+        if not iSampleCount:
+            return returnMetricsMatrixRet
+
+        #Measurements of all samples and how to sum them per sample
+        #Sparse samples are measured on their non-zero measurements
+        fSparse = scipy.sparse.issparse(npaSampleAbundance)
+        if fSparse:
+            npaSampleAbundance = scipy.sparse.csc_matrix(npaSampleAbundance)
+            npaSampleAbundance.sum_duplicates()
+            npaValues = npaSampleAbundance.data
+            npaColumns = np.repeat(np.arange(iSampleCount), np.diff(npaSampleAbundance.indptr))
+            funcSum = lambda npaTerms: np.bincount(npaColumns, weights = npaTerms, minlength = iSampleCount).astype(np.float64)
+            funcCount = lambda npaIndicators: np.bincount(npaColumns[npaIndicators], minlength = iSampleCount)
+        else:
+            npaValues = np.column_stack([np.asarray(npaSampleAbundance[sample]) for sample in lsSampleNames])
+            funcSum = lambda npaTerms: np.add.reduce(npaTerms, axis = 0, dtype = np.float64 if npaTerms.dtype.kind == "f" else None)
+            funcCount = lambda npaIndicators: npaIndicators.sum(axis = 0)
 
-        #For each sample get all metrics
-        #Place in list of lists
+        #Measure each metric for all samples at once
         #[[metric1-sample1, metric1-sample2, metric1-sample3],[metric1-sample1, metric1-sample2, metric1-sample3]]
-        for sample in lsSampleNames:
-            sampleAbundance = npaSampleAbundance[sample]
-            for metricIndex in xrange(0,metricsCount):
-                returnMetricsMatrixRet[metricIndex].append(Metric.funcGetAlphaMetric(ldAbundancies = sampleAbundance, strMetric = lsDiversityMetricAlpha[metricIndex]))
+        for metricIndex, strMetric in enumerate(lsDiversityMetricAlpha):
+            if strMetric in Metric.setSparseAlphaDiversities:
+                #Comparisons with NaN measurements are False as when measuring sample by sample
+                with np.errstate(invalid = "ignore"):
+                    returnMetricsMatrixRet[metricIndex] = Metric._funcGetAlphaMetricForSamples(npaValues, strMetric, funcSum, funcCount)
+            else:
+                #Other metrics are measured sample by sample
+                for iSample, sample in enumerate(lsSampleNames):
+                    sampleAbundance = npaSampleAbundance[:,iSample].toarray().ravel() if fSparse else npaSampleAbundance[sample]
+                    returnMetricsMatrixRet[metricIndex].append(Metric.funcGetAlphaMetric(ldAbundancies = sampleAbundance, strMetric = strMetric))
         return returnMetricsMatrixRet
 
+    @staticmethod
+    def _funcGetAlphaMetricForSamples(npaValues, strMetric, funcSum, funcCount):
+        """
+        Measures an alpha metric on all samples at once, giving the values of funcGetAlphaMetric.
+
+        :param	npaValues:	Measurements, a matrix (Taxa (row) x sample (column)) or the non-zero measurements of a sparse matrix.
+        :type:	Numpy array
+        :param	strMetric:	The metric to measure.
+        :type:	String	Metric name (Use from constants above).
+        :param	funcSum:	Sums values of the same shape as the measurements by sample.
+        :type:	Function
+        :param	funcCount:	Counts indicators of the same shape as the measurements by sample.
+        :type:	Function
+        :return	List:	Metric per sample, None if the metric is not one of setSparseAlphaDiversities.
+        """
+
+        if strMetric in [Metric.c_strSimpsonDiversity, Metric.c_strInvSimpsonDiversity]:
+            npaSimpson = funcSum(npaValues*npaValues)
+            if strMetric == Metric.c_strSimpsonDiversity:
+                return list(npaSimpson)
+            return [1.0/dSimpson if dSimpson else False for dSimpson in npaSimpson]
+        elif strMetric == Metric.c_strShannonRichness:
+            npaShannon = funcSum(npaValues*np.log(np.where(npaValues != 0, npaValues, 1)))
+            return [0.0 if dShannon == 0.0 else -1 * dShannon for dShannon in npaShannon]
+        elif strMetric == Metric.c_strObservedCount:
+            return funcCount(npaValues > 0).tolist()
+        #Chao1 Needs NOT Normalized Abundance (Counts), samples which are not counts are False
+        elif strMetric == Metric.c_strChao1Diversity:
+            lfCounts = ( funcCount((npaValues < 1) & (npaValues != 0)) == 0 ).tolist()
+            liObserved = funcCount(npaValues != 0).tolist()
+            liSingles = funcCount(npaValues == 1.0).tolist()
+            liDoubles = funcCount(npaValues == 2.0).tolist()
+            return [( iObserved if ( ( iSingles == 0 ) or ( iDoubles == 0 ) ) else iObserved + iSingles**2/float(iDoubles*2) ) if fCounts else False
+                for fCounts, iObserved, iSingles, iDoubles in zip(lfCounts, liObserved, liSingles, liDoubles)]
+        return None
+
     #Testing 6 cases
     @staticmethod
-    def funcGetBetaMetric(npadAbundancies=None, sMetric=None, istrmTree=None, istrmEnvr=None, lsSampleOrder=None, fAdditiveInverse = False):
+    def funcGetBetaMetric(npadAbundancies=None, sMetric=None, istrmTree=None, istrmEnvr=None, lsSampleOrder=None, fAdditiveInverse = False, iProcesses = 1, strOutputFile = None):
         """
         Takes a matrix of values and returns a beta metric matrix. The metric returned is indicated by name (sMetric).
+        Bray-Curtis, Spearman and the metrics of setBetaDiversities are measured in blocks (see funcGetBlockedDissimilarity).
 		
         :param	npadAbundancies:	Numpy array of sample abundances to measure against.
         :type:	Numpy Array	Numpy array where row=samples and columns = features.
         :param	sMetric:	String name of beta metric. Possibilities are listed in microPITA.
         :type:	String	String name of beta metric. Possibilities are listed in microPITA.
+        :param	iProcesses:	Number of processes measuring the blocked metrics, None uses all processors.
+        :type:	Integer
+        :param	strOutputFile:	If given, blocked metrics are written to this memory-mapped file (see funcGetBlockedDissimilarity).
+        :type:	String
         :return	Double:	Measurement indicated by metric for given abundance list
         """
 
-        if sMetric == Metric.c_strBrayCurtisDissimilarity:
-            mtrxDistance = Metric.funcGetBrayCurtisDissimilarity(ldSampleTaxaAbundancies=npadAbundancies)
-        elif sMetric == Metric.c_strInvBrayCurtisDissimilarity:
-            mtrxDistance = Metric.funcGetInverseBrayCurtisDissimilarity(ldSampleTaxaAbundancies=npadAbundancies)
-        elif sMetric in Metric.setBetaDiversities:
-            mtrxDistance = Metric.funcGetDissimilarityByName(ldSampleTaxaAbundancies=npadAbundancies, strMetric=sMetric)
+        if ( sMetric in [Metric.c_strBrayCurtisDissimilarity, Metric.c_strInvBrayCurtisDissimilarity, Metric.c_strSpearmanDissimilarity] ) or ( sMetric in Metric.setBetaDiversities ):
+            mtrxDistance = Metric.funcGetBlockedDissimilarity(npaSamples=npadAbundancies,
+                strMetric=Metric.c_strBrayCurtisDissimilarity if sMetric == Metric.c_strInvBrayCurtisDissimilarity else sMetric,
+                iProcesses=iProcesses, strOutputFile=strOutputFile)
+            #The inverse is taken in place so a shared or memory-mapped output stays so
+            if ( not type(mtrxDistance) is BooleanType ) and ( ( sMetric == Metric.c_strInvBrayCurtisDissimilarity ) != bool(fAdditiveInverse) ):
+                np.subtract(1.0, mtrxDistance, out=mtrxDistance)
+            return mtrxDistance
         elif sMetric == Metric.c_strUnifracUnweighted:
             mtrxDistance = Metric.funcGetUnifracDistance(istrmTree=istrmTree,istrmEnvr=istrmEnvr,lsSampleOrder=lsSampleOrder,fWeighted=False)
 #            mtrxDistance = xReturn[0] if not type(xReturn) is BooleanType else xReturn
@@ -429,42 +739,75 @@ class Metric:
     def funcReadMatrixFile(istmMatrixFile, lsSampleOrder=None):
 	"""
 	Reads in a file with a precalculated beta-diversty matrix.
+	Rows are streamed, only the rows of the requested samples are parsed (each row at once) and the
+	columns are put in the requested order with a permutation made once from the header.
+	Binary distance matrix files (see funcWriteBinaryMatrixFile) are also read.
 
 	:param istmMatrixFile:	File with beta-diversity matrix
 	:type:	FileStream of String file path
+	:param lsSampleOrder:	Samples to read in the order to return them, None reads all samples in the file order.
+	:type:	List of strings
+	:return	Tuple:	(Square matrix, list of sample names)
 	"""
 
+        if Metric.funcIsBinaryMatrixFile(istmMatrixFile):
+            npaDistances, lsSampleOrder = Metric.funcReadBinaryMatrixFile(istmMatrixFile, lsSampleOrder)
+            if type(npaDistances) is BooleanType:
+                return False
+            return (scipy.spatial.distance.squareform(npaDistances) if len(lsSampleOrder) > 1 else np.zeros((len(lsSampleOrder),len(lsSampleOrder))),lsSampleOrder)
+
         #Read in data
-        f = csv.reader(open(istmMatrixFile,"r") if isinstance(istmMatrixFile, str) else istmMatrixFile, delimiter=ConstantsBreadCrumbs.c_matrixFileDelim )
+        istmMatrix = open(istmMatrixFile,"r") if isinstance(istmMatrixFile, str) else istmMatrixFile
+        cDelim = ConstantsBreadCrumbs.c_matrixFileDelim
 
         #Get header
         try:
-            lsHeader = f.next()
+            lsHeader = csv.reader([istmMatrix.next()], delimiter=cDelim).next()
         except StopIteration:
             return (False,False)
-        lsHeaderReducedToSamples = [sHeader for sHeader in lsHeader if sHeader in lsSampleOrder] if lsSampleOrder else lsHeader[1:]
+        setSampleOrder = set(lsSampleOrder) if lsSampleOrder else set()
+        lsHeaderReducedToSamples = [sHeader for sHeader in lsHeader if sHeader in setSampleOrder] if lsSampleOrder else lsHeader[1:]
 
         #If no sample ordering is given, set the ordering to what is in the file
         if not lsSampleOrder:
 	    lsSampleOrder = lsHeaderReducedToSamples
 
         #Preallocate matrix
-        mtrxData = np.zeros(shape=(len(lsSampleOrder),len(lsSampleOrder)))
+        iSampleCount = len(lsSampleOrder)
+        mtrxData = np.zeros(shape=(iSampleCount,iSampleCount))
 
         #Make sure all samples requested are in the file
-        if(not len(lsSampleOrder) == len(lsHeaderReducedToSamples)): return False
-
-	for lsLine in f:
-            if lsLine[0] in lsSampleOrder:
-                iRowIndex = lsSampleOrder.index(lsLine[0])
-
-                for i in xrange(1,len(lsSampleOrder)):
-                    iColumnIndexComing = lsHeader.index(lsSampleOrder[i])
-                    iColumnIndexGoing = lsSampleOrder.index(lsSampleOrder[i])
-                    mtrxData[iRowIndex,iColumnIndexGoing] = lsLine[iColumnIndexComing]
-                    mtrxData[iColumnIndexGoing,iRowIndex] = lsLine[iColumnIndexComing]
+        if(not iSampleCount == len(lsHeaderReducedToSamples)): return False
+
+        #Index of each requested sample (first occurence) and the permutation of the file columns to the requested order
+        dictSampleOrder = {}
+        for iIndex, sSample in enumerate(lsSampleOrder):
+            dictSampleOrder.setdefault(sSample, iIndex)
+        dictHeader = {}
+        for iIndex, sHeader in enumerate(lsHeader[1:]):
+            dictHeader.setdefault(sHeader, iIndex)
+        npaColumns = np.array([dictHeader[sSample] for sSample in lsSampleOrder], dtype=int)
+
+        for strLine in istmMatrix:
+            strLine = strLine.rstrip("\r\n")
+            lsLine = strLine.split(cDelim, 1)
+            #Quoted ids are left to csv
+            if lsLine[0].startswith(ConstantsBreadCrumbs.c_cQuote):
+                lsLine = csv.reader([strLine], delimiter=cDelim).next()
+                lsLine = [lsLine[0], cDelim.join(lsLine[1:])]
+            iRowIndex = dictSampleOrder.get(lsLine[0])
+            if iRowIndex is None:
+                continue
+
+            #Parse the row at once, malformed rows are converted value by value to report the value
+            npaLine = np.fromstring(lsLine[1], sep=cDelim) if len(lsLine) > 1 else np.zeros(0)
+            if not len(npaLine) == len(lsHeader) - 1:
+                npaLine = np.array(lsLine[1].split(cDelim) if len(lsLine) > 1 else [], dtype=float)
+            npaLine = npaLine[npaColumns]
+            mtrxData[iRowIndex,1:] = npaLine[1:]
+            mtrxData[1:,iRowIndex] = npaLine[1:]
         tpleMData = mtrxData.shape
-        mtrxData = mtrxData if any(sum(ld)>0 for ld in mtrxData) or ((tpleMData[0]==1) and (tpleMData[1]==1)) else []
+        mtrxData = mtrxData if ( mtrxData.sum(axis=1) > 0 ).any() or ((tpleMData[0]==1) and (tpleMData[1]==1)) else []
         return (mtrxData,lsSampleOrder)
 
     #Test cases 2
@@ -502,3 +845,174 @@ class Metric:
         ostmOut.writerow(lsSampleNames)
         [ostmOut.writerow([lsSampleNames[iIndex+1]]+mtrxMatrix[iIndex,].tolist()) for iIndex in xrange(tpleiShape[0])]
         return True
+
+    @staticmethod
+    def funcCreateBinaryMatrixFile(strMatrixFile, lsSampleNames, strDType = "float64"):
+        """
+        Creates a binary distance matrix file and returns its condensed matrix memory-mapped for writing.
+        The file holds a text header (ConstantsBreadCrumbs.c_strBinaryMatrixFileMagic, version, data type,
+        sample count and data offset), the sample names one per line and the condensed matrix.
+
+        :param strMatrixFile:	File to write to
+        :type:	String
+        :param lsSampleNames:	The names of the samples in the order of the matrix
+        :type:	List of strings
+        :param strDType:	float32 or float64
+        :type:	String
+        :return	Numpy memmap:	Condensed matrix to fill (flush when done), False on error.
+        """
+
+        lsSampleNames = [str(sName) for sName in lsSampleNames]
+        if not strDType in ["float32","float64"]:
+            print "".join(["Metric.funcCreateBinaryMatrixFile. Error=Unsupported data type ",str(strDType)])
+            return False
+        if [sName for sName in lsSampleNames if ConstantsBreadCrumbs.c_strEndline in sName]:
+            print "Metric.funcCreateBinaryMatrixFile. Error=Sample names can not hold new lines."
+            return False
+
+        #The header line has a fixed width offset so its length is known before the offset is
+        iSampleCount = len(lsSampleNames)
+        strNames = "".join([sName + ConstantsBreadCrumbs.c_strEndline for sName in lsSampleNames])
+        strHeader = ConstantsBreadCrumbs.c_cTab.join([ConstantsBreadCrumbs.c_strBinaryMatrixFileMagic,
+            ConstantsBreadCrumbs.c_strBinaryMatrixFileVersion, strDType, str(iSampleCount), "%020d"])
+        iOffset = len(strHeader % 0) + len(ConstantsBreadCrumbs.c_strEndline) + len(strNames)
+        iOffset += -iOffset % ConstantsBreadCrumbs.c_iBinaryMatrixFileAlignment
+        strHeader = strHeader % iOffset + ConstantsBreadCrumbs.c_strEndline + strNames
+        with open(strMatrixFile, "wb") as ostmOut:
+            ostmOut.write(strHeader + "\0" * ( iOffset - len(strHeader) ))
+
+        iPairCount = iSampleCount * ( iSampleCount - 1 ) // 2
+        if not iPairCount:
+            return np.zeros(0, dtype=strDType)
+        return np.memmap(strMatrixFile, dtype=np.dtype(strDType).newbyteorder("<"), mode="r+", offset=iOffset, shape=(iPairCount,))
+
+    @staticmethod
+    def funcWriteBinaryMatrixFile(mtrxMatrix, strMatrixFile, lsSampleNames=None, strDType = "float64"):
+        """
+        Writes a distance matrix to a binary distance matrix file (see funcCreateBinaryMatrixFile).
+
+        :param mtrxMatrix:	Condensed or square matrix to write to file
+        :type:	Numpy array
+        :param strMatrixFile:	File to write to
+        :type:	String
+        :param lsSampleNames:	The names of the samples in the order of the matrix
+        :type:	List of strings
+        :param strDType:	float32 or float64
+        :type:	String
+        :return	Boolean:	True on success
+        """
+
+        mtrxMatrix = np.asarray(mtrxMatrix)
+        if ( mtrxMatrix.ndim == 2 ) and ( mtrxMatrix.shape[0] == mtrxMatrix.shape[1] ):
+            mtrxMatrix = scipy.spatial.distance.squareform(mtrxMatrix, checks=False)
+        if not mtrxMatrix.ndim == 1:
+            print "".join(["Metric.funcWriteBinaryMatrixFile. Error=Matrix is not square or condensed ("+str(mtrxMatrix.shape)+")."])
+            return False
+        if not lsSampleNames:
+            lsSampleNames = range(int(round(( 1 + np.sqrt(1 + 8 * len(mtrxMatrix)) ) / 2)))
+        if not ( len(lsSampleNames) * ( len(lsSampleNames) - 1 ) // 2 == len(mtrxMatrix) ):
+            print "".join(["Metric.funcWriteBinaryMatrixFile. Error= Length of sample names ("+str(len(lsSampleNames))+") and matrix ("+str(mtrxMatrix.shape)+") not equal."])
+            return False
+
+        npaOut = Metric.funcCreateBinaryMatrixFile(strMatrixFile, lsSampleNames, strDType)
+        if type(npaOut) is BooleanType:
+            return False
+        npaOut[:] = mtrxMatrix
+        if isinstance(npaOut, np.memmap):
+            npaOut.flush()
+        return True
+
+    @staticmethod
+    def funcIsBinaryMatrixFile(strMatrixFile):
+        """
+        Indicates if a file is a binary distance matrix file (see funcCreateBinaryMatrixFile).
+
+        :param strMatrixFile:	File to check
+        :type:	String
+        :return	Boolean:	True if the file starts with the binary matrix header
+        """
+
+        if not isinstance(strMatrixFile, basestring):
+            return False
+        try:
+            with open(strMatrixFile, "rb") as istmIn:
+                return istmIn.read(len(ConstantsBreadCrumbs.c_strBinaryMatrixFileMagic) + 1) == ConstantsBreadCrumbs.c_strBinaryMatrixFileMagic + ConstantsBreadCrumbs.c_cTab
+        except IOError:
+            return False
+
+    @staticmethod
+    def funcReadBinaryMatrixFile(strMatrixFile, lsSampleOrder=None):
+        """
+        Reads a binary distance matrix file (see funcCreateBinaryMatrixFile).
+        The condensed matrix is memory-mapped read only, when lsSampleOrder subsets or reorders
+        the samples only the requested distances are read (into memory).
+
+        :param strMatrixFile:	Binary distance matrix file
+        :type:	String
+        :param lsSampleOrder:	Names of the samples to read in the order to return them, None reads all samples in the file order.
+        :type:	List of strings
+        :return	Tuple:	(Condensed matrix, list of sample names), (False,False) on error.
+        """
+
+        with open(strMatrixFile, "rb") as istmIn:
+            lsHeader = istmIn.readline().rstrip(ConstantsBreadCrumbs.c_strEndline).split(ConstantsBreadCrumbs.c_cTab)
+            if not ( ( len(lsHeader) == 5 ) and ( lsHeader[0] == ConstantsBreadCrumbs.c_strBinaryMatrixFileMagic ) and ( lsHeader[1] == ConstantsBreadCrumbs.c_strBinaryMatrixFileVersion ) ):
+                print "".join(["Metric.funcReadBinaryMatrixFile. Error=Not a binary distance matrix file ",str(strMatrixFile)])
+                return (False,False)
+            strDType, iSampleCount, iOffset = lsHeader[2], int(lsHeader[3]), int(lsHeader[4])
+            lsHeader = [istmIn.readline().rstrip(ConstantsBreadCrumbs.c_strEndline) for iSample in xrange(iSampleCount)]
+
+        iPairCount = iSampleCount * ( iSampleCount - 1 ) // 2
+        npaDistances = np.memmap(strMatrixFile, dtype=np.dtype(strDType).newbyteorder("<"), mode="r", offset=iOffset, shape=(iPairCount,)) if iPairCount else np.zeros(0, dtype=strDType)
+        if ( not lsSampleOrder ) or ( list(lsSampleOrder) == lsHeader ):
+            return (npaDistances,lsHeader)
+
+        #Precomputed index of the samples in the file
+        dictSampleIndex = dict([[sName, iIndex] for iIndex, sName in enumerate(lsHeader)])
+        lsMissing = [sName for sName in lsSampleOrder if not sName in dictSampleIndex]
+        if lsMissing:
+            print "".join(["Metric.funcReadBinaryMatrixFile. Error=Samples not in the matrix file ",", ".join([str(sName) for sName in lsMissing])])
+            return (False,False)
+        return (Metric.funcGetCondensedSubset(npaDistances, iSampleCount, [dictSampleIndex[sName] for sName in lsSampleOrder]),list(lsSampleOrder))
+
+    @staticmethod
+    def funcGetCondensedSubset(npaDistances, iSampleCount, liSamples):
+        """
+        Subsets and reorders a condensed distance matrix, without making the square matrix.
+
+        :param npaDistances:	Condensed distance matrix
+        :type:	Numpy array
+        :param iSampleCount:	Number of samples of the condensed matrix
+        :type:	Integer
+        :param liSamples:	Indices of the samples to keep, in the order to keep them
+        :type:	List of integers
+        :return	Numpy array:	Condensed distance matrix of the samples kept
+        """
+
+        npaSamples = np.asarray(liSamples, dtype=np.int64)
+        npaRows, npaColumns = np.triu_indices(len(npaSamples), 1)
+        npaFirst = np.minimum(npaSamples[npaRows], npaSamples[npaColumns])
+        npaSecond = np.maximum(npaSamples[npaRows], npaSamples[npaColumns])
+        npaIndices = npaFirst * iSampleCount - npaFirst * ( npaFirst + 1 ) // 2 + ( npaSecond - npaFirst - 1 )
+        #The same sample twice is at distance 0
+        if not len(npaDistances):
+            return np.zeros(len(npaIndices), dtype=npaDistances.dtype)
+        return np.where(npaFirst == npaSecond, 0, np.asarray(npaDistances)[np.where(npaFirst == npaSecond, 0, npaIndices)])
+
+#Data of the blocks of beta metrics measured by a process (see Metric.funcGetBlockedDissimilarity)
+dictDissimilarityBlockData = None
+
+def funcSetDissimilarityBlockData(dictData):
+    """
+    Sets the data of the blocks of beta metrics measured by a process, this initializes the processes of Metric.funcGetBlockedDissimilarity.
+    """
+
+    global dictDissimilarityBlockData
+    dictDissimilarityBlockData = dictData
+
+def funcMeasureDissimilarityBlock(lBlock):
+    """
+    Measures a block of sample pairs in a process of Metric.funcGetBlockedDissimilarity.
+    """
+
+    Metric._funcMeasureDissimilarityBlock(dictDissimilarityBlockData, lBlock)
@@ -33,9 +33,12 @@ __email__ = "ttickle@sph.harvard.edu"
 __status__ = "Development"
 
 #External libraries
+from AbundanceTableCache import AbundanceTableCache
+from ClassicalMDS import ClassicalMDS
 from ConstantsFiguresBreadCrumbs import ConstantsFiguresBreadCrumbs
 from cogent.cluster.nmds import NMDS
 import csv
+import hashlib
 import math
 
 import matplotlib
@@ -44,8 +47,8 @@ matplotlib.use("Agg")
 import matplotlib.cm as cm
 from Metric import Metric
 import numpy as np
+import scipy.sparse
 from scipy.spatial.distance import squareform
-from scipy.stats.stats import spearmanr
 from Utility import Utility
 from UtilityMath import UtilityMath
 from ValidateData import ValidateData
@@ -63,18 +66,47 @@ class PCoA:
 
     Supported beta diversity metrics include "braycurtis","canberra","chebyshev","cityblock","correlation",
 	"cosine","euclidean","hamming","sqeuclidean",unifrac_unweighted","unifrac_weighted"
+
+    The ordination is either non-metric multidimensional scaling (cogent's NMDS) or classical metric
+    scaling (ClassicalMDS, an eigendecomposition of the double centered distances with explained variance per axis).
     """
 
     #Supported distance metrics
     c_BRAY_CURTIS="B_Curtis"
     c_SPEARMAN="spearman"
 
+    #Ordination engines
+    c_strEngineNMDS="nmds"
+    c_strEngineClassical="classical"
+    lsEngines=[c_strEngineNMDS,c_strEngineClassical]
+
+    #Keys of saved ordinations (see funcSaveOrdination) other than the fit of the ordination
+    c_strOrdinationDimensions="dimensions"
+    c_strOrdinationIDs="ids"
+    c_strOrdinationMetric="metric"
+    c_strOrdinationFeatures="features"
+    c_strOrdinationReferenceData="reference_data"
+    c_strOrdinationReferenceIndices="reference_indices"
+    c_strOrdinationReferenceIndptr="reference_indptr"
+    c_strOrdinationReferenceShape="reference_shape"
+
+    #Kind of the cache entries of ordinations (see run) and the names of their arrays and header values
+    c_strCacheKind="PCoA"
+    c_strCacheDistances="Distances"
+    c_strCachePoints="Points"
+    c_strCacheStress="Stress"
+
     #Holds the data Matrix
     dataMatrix=None
     #Indicates if the data matrix is raw data (True) or a distance matrix (False)
     isRawData=None
     # Holds current matrix ids
     lsIDs = None
+    #Holds the feature names (columns) of raw data, new samples are matched to them when placed in the ordination
+    lsFeatures = None
+    #Identifies raw data loaded from an AbundanceTable [content hash, normalized, summed] to cache ordinations
+    #The hash is only computed when a run uses a cache (see _funcGetCacheKey)
+    lDataKey = None
 
     #Current pcoa object
     pcoa = None
@@ -112,13 +144,27 @@ class PCoA:
         and no conversion will occur in subsequent methods.
 
         :params xData: AbundanceTable or Distance matrix . Taxa (columns) by samples (rows)(lists)
+                       The distance matrix can be square, condensed or the path to a binary distance matrix file
+                       (see Metric.funcWriteBinaryMatrixFile), which also sets the sample ids.
         :type: AbundanceTable or DistanceMatrix
         :param fIsRawData: Indicates if the xData is an AbudanceTable (True) or distance matrix (False; numpy array)
         :type: boolean
         :return boolean: indicator of success (True=Was able to load data)
         """
 
-        if fIsRawData:
+        if fIsRawData and xData.funcIsSparse():
+            #Keep sparse tables sparse, samples (rows) by Taxa (columns)
+            data = xData.funcToSparseArray().T.tocsr()
+            if not data.nnz:
+                print("PCoA:loadData::Error when converting AbundanceTable to Array, did not perform PCoA.")
+                return False
+            self.dataMatrix=data
+            self.isRawData=fIsRawData
+            self.lsIDs=xData.funcGetMetadata(xData.funcGetIDMetadataName())
+            self.lsFeatures=xData.funcGetFeatureNames()
+            self.lDataKey=[None, xData.funcIsNormalized(), xData.funcIsSummed()]
+
+        elif fIsRawData:
             #Read in the file data to a numpy array.
             #Samples (column) by Taxa (rows)(lists) without the column
             data = xData.funcToArray()
@@ -135,21 +181,37 @@ class PCoA:
                 self.dataMatrix=data
                 self.isRawData=fIsRawData
                 self.lsIDs=xData.funcGetMetadata(xData.funcGetIDMetadataName())
+                self.lsFeatures=xData.funcGetFeatureNames()
+                self.lDataKey=[None, xData.funcIsNormalized(), xData.funcIsSummed()]
+
+        #Binary distance matrix files are memory-mapped
+        elif Metric.funcIsBinaryMatrixFile(xData):
+            data, lsIDs = Metric.funcReadBinaryMatrixFile(xData)
+            if data is False:
+                print("PCoA:loadData::Error when reading the binary distance matrix file, did not perform PCoA.")
+                return False
+            self.dataMatrix=data
+            self.isRawData=fIsRawData
+            self.lsIDs=lsIDs
+            self.lsFeatures=None
+            self.lDataKey=None
 
         #Otherwise load the data directly as passed.
         else:
             self.dataMatrix=xData
             self.isRawData=fIsRawData
+            self.lsFeatures=None
+            self.lDataKey=None
         return True
 
-    def run(self, tempDistanceMetric=None, iDims=2, strDistanceMatrixFile=None, istrmTree=None, istrmEnvr=None):
+    def run(self, tempDistanceMetric=None, iDims=2, strDistanceMatrixFile=None, istrmTree=None, istrmEnvr=None, strEngine=c_strEngineNMDS, strEigenSolver=ClassicalMDS.c_strEigenSolverDense, xCache=None):
         """
         Runs analysis on loaded data.
 
         :param tempDistanceMetric: The name of the distance metric to use when performing PCoA.
                                    None indicates a distance matrix was already given when loading and will be used.
                                    Supports "braycurtis","canberra","chebyshev","cityblock","correlation",
-				   "cosine","euclidean","hamming","sqeuclidean",unifrac_unweighted","unifrac_weighted"
+				   "cosine","euclidean","hamming","sqeuclidean","spearman",unifrac_unweighted","unifrac_weighted"
         :type: String Distance matrix name
         :param iDims: How many dimension to plot the PCoA graphs.
                       (This can be minimally 2; all combinations of dimensions are plotted).
@@ -161,9 +223,23 @@ class PCoA:
 	:type: String Path to file
 	:param istrmEnvr: One of two files needed for unifrac calculations, this is the environment file for the features.
 	:type: String Path to file
+	:param strEngine: Ordination engine, one of lsEngines (c_strEngineNMDS by default).
+	:type: String
+	:param strEigenSolver: Eigen solver of the classical engine, one of ClassicalMDS.lsEigenSolvers.
+	:type: String
+	:param xCache: Cache of distance matrices and ordinations of AbundanceTables (opt-in). Runs on a table with the same content,
+	               normalization and summation, with the same metric and ordination, reuse the cached results.
+	:type: AbundanceTableCache or String path of the cache directory
         :return boolean: Indicator of success (True)
         """
 
+        if not strEngine in self.lsEngines:
+            print("".join(["PCoA:run::Error, unknown ordination engine ",str(strEngine),"."]))
+            return False
+        if ( strEngine == self.c_strEngineClassical ) and ( not strEigenSolver in ClassicalMDS.lsEigenSolvers ):
+            print("".join(["PCoA:run::Error, unknown eigen solver ",str(strEigenSolver),"."]))
+            return False
+
         if iDims > 1:
             self._iDimensions = iDims
 
@@ -175,7 +251,7 @@ class PCoA:
                 print("PCoA:run::Error, no distance metric was specified but the previous load was not of a distance matrix.")
                 return False
             elif(ValidateData.funcIsFalse(self.isRawData)):
-                self.pcoa = NMDS(dataMatrix, verbosity=0)
+                self.pcoa = self._funcOrdinate(self.dataMatrix, strEngine, strEigenSolver)
                 return True
         
         #Make sure the distance metric was a valid string type
@@ -185,10 +261,15 @@ class PCoA:
 
         #Supported distances
 	
+        #Look for the distances and ordination of the same data, metric and ordination in the cache
+        cacheOrdination = AbundanceTableCache(xCache) if isinstance(xCache, str) else xCache
+        lCacheKey = self._funcGetCacheKey(tempDistanceMetric, strEngine, strEigenSolver) if cacheOrdination else None
+        lCached = cacheOrdination.funcLoadContent(lCacheKey) if lCacheKey else None
+
         distanceMatrix = None
-        if(tempDistanceMetric==self.c_SPEARMAN):
-            distanceMatrix = Metric().funcGetDissimilarity(ldSampleTaxaAbundancies=self.dataMatrix, funcDistanceFunction=lambda u,v: spearmanr(u,v)[0])
-        if(tempDistanceMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]):
+        if lCached:
+            distanceMatrix = lCached[0][self.c_strCacheDistances]
+        elif(tempDistanceMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]):
             distanceMatrix,lsLabels = Metric().funcGetBetaMetric(sMetric=tempDistanceMetric, istrmTree=istrmTree, istrmEnvr=istrmEnvr)
             self.lsIDs = lsLabels
         else:
@@ -198,6 +279,7 @@ class PCoA:
             return False
 
         # Make squareform
+        npaCondensed = distanceMatrix
         distanceMatrix = squareform(distanceMatrix)
 
         # Writes distance measures if needed.
@@ -210,14 +292,184 @@ class PCoA:
                 strId = [self.lsIDs[x]] if self.lsIDs else []
                 csvrDistance.writerow(strId+distanceMatrix[x].tolist())
 
-        self.pcoa = NMDS(distanceMatrix, dimension=max(self._iDimensions,2), verbosity=0)
+        if lCached:
+            self.pcoa = StoredOrdination(lCached[0][self.c_strCachePoints], lCached[1][self.c_strCacheStress]) if strEngine == self.c_strEngineNMDS else ClassicalMDS(dictFit=lCached[0])
+        else:
+            self.pcoa = self._funcOrdinate(distanceMatrix, strEngine, strEigenSolver)
+            if lCacheKey:
+                if strEngine == self.c_strEngineNMDS:
+                    dictArrays, dictHeader = {self.c_strCachePoints:self.pcoa.getPoints()}, {self.c_strCacheStress:self.pcoa.getStress()}
+                else:
+                    dictArrays, dictHeader = dict(self.pcoa.funcGetFit()), {}
+                dictArrays[self.c_strCacheDistances] = npaCondensed
+                cacheOrdination.funcStoreContent(lCacheKey, dictArrays, dictHeader)
         self.strRecentMetric = tempDistanceMetric
         return True
 
+    def _funcGetCacheKey(self, tempDistanceMetric, strEngine, strEigenSolver):
+        """
+        Returns what identifies the distances and ordination of a run in the cache (see run),
+        None if the run can not be cached (the data was not loaded from an AbundanceTable or the metric needs other files).
+
+        :return List: Cache key
+        """
+
+        if ( self.lDataKey is None ) or ( not ValidateData.funcIsTrue(self.isRawData) ) or ( tempDistanceMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted] ):
+            return None
+        if self.lDataKey[0] is None:
+            self.lDataKey[0] = self._funcGetDataHash()
+        return [self.c_strCacheKind]+list(self.lDataKey)+[tempDistanceMetric, max(self._iDimensions,2), strEngine,
+            strEigenSolver if strEngine == self.c_strEngineClassical else None]
+
+    def _funcGetDataHash(self):
+        """
+        Returns a hash of the loaded raw data (measurements, feature names and sample ids).
+        The loaded matrix is hashed, not the AbundanceTable, so changes to the table after loading do not change it.
+
+        :return String: Hexadecimal SHA1 digest
+        """
+
+        hashContent = hashlib.sha1()
+        hashContent.update(repr([list(self.lsFeatures), list(self.lsIDs or [])]))
+        if scipy.sparse.issparse(self.dataMatrix):
+            npaData = scipy.sparse.csr_matrix(self.dataMatrix, dtype=np.float64, copy=True)
+            npaData.sum_duplicates()
+            npaData.sort_indices()
+            for npaArray in [npaData.data, npaData.indices.astype(np.int64), npaData.indptr.astype(np.int64)]:
+                hashContent.update(np.ascontiguousarray(npaArray).data)
+        else:
+            hashContent.update(np.ascontiguousarray(self.dataMatrix, dtype=np.float64).data)
+        return hashContent.hexdigest()
+
+    def _funcOrdinate(self, distanceMatrix, strEngine, strEigenSolver):
+        """
+        Ordinates a distance matrix with the given engine (see run).
+
+        :param distanceMatrix: Square or condensed distance matrix
+        :type: Numpy array
+        :return Ordination: NMDS or ClassicalMDS object
+        """
+
+        if strEngine == self.c_strEngineClassical:
+            return ClassicalMDS(distanceMatrix, dimension=max(self._iDimensions,2), strEigenSolver=strEigenSolver)
+        return NMDS(squareform(distanceMatrix) if np.ndim(distanceMatrix) == 1 else distanceMatrix, dimension=max(self._iDimensions,2), verbosity=0)
+
+    def project(self, xData, fIsRawData=True):
+        """
+        Places new samples in the current (classical) ordination without changing it, from their distances to the
+        samples of the ordination (reference samples) only (see ClassicalMDS.funcProject).
+
+        :param xData: AbundanceTable of the new samples (measured with the metric of the ordination against the
+                      reference samples, features are matched by name and missing features are 0), or the distances of
+                      the new samples (rows) to the reference samples (columns, in the order of funcGetIDs).
+        :type: AbundanceTable or Numpy array
+        :param fIsRawData: Indicates if the xData is an AbundanceTable (True) or distances (False)
+        :type: boolean
+        :return Numpy array: Coordinates of the new samples (rows) on each dimension (columns), False on error.
+        """
+
+        if not isinstance(self.pcoa, ClassicalMDS):
+            print("PCoA:project::Error, new samples can only be placed in a classical ordination.")
+            return False
+
+        if fIsRawData:
+            if ( not ValidateData.funcIsTrue(self.isRawData) ) or ( self.lsFeatures is None ) or ( self.dataMatrix is None ):
+                print("PCoA:project::Error, the ordination was not made from an AbundanceTable so only distances can be placed.")
+                return False
+
+            #Samples (rows) by the features of the reference samples (columns)
+            npaSamples = xData.funcToSparseArray().T.tocsc() if xData.funcIsSparse() else np.asarray(xData.funcToArray()).T
+            dictFeatures = dict([[sFeature, iIndex] for iIndex, sFeature in enumerate(self.lsFeatures)])
+            liFrom = [iIndex for iIndex, sFeature in enumerate(xData.funcGetFeatureNames()) if sFeature in dictFeatures]
+            liTo = [dictFeatures[sFeature] for sFeature in xData.funcGetFeatureNames() if sFeature in dictFeatures]
+            npaAligned = np.zeros((npaSamples.shape[0], len(self.lsFeatures)))
+            npaAligned[:,liTo] = npaSamples[:,liFrom].toarray() if scipy.sparse.issparse(npaSamples) else npaSamples[:,liFrom]
+            xData = Metric.funcGetCrossDissimilarity(npaAligned, self.dataMatrix, self.strRecentMetric)
+            if xData is False:
+                print("PCoA:project::Error, when generating distances to the reference samples.")
+                return False
+
+        npaDistances = np.asarray(xData, dtype=float)
+        if ( not npaDistances.ndim == 2 ) or ( not npaDistances.shape[1] == len(self.pcoa.getPoints()) ):
+            print("".join(["PCoA:project::Error, distances to ",str(len(self.pcoa.getPoints()))," reference samples were expected, received ",str(npaDistances.shape),"."]))
+            return False
+        return self.pcoa.funcProject(npaDistances)
+
+    def funcSaveOrdination(self, strOrdinationFile):
+        """
+        Saves the current (classical) ordination, its reference sample ids, metric and (if made from an AbundanceTable)
+        the measurements of the reference samples so new samples can be placed later (see funcLoadOrdination and project).
+
+        :param strOrdinationFile: File to save to (numpy .npz)
+        :type: String
+        :return boolean: Indicator of success (True)
+        """
+
+        if not isinstance(self.pcoa, ClassicalMDS):
+            print("PCoA:funcSaveOrdination::Error, only classical ordinations can be saved.")
+            return False
+
+        dictArrays = dict(self.pcoa.funcGetFit())
+        dictArrays[self.c_strOrdinationDimensions] = np.array(self._iDimensions)
+        if self.lsIDs is not None:
+            dictArrays[self.c_strOrdinationIDs] = np.array(self.lsIDs)
+        if self.strRecentMetric is not None:
+            dictArrays[self.c_strOrdinationMetric] = np.array(self.strRecentMetric)
+        if ValidateData.funcIsTrue(self.isRawData) and ( self.lsFeatures is not None ):
+            dictArrays[self.c_strOrdinationFeatures] = np.array(self.lsFeatures)
+            if scipy.sparse.issparse(self.dataMatrix):
+                npaReference = scipy.sparse.csr_matrix(self.dataMatrix)
+                dictArrays.update({self.c_strOrdinationReferenceData:npaReference.data, self.c_strOrdinationReferenceIndices:npaReference.indices,
+                    self.c_strOrdinationReferenceIndptr:npaReference.indptr, self.c_strOrdinationReferenceShape:np.array(npaReference.shape)})
+            else:
+                dictArrays[self.c_strOrdinationReferenceData] = np.asarray(self.dataMatrix, dtype=float)
+        with open(strOrdinationFile, "wb") as ostmOut:
+            np.savez(ostmOut, **dictArrays)
+        return True
+
+    def funcLoadOrdination(self, strOrdinationFile):
+        """
+        Loads an ordination saved with funcSaveOrdination as the current ordination.
+
+        :param strOrdinationFile: File to load (numpy .npz)
+        :type: String
+        :return boolean: Indicator of success (True)
+        """
+
+        try:
+            dictArrays = np.load(strOrdinationFile)
+        except IOError as error:
+            print("".join(["PCoA:funcLoadOrdination::Error, could not read the ordination. ",str(error)]))
+            return False
+        with dictArrays:
+            lsKeys = dictArrays.files
+            self.pcoa = ClassicalMDS(dictFit=dictArrays)
+            self._iDimensions = int(dictArrays[self.c_strOrdinationDimensions])
+            self.lsIDs = dictArrays[self.c_strOrdinationIDs].tolist() if self.c_strOrdinationIDs in lsKeys else None
+            self.strRecentMetric = str(dictArrays[self.c_strOrdinationMetric]) if self.c_strOrdinationMetric in lsKeys else None
+            self.lsFeatures = dictArrays[self.c_strOrdinationFeatures].tolist() if self.c_strOrdinationFeatures in lsKeys else None
+            self.isRawData = not self.lsFeatures is None
+            self.dataMatrix = None
+            if self.c_strOrdinationReferenceShape in lsKeys:
+                self.dataMatrix = scipy.sparse.csr_matrix((dictArrays[self.c_strOrdinationReferenceData], dictArrays[self.c_strOrdinationReferenceIndices],
+                    dictArrays[self.c_strOrdinationReferenceIndptr]), shape=tuple(dictArrays[self.c_strOrdinationReferenceShape]))
+            elif self.c_strOrdinationReferenceData in lsKeys:
+                self.dataMatrix = dictArrays[self.c_strOrdinationReferenceData]
+        return True
+
     #TODO Test
     def funcGetCoordinates(self):
         return(self.pcoa.getPoints())
 
+    def funcGetExplainedVariance(self):
+        """
+        Returns the fraction of variance explained by each dimension, None when the ordination has none (NMDS).
+        """
+
+        if isinstance(self.pcoa, ClassicalMDS):
+            return self.pcoa.funcGetExplainedVariance()
+        return None
+
     #TODO Test
     def funcGetIDs(self):
         return(self.lsIDs)
@@ -263,9 +515,15 @@ class PCoA:
             iDimensionTwo = max(1,min(self._iDimensions-1, iDim2-1))
             adPoints = self.pcoa.getPoints()
 
-            #This is 1-stress which is the amount of variance not explained by all dimensions
-            #There is no precent variance, so I am trying this as a substitute
-            dPercentVariance = int((1.0-self.pcoa.getStress())*100)
+            #Classical ordinations explain a percent of the variance on each dimension
+            #NMDS has no precent variance, 1-stress (the amount of variance not explained by all dimensions) is used as a substitute
+            ldExplainedVariance = self.funcGetExplainedVariance()
+            if ldExplainedVariance is None:
+                strXLabel = "Dimension "+str(iDimensionOne+1)+" (1-Stress = "+str(int((1.0-self.pcoa.getStress())*100))+"% )"
+                strYLabel = "Dimension "+str(iDimensionTwo+1)
+            else:
+                strXLabel = "Dimension %d (%.1f%% variance)" % (iDimensionOne+1, ldExplainedVariance[iDimensionOne]*100)
+                strYLabel = "Dimension %d (%.1f%% variance)" % (iDimensionTwo+1, ldExplainedVariance[iDimensionTwo]*100)
             ldXPoints = list(adPoints[:,iDimensionOne])
             if not (self.ldForcedXAxis == None):
                 ldXPoints = self.ldForcedXAxis
@@ -347,8 +605,8 @@ class PCoA:
             #Color/Invert figure
             imgFigure.set_facecolor(self.objFigureControl.c_strBackgroundColorWord)
             imgSubplot = imgFigure.add_subplot(111,axisbg=self.objFigureControl.c_strBackgroundColorLetter)
-            imgSubplot.set_xlabel("Dimension "+str(iDimensionOne+1)+" (1-Stress = "+str(dPercentVariance)+"% )")
-            imgSubplot.set_ylabel("Dimension "+str(iDimensionTwo+1))
+            imgSubplot.set_xlabel(strXLabel)
+            imgSubplot.set_ylabel(strYLabel)
             imgSubplot.spines['top'].set_color(self.objFigureControl.c_strDetailsColorLetter)
             imgSubplot.spines['bottom'].set_color(self.objFigureControl.c_strDetailsColorLetter)
             imgSubplot.spines['left'].set_color(self.objFigureControl.c_strDetailsColorLetter)
@@ -806,3 +1064,28 @@ class PCoA:
             print("".join(["Error, PCoA.getShapes. Do not have enough shapes to give. Received request for ",str(intShapeCount)," shapes. Max available shape count is ",str(len(lsPointShapes)),"."]))
             return []
         return lsPointShapes[0:intShapeCount]
+
+class StoredOrdination:
+    """
+    Points and stress of a previous ordination (for example restored from a cache),
+    with the getPoints and getStress methods of cogent's NMDS.
+    """
+
+    def __init__(self, npaPoints, dStress):
+        """
+        Constructor
+
+        :param npaPoints: Coordinates of the samples (rows) on each dimension (columns)
+        :type: Numpy array
+        :param dStress: Stress of the ordination
+        :type: Double
+        """
+
+        self.npaPoints = np.asarray(npaPoints)
+        self.dStress = dStress
+
+    def getPoints(self):
+        return self.npaPoints
+
+    def getStress(self):
+        return self.dStress
@@ -154,3 +154,32 @@ class UtilityMath():
         conversionMatrix = [list(row)[fRemoveAdornments:] for row in npaMatrix]
         return np.array(conversionMatrix).transpose()
 
+
+    @staticmethod
+    def funcRankRows(npaMatrix):
+        """
+        Ranks the values of each row of a matrix (1 for the smallest value), tied values get the average of their ranks.
+
+        :param	npaMatrix:	Values to rank.
+        :type	Numpy Array	2-D array
+        :return	Numpy Array:	Ranks (float) in the shape of the matrix.
+        """
+
+        npaMatrix = np.asarray(npaMatrix)
+        iRows, iColumns = npaMatrix.shape
+        if not npaMatrix.size:
+            return np.zeros(npaMatrix.shape)
+        npaOrder = np.argsort(npaMatrix, axis=1, kind="mergesort")
+        npaRowIndices = np.arange(iRows)[:,np.newaxis]
+        npaSorted = npaMatrix[npaRowIndices, npaOrder]
+
+        #Group the tied values, each row starts a group
+        fStarts = np.ones(npaSorted.shape, dtype=bool)
+        fStarts[:,1:] = npaSorted[:,1:] != npaSorted[:,:-1]
+        npaGroups = np.cumsum(fStarts.ravel()) - 1
+        npaPositions = np.tile(np.arange(1.0, iColumns + 1), iRows)
+        npaGroupRanks = np.bincount(npaGroups, weights=npaPositions) / np.bincount(npaGroups)
+
+        npaRanks = np.empty(npaMatrix.shape)
+        npaRanks[npaRowIndices, npaOrder] = npaGroupRanks[npaGroups].reshape(npaMatrix.shape)
+        return npaRanks
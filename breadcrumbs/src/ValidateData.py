@@ -54,7 +54,7 @@ class ValidateData:
         """
 
         #Check to make sure it is not null
-        if parameterValue == None:
+        if parameterValue is None:
             return False
 
         #Check to make sure it is a string
@@ -104,12 +104,20 @@ class Tree:
 
     def load_lefse(self,inp_f):
         with open(inp_f, 'r') as inp:
-            rows = ["root."+l.rstrip().split("\t")[0] for l in inp.readlines()]
-        rows.append("root")
+            self.load_lefse_lines(inp)
+
+    def load_lefse_lines(self,lines):
+        rows = ["root."+l.rstrip().split("\t")[0] for l in lines]
+
+        # children of each clade in file order, a clade's children are taken
+        # (and so consumed) the first time the clade is added
+        children_of = {}
+        for r in rows:
+            children_of.setdefault(r.rsplit(".",1)[0],[]).append(r)
 
         self.opt['ignore_branch_len'] = 1
 
-        def rec_add(clade_name,rows,br_depth=0.0, first = False):
+        def rec_add(clade_name,br_depth=0.0, first = False):
             self.__all_taxa.add(clade_name)
             fn = clade_name if not clade_name.startswith("root.") \
                             else clade_name.split("root.")[1]
@@ -119,11 +127,7 @@ class Tree:
             cl = Tree.Clade(    clade_name, clade_name.split(".")[-1],1.0,
                                 br_depth+1.0, highlighted = highlighted, ext_seg = ext_seg, ext_seg_vec = ext_seg_v )
             self.add_clade(cl,fn,br_depth)
-            rows.remove(clade_name)
-            np = clade_name.count(".")
-            children = [r for r in rows if r.count(".") == np+1 and \
-                        r.count(".") > 0  and \
-                        ".".join(r.split(".")[:-1]) == clade_name]
+            children = children_of.pop(clade_name,[])
             if not children:
                 self.__leaves.append(cl)
                 if cl.root_br_dist > self.__max_br_depth:
@@ -133,7 +137,7 @@ class Tree:
                 cl.nleaves = 1
             nleav = len(self.__leaves)
             for c in children:
-                cl.add_child(rec_add(c,rows,br_depth+1.0 if not first else 0.0))
+                cl.add_child(rec_add(c,br_depth+1.0 if not first else 0.0))
             sep = 'sep_clades' in self.opt and self.opt['sep_clades']
             if sep and children and all([c.is_leaf for c in cl.get_children()]):
                 self.__leaves.insert(nleav,None)
@@ -142,7 +146,7 @@ class Tree:
 
             return cl
 
-        self.root = rec_add(rows[-1],rows, first = True)    
+        self.root = rec_add("root", first = True)
 
     def load_newick(self,inp_f):
         if os.path.splitext(inp_f)[-1] == '.nwk':
@@ -627,14 +631,19 @@ class Tree:
             plt.show()
    
     def read_highlights(self,highlights_file):
+        if not highlights_file: 
+            return self.set_highlights(None)
+        with open(highlights_file) as inp_f:
+            self.set_highlights(inp_f)
+
+    def set_highlights(self,lines):
         self.labels = {}
         self.label_color = {}
         self.label_cat = {}
-        if not highlights_file: 
+        if lines is None:
             return
-        with open(highlights_file) as inp_f:
-            labels = [l.rstrip().split('\t') 
-                    for l in inp_f.readlines() if not l.startswith("#")] 
+        labels = [l.rstrip().split('\t') 
+                    for l in lines if not l.startswith("#")] 
         for l in labels:
             self.labels[l[0]] = l[1] 
             self.label_cat[l[0]] = l[2]
@@ -644,12 +653,17 @@ class Tree:
                 self.label_color[l[0]] = self.colors[l[3]]
 
     def read_circles(self,circles_file):
-        self.cseg = {}
         if not circles_file: 
-            return
+            return self.set_circles(None)
         with open(circles_file) as inp_f:
-            mat = [l.rstrip().split('\t') 
-                    for l in inp_f.readlines() if not l.startswith("#")] 
+            self.set_circles(inp_f)
+
+    def set_circles(self,lines):
+        self.cseg = {}
+        if lines is None:
+            return
+        mat = [l.rstrip().split('\t') 
+                    for l in lines if not l.startswith("#")] 
         for m in mat:
             cv = []
             cs = []
@@ -668,22 +682,32 @@ class Tree:
             self.cseg[m[0]] = cv
 
     def read_sizes(self,size_file):
-        self.sizes = {}
         if not size_file: 
-            return
+            return self.set_sizes(None)
         with open(size_file) as inp_f:
-            rows = [l.rstrip().split('\t') 
-                    for l in inp_f.readlines() if not l.startswith("#")] 
+            self.set_sizes(inp_f)
+
+    def set_sizes(self,lines):
+        self.sizes = {}
+        if lines is None:
+            return
+        rows = [l.rstrip().split('\t') 
+                    for l in lines if not l.startswith("#")] 
         for l in rows:
             self.sizes["root."+l[0]] = float(l[1])
 
     def read_tick_labels(self,ticks_file):
-        self.tick_labels = {}
         if not ticks_file:
-            return
+            return self.set_tick_labels(None)
         with open(ticks_file) as inp_f:
-            labels = [l.rstrip().split('\t') 
-                        for l in inp_f.readlines() if not l.startswith("#")] 
+            self.set_tick_labels(inp_f)
+
+    def set_tick_labels(self,lines):
+        self.tick_labels = {}
+        if lines is None:
+            return
+        labels = [l.rstrip().split('\t') 
+                        for l in lines if not l.startswith("#")] 
         for l in labels:
             self.tick_labels[int(l[0])-1] = l[1] 
 
@@ -692,6 +716,12 @@ class Tree:
 
     def read_colors(self,colors_file):
         if not colors_file:
+            return self.set_colors(None)
+        with open(colors_file) as inp_f:
+            self.set_colors(inp_f)
+
+    def set_colors(self,lines):
+        if lines is None:
             self.opt = {}
             for c in self.default_colors:
                 self.opt[c] = c
@@ -699,17 +729,19 @@ class Tree:
 
         self.color_list = []
         self.colors = {}
-        with open(colors_file) as inp_f:
-            col = [l.rstrip().split('\t') 
-                    for l in inp_f.readlines() if not l.startswith("#")]
+        col = [l.rstrip().split('\t') 
+                    for l in lines if not l.startswith("#")]
         for c in col:
             self.color_list.append(c[0])
             self.colors[c[0]] = [float(cc)/255.0 for cc in c[1].split(',')]
 
     def read_style(self,style_file):
         with open(style_file) as inp_f:
-            self.opt = dict([(l.rstrip().split()[0],l.split("#")[0].split()[1:]) 
-                                for l in inp_f.readlines() 
+            self.set_style(inp_f)
+
+    def set_style(self,lines):
+        self.opt = dict([(l.rstrip().split()[0],l.split("#")[0].split()[1:]) 
+                                for l in lines 
                                     if l.strip() and not l.startswith("#")])
         for o in self.opt:
             try:
@@ -724,3 +756,25 @@ class Tree:
                         print "not a valid input",self.opt[o][0]
             self.opt[o] = v
 
+
+# Draws a cladogram from in-memory data: the tabular tree, colors, sizes, circles,
+# highlights and ticks are the lines of the corresponding circlader files (any
+# iterable of strings) or None, the style is either its lines or the options
+# already parsed by Tree.set_style (Tree.opt) which are copied
+def draw_cladogram( out_img, tree, style, colors = None, sizes = None,
+                    circles = None, highlights = None, ticks = None,
+                    outformat = None, dpi = 300 ):
+    cladogram = Tree()
+    cladogram.set_colors(colors)
+    if isinstance(style, dict):
+        cladogram.opt = dict(style)
+    else:
+        cladogram.set_style(style)
+    cladogram.set_sizes(sizes)
+    cladogram.set_circles(circles)
+    cladogram.set_highlights(highlights)
+    cladogram.set_tick_labels(ticks)
+    cladogram.load_lefse_lines(tree)
+    cladogram.pos_rad_leaves()
+    cladogram.set_pos()
+    cladogram.draw(out_img,outformat=outformat,dpi=dpi)